@@ -0,0 +1,82 @@
+"""
+等值物资计算器基准测试
+用法: python benchmarks/bench_calculator.py
+对比旧版逐数量复制组合的动态规划和新版单调队列有界背包在不同库存规模下的耗时
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from resource_calculator import ResourceValueCalculator
+
+RESOURCE_VALUES = {
+    '钻石': 8, '金币': 6, '木材': 2,
+    '矿石': 3, '食物': 1, '铁': 2
+}
+# 旧实现超过这个库存规模就太慢了，只测新实现
+LEGACY_MAX_SIZE = 40
+
+def legacy_calculate(resource_values, player_resources, target_value):
+    """旧版实现，仅用于对比"""
+    available_res = {
+        res: qty for res, qty in player_resources.items()
+        if qty > 0 and not res.startswith('保留')
+    }
+    dp = defaultdict(list)
+    dp[0] = [{}]
+    for res, max_qty in available_res.items():
+        res_value = resource_values[res]
+        current_dp = list(dp.items())
+        for value, combos in current_dp:
+            for qty in range(1, max_qty + 1):
+                new_value = value + res_value * qty
+                new_combo = [{
+                    **combo,
+                    res: combo.get(res, 0) + qty
+                } for combo in combos]
+                if new_value not in dp or len(new_combo[0]) < len(dp[new_value][0]):
+                    dp[new_value] = new_combo
+    valid_combinations = []
+    for value, combos in dp.items():
+        if value >= target_value:
+            for combo in combos:
+                valid_combinations.append({
+                    'resources': combo,
+                    'total_value': value,
+                    'difference': value - target_value
+                })
+    return sorted(valid_combinations, key=lambda x: (x['difference'], len(x['resources'])))
+
+def timeit(func, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    calc = ResourceValueCalculator(RESOURCE_VALUES)
+    # 目标价值分别对应 建造无敌农场(8金币) 和 海盗掠夺(3金币)
+    targets = [8 * RESOURCE_VALUES['金币'], 3 * RESOURCE_VALUES['金币']]
+    rows = []
+    for size in [5, 10, 20, 40, 100, 300, 1000]:
+        inventory = {res: size for res in RESOURCE_VALUES}
+        for target in targets:
+            new = timeit(calc.best_combination, inventory, target)
+            top10 = timeit(calc.calculate_equivalent_resources, inventory, target, 10)
+            if size <= LEGACY_MAX_SIZE:
+                old = timeit(legacy_calculate, RESOURCE_VALUES, inventory, target, repeat=1)
+                speedup = f"{old / new:.0f}x"
+                old = f"{old * 1000:.3f}"
+            else:
+                old, speedup = '-', '-'
+            rows.append([size, target, old, f"{new * 1000:.3f}", f"{top10 * 1000:.3f}", speedup])
+    print(tabulate(rows, headers=["每种资源数量", "目标价值", "旧版(ms)", "新版最优(ms)", "新版前10(ms)", "加速比"]))
+
+if __name__ == '__main__':
+    main()
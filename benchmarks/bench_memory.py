@@ -0,0 +1,98 @@
+"""
+房间内存基准测试
+用法: python benchmarks/bench_memory.py [--rooms 200]
+用 tracemalloc 测量一次性建好 --rooms 个房间多占用的内存，除以房间数得到每个房间的字节数：
+    规则状态   rules.GameState，模拟器和重放工具用的就是它
+    服务器房间 server.Game，包括排行榜、消息分发器等服务器自己的结构（不含连接）
+每个房间按人数坐满玩家，开局并跑到第3轮投资阶段，玩家的库存和建筑和 bench_server 的房间相同。
+另外测量 GameState.copy() 复制一个房间的耗时和复制出来的状态占用的内存
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rules
+import server
+from bench_server import PLAYER_COUNTS, NullConnection, make_inventory
+
+def fill(state:rules.GameState, players:int, new_player, seed:int):
+    rng = random.Random(seed)
+    for i in range(players):
+        player = new_player()
+        state.players[f'player{i}'] = player
+        player.resources.update(make_inventory(50, rng))
+        player.buildings.extend(rng.sample(rules.ALL_BUILDINGS, 3))
+        player.bank_money = rng.randint(0, 50)
+    rules.start_game(state)
+    for _ in range(2):
+        for phase in server.PHASES:
+            rules.enter_phase(state, phase)
+        rules.end_epoch(state)
+    rules.enter_phase(state, 1)
+    return state
+
+def rules_room(players:int, seed:int):
+    return fill(rules.GameState(rng=random.Random(seed)), players, rules.PlayerState, seed)
+
+def server_room(players:int, seed:int):
+    game = server.Game(f'mem-{players}-{seed}', seed=seed)
+    fill(game.state, players, lambda: server.Player(ws=NullConnection()), seed)
+    return game
+
+def bytes_per_room(factory, players:int, rooms:int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    kept = [factory(players, seed) for seed in range(rooms)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del kept
+    return used / rooms
+
+def copy_cost(players:int, rooms:int):
+    """:return: (单次 copy() 的耗时, 每份副本占用的字节数)，GameState 没有 copy() 时为 None"""
+    state = rules_room(players, 0)
+    if not hasattr(state, 'copy'):
+        return None
+    loops = 2000
+    start = time.perf_counter()
+    for _ in range(loops):
+        state.copy()
+    elapsed = (time.perf_counter() - start) / loops
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    copies = [state.copy() for _ in range(rooms)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del copies
+    return elapsed, used / rooms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=200, help='每种情况建多少个房间取平均')
+    args = parser.parse_args()
+
+    rows = []
+    for players in PLAYER_COUNTS:
+        rules_bytes = bytes_per_room(rules_room, players, args.rooms)
+        server_bytes = bytes_per_room(server_room, players, args.rooms)
+        row = [players, f"{rules_bytes:.0f}", f"{rules_bytes / players:.0f}",
+               f"{server_bytes:.0f}", f"{server_bytes / players:.0f}"]
+        copied = copy_cost(players, args.rooms)
+        row += ['-', '-'] if copied is None else [f"{copied[0] * 1e6:.1f}", f"{copied[1]:.0f}"]
+        rows.append(row)
+        server.rooms.rooms.clear()
+    print(tabulate(rows, headers=["人数", "规则状态(字节)", "每个玩家", "服务器房间(字节)", "每个玩家",
+                                  "copy()(us)", "副本(字节)"]))
+
+if __name__ == '__main__':
+    main()
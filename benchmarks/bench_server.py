@@ -0,0 +1,242 @@
+"""
+服务器热点函数基准测试
+用法:
+    python benchmarks/bench_server.py                     运行并打印结果
+    python benchmarks/bench_server.py --save              运行并把结果保存为基线 benchmarks/baseline.json
+    python benchmarks/bench_server.py --compare           运行并和基线对比，有用例变慢超过阈值时返回非0
+    python benchmarks/bench_server.py -k calculator       只运行名字里包含 calculator 的用例
+规则相关的用例测的是 rules.py 里的对应函数（服务器的 _draw_cards 等已经移到规则核心）。
+每个用例按库存规模、牌堆大小、玩家人数参数化，取多轮中最快一轮的单次平均耗时。
+随机数种子固定，同一台机器上多次运行的结果可以直接比较
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rules
+import server
+from resource_calculator import ResourceValueCalculator
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+REPEAT = 5
+# 每轮至少跑这么久，太快的用例自动加大循环次数
+MIN_ROUND_TIME = 0.05
+
+INVENTORY_SIZES = [5, 50, 500]          # 每种资源的数量
+DECK_SIZES = [100, 1000, 10000]         # 牌堆总张数
+PLAYER_COUNTS = [2, 5, 50]              # 房间人数
+DEADLINE_COUNTS = [10, 10000, 50000]    # 所有房间等待中的截止时间数
+
+class NullConnection:
+    """丢弃所有消息的连接，只测服务端自身的开销"""
+    closed = False
+
+    def send_message(self, message, droppable=False):
+        pass
+
+    async def send_json(self, data, droppable=False):
+        pass
+
+    def close_nowait(self, code=1000, reason=''):
+        pass
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+def make_inventory(size:int, rng:random.Random):
+    return {res: rng.randint(size // 2, size) for res in rules.ALL_RESOURCES}
+
+def make_game(players:int=2, inventory:int=10, seed:int=0) -> server.Game:
+    rng = random.Random(seed)
+    game = server.Game(f'bench-{players}-{inventory}')
+    for i in range(players):
+        player = server.Player(ws=NullConnection())
+        player.resources.update(make_inventory(inventory, rng))
+        player.buildings.extend(rng.sample(rules.ALL_BUILDINGS, 3))
+        player.bank_money = rng.randint(0, 50)
+        game.state.players[f'player{i}'] = player
+    game.state.market.extend(rng.choices(rules.ALL_RESOURCES, k=20))
+    game.state.epoch = 3
+    return game
+
+def scaled_ruleset(size:int) -> rules.Ruleset:
+    deck = rules.DEFAULT_RULESET.resource_deck
+    total = sum(deck.values())
+    return dataclasses.replace(rules.DEFAULT_RULESET, resource_deck={
+        card: max(1, count * size // total) for card, count in deck.items()})
+
+async def measure(func, *args):
+    """
+    func 可以是普通函数，也可以返回协程（协程函数或返回协程的 lambda）
+    :return: 单次调用耗时（秒），取 REPEAT 轮中最快的一轮
+    """
+    async def round_time(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            result = func(*args)
+            if asyncio.iscoroutine(result):
+                await result
+        return time.perf_counter() - start
+
+    loops = 1
+    while (elapsed := await round_time(loops)) < MIN_ROUND_TIME:
+        loops *= 2
+    best = elapsed
+    for _ in range(REPEAT - 1):
+        best = min(best, await round_time(loops))
+    return best / loops
+
+def endpoint(path:str):
+    for route in server.app.routes:
+        if getattr(route, 'path', None) == path:
+            return route.endpoint
+    raise KeyError(path)
+
+async def call_handler(handler, **kwargs):
+    """调用路由函数并按 FastAPI 的方式编码返回值，不包含HTTP协议本身的开销"""
+    result = await handler(**kwargs)
+    if isinstance(result, Response):
+        # 路由自己编码好的响应，FastAPI 原样返回
+        return result.body
+    return server.app.router.default_response_class(jsonable_encoder(result)).body
+
+async def bench_calculator():
+    values = server.GameState().resource_values
+    calc = ResourceValueCalculator(values)
+    rng = random.Random(1)
+    for size in INVENTORY_SIZES:
+        inventory = make_inventory(size, rng)
+        for target in (3 * values['金币'], 8 * values['金币']):
+            yield f'calculator[inv={size},target={target}]', (
+                calc.calculate_equivalent_resources, inventory, target)
+
+async def bench_deck():
+    for size in DECK_SIZES:
+        state = make_game().state
+        state.ruleset = scaled_ruleset(size)
+        yield f'shuffle_deck[deck={size}]', (rules.shuffle_deck, state)
+        rules.shuffle_deck(state)
+        # 抽空后会自动重新洗牌，和游戏中的行为一致
+        yield f'draw_cards[deck={size},n=20]', (rules.draw_cards, state, 20)
+
+async def bench_check_can_build():
+    for size in INVENTORY_SIZES:
+        state = make_game(inventory=size).state
+        for building in ('铁镐', '农场'):
+            yield f'check_can_build[inv={size},{building}]', (
+                rules.build_plan, state, 'player0', building)
+        # 所有建筑一起查询；cold 每次先清空方案缓存，测的是那一次背包本身
+        yield f'build_options[inv={size}]', (rules.build_options, state, 'player0')
+        book = state.ruleset.recipe_book
+        yield f'build_options[inv={size},cold]', (
+            lambda: (book._plans.clear(), rules.build_options(state, 'player0')),)
+
+async def bench_update_values():
+    for players in PLAYER_COUNTS:
+        state = make_game(players=players).state
+        rng = random.Random(2)
+        for res in rules.ALL_RESOURCES:
+            state.tmp_cnt_take[res] = rng.choice([0, 2, 6])
+        yield f'update_resource_values[players={players}]', (rules.update_resource_values, state)
+
+async def bench_handlers():
+    state = endpoint('/game/{room}/state')
+    playerinfo = endpoint('/playerinfo/{room}/{player}')
+    leaderboard = endpoint('/game/{room}/leaderboard')
+    for players in PLAYER_COUNTS:
+        game = make_game(players=players, inventory=50)
+        server.rooms.rooms[game.room_id] = game
+        try:
+            yield f'GET /game/state[players={players}]', (lambda: call_handler(state, room=game.room_id),)
+            yield f'GET /playerinfo[players={players}]', (
+                lambda: call_handler(playerinfo, room=game.room_id, player='player0'),)
+            yield f'GET /game/leaderboard[players={players}]', (
+                lambda: call_handler(leaderboard, room=game.room_id),)
+        finally:
+            del server.rooms.rooms[game.room_id]
+
+async def bench_deadlines():
+    """已经有 pending 个截止时间在等待时，设置再取消一个截止时间（每个阶段的正常情况）"""
+    for pending in DEADLINE_COUNTS:
+        scheduler = server.DeadlineScheduler()
+        waiting = [scheduler.schedule(3600 + i, lambda: None) for i in range(pending)]
+        yield f'deadline_schedule_cancel[pending={pending}]', (
+            lambda: scheduler.schedule(60, lambda: None).cancel(),)
+        for deadline in waiting:
+            deadline.cancel()
+
+async def bench_process_command():
+    for cmd in ('/kick player0 bye', '/give player0 金币 100', '/build player0 伐木场', 'hello'):
+        yield f'process_command[{cmd.split()[0]}]', (server.process_command, cmd)
+
+SUITES = [bench_calculator, bench_deck, bench_check_can_build, bench_update_values,
+          bench_handlers, bench_deadlines, bench_process_command]
+
+async def run(keyword:str=None):
+    results = {}
+    for suite in SUITES:
+        # 用例以 (名字, (函数, 参数...)) 的形式产出，测量在产出处暂停时进行，套件里准备好的环境仍然有效
+        async for name, (func, *args) in suite():
+            if keyword is None or keyword in name:
+                results[name] = await measure(func, *args)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='把结果保存为基线')
+    parser.add_argument('--compare', action='store_true', help='和基线对比')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=1.5, help='比基线慢多少倍算退化')
+    parser.add_argument('-k', dest='keyword', help='只运行名字包含该字符串的用例')
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = asyncio.run(run(args.keyword))
+    baseline = {}
+    if args.compare:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    rows, regressed = [], []
+    for name, seconds in results.items():
+        row = [name, f"{seconds * 1e6:.2f}"]
+        if args.compare:
+            base = baseline.get(name)
+            if base is None:
+                row += ['-', '新增']
+            else:
+                ratio = seconds / base
+                row += [f"{base * 1e6:.2f}", f"{ratio:.2f}x"]
+                if ratio > args.threshold:
+                    regressed.append(name)
+        rows.append(row)
+    headers = ["用例", "耗时(us)"] + (["基线(us)", "对比"] if args.compare else [])
+    print(tabulate(rows, headers=headers))
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+    if regressed:
+        print(f"\n{len(regressed)} 个用例比基线慢 {args.threshold} 倍以上:")
+        for name in regressed:
+            print("  " + name)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+消息编码基准测试
+用法: python benchmarks/bench_wire.py
+用服务器实际推送的消息（不同人数下的完整状态、一个玩家变化的增量、阶段通知、/submit 回复）
+比较标准库 json、orjson（现在的 JSON 编码，见 wire.JSON）和协商后的 msgpack（wire.MSGPACK）的
+消息大小、编码耗时和解码耗时，另外测 /game/state 和 /playerinfo 两种响应方式的编码耗时
+"""
+import json
+import os
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+import wire
+from bench_server import PLAYER_COUNTS, make_game
+
+REPEAT = 5
+MIN_ROUND_TIME = 0.05
+
+def measure(func, *args) -> float:
+    """:return: 单次调用耗时（秒），取 REPEAT 轮中最快的一轮"""
+    def round_time(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(*args)
+        return time.perf_counter() - start
+
+    loops = 1
+    while (elapsed := round_time(loops)) < MIN_ROUND_TIME:
+        loops *= 2
+    return min([elapsed] + [round_time(loops) for _ in range(REPEAT - 1)]) / loops
+
+def stdlib_dumps(data) -> str:
+    """改用 orjson 之前的编码方式"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+CODECS = [
+    ("json", stdlib_dumps, json.loads),
+    ("orjson", wire.JSON.encode, wire.JSON.decode),
+]
+if wire.MSGPACK is not None:
+    CODECS.append(("msgpack", wire.MSGPACK.encode, wire.MSGPACK.decode))
+
+def payloads():
+    """(名字, 消息)，内容取自 bench_server 构造的房间，和服务器推送的格式一致"""
+    for players in PLAYER_COUNTS:
+        game = make_game(players=players, inventory=50)
+        state = json.loads(stdlib_dumps(game.state.to_dict()))
+        yield f"完整状态[players={players}]", {"type": "state", "target": {"type": "full", "state": state}}
+        name = next(iter(state["players"]))
+        yield f"增量[players={players}]", {"type": "state", "target": {
+            "type": "delta", "base": 1, "version": 2,
+            "changes": {"players": {name: state["players"][name]}, "leaderboard": state["leaderboard"]}}}
+    yield "阶段通知", {"type": "notify", "target": {"type": "phase_changed", "epoch": 3, "phase": -2}}
+    yield "/submit 回复", {"type": "notify", "target": {
+        "type": "investment_success", "player": "player0", "action": {"3": "高级伐木场"}}}
+
+def bench_codecs():
+    rows = []
+    for name, message in payloads():
+        row = [name]
+        for _, encode, decode in CODECS:
+            frame = encode(message)
+            size = len(frame.encode() if isinstance(frame, str) else frame)
+            row += [size, f"{measure(encode, message) * 1e6:.2f}", f"{measure(decode, frame) * 1e6:.2f}"]
+        rows.append(row)
+    headers = ["消息"] + [f"{codec}{column}" for codec, _, _ in CODECS for column in ("字节", "编码(us)", "解码(us)")]
+    print(tabulate(rows, headers=headers))
+
+def bench_responses():
+    """同一个返回值：FastAPI 默认的 jsonable_encoder + JSONResponse，和直接返回 ORJSONResponse"""
+    rows = []
+    for players in PLAYER_COUNTS:
+        state = make_game(players=players, inventory=50).state
+        player = state.players['player0']
+        bodies = {
+            f"/game/state[players={players}]": {
+                "market": state.market.to_list(), "epoch": state.epoch, "phase": state.phase,
+                "players": list(state.players), "values": state.resource_values, "started": state.started},
+            f"/playerinfo[players={players}]": {
+                "action_points": player.action_points, "resources": player.resources.to_dict(),
+                "buildings": player.buildings.to_list(), "bank_money": player.bank_money},
+        }
+        for name, body in bodies.items():
+            before = measure(lambda: JSONResponse(jsonable_encoder(body)).body)
+            after = measure(lambda: ORJSONResponse(body).body)
+            rows.append([name, f"{before * 1e6:.2f}", f"{after * 1e6:.2f}", f"{before / after:.1f}x"])
+    print(tabulate(rows, headers=["响应", "JSONResponse(us)", "ORJSONResponse(us)", "加速"]))
+
+def main():
+    bench_codecs()
+    print()
+    bench_responses()
+    server.rooms.rooms.clear()
+
+if __name__ == '__main__':
+    main()
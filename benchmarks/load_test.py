@@ -0,0 +1,130 @@
+"""
+压测工具：在本地服务器上同时跑很多房间的机器人对局
+用法: python benchmarks/load_test.py --server 127.0.0.1:8000 --rooms 500 --strategy random
+每个房间的人数取服务器的 RSIPLAYERS 设置，所有对局结束后输出：
+    各阶段从 phase_changed 到下一次 phase_changed 的耗时分位数
+    /submit 往返耗时分位数
+    每秒消息数（收到的WebSocket消息 + 发出的 /submit 请求），WebSocket消息的平均大小
+    压测期间服务器进程的CPU占用
+--protocol msgpack 让机器人协商二进制编码（见 wire.py），用来和默认的 JSON 比较
+--batch 让机器人把每轮的投资操作合并成一次 /submit，用来和逐条提交比较请求数和投资阶段耗时
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import aiohttp
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bots import STRATEGIES, Bot
+
+PHASE_NAMES = {1: '投资', 2: '竞标', -2: '拿取', 3: '价值更新', 4: '事件'}
+
+def percentile(sorted_values, pct):
+    """最近秩分位数，sorted_values 需已排序且非空"""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return [0, '-', '-', '-', '-']
+    return [len(values)] + [f"{percentile(values, pct) * 1000:.1f}" for pct in (50, 90, 99, 100)]
+
+class LoadTest:
+    def __init__(self, server_addr:str, rooms:int, strategy:str, ramp:int, protocol:str='json',
+                 batch:bool=False):
+        self.server_addr = server_addr
+        self.protocol = protocol
+        self.batch = batch
+        self.rooms = rooms
+        self.strategy = STRATEGIES[strategy]
+        self.ramp = ramp
+        self.run_id = uuid.uuid4().hex[:6]
+        self.bots = []
+        # 房间 -> [(时间, 阶段)]，同一房间的每次阶段切换只记第一个收到的机器人
+        self.phase_events = defaultdict(list)
+        self._seen = set()
+
+    def _on_phase(self, bot:Bot, epoch:int, phase:int):
+        key = (bot.room, epoch, phase)
+        if key not in self._seen:
+            self._seen.add(key)
+            self.phase_events[bot.room].append((time.perf_counter(), phase))
+
+    async def _stats(self, session:aiohttp.ClientSession):
+        async with session.get(f"http://{self.server_addr}/stats") as resp:
+            return await resp.json()
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            before = await self._stats(session)
+            players = before['players_per_room']
+            start = time.perf_counter()
+            tasks = []
+            for i in range(self.rooms):
+                for j in range(players):
+                    bot = Bot(session, self.server_addr, f"load-{self.run_id}-{i}", f"bot{j}",
+                              self.strategy(), on_phase=self._on_phase, protocol=self.protocol,
+                              batch=self.batch)
+                    self.bots.append(bot)
+                    tasks.append(asyncio.create_task(bot.run()))
+                    # 控制建立连接的速度，避免瞬间打满 accept 队列
+                    if len(tasks) % self.ramp == 0:
+                        await asyncio.sleep(1)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            after = await self._stats(session)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        self.report(elapsed, before, after, failures)
+
+    def report(self, elapsed:float, before:dict, after:dict, failures:list):
+        durations = defaultdict(list)
+        for events in self.phase_events.values():
+            for (t0, phase), (t1, _) in zip(events, events[1:]):
+                durations[phase].append(t1 - t0)
+        headers = ["阶段", "次数", "p50(ms)", "p90(ms)", "p99(ms)", "max(ms)"]
+        table = [[PHASE_NAMES[phase]] + summarize(values) for phase, values in durations.items()]
+        table.append(["/submit"] + summarize([x for bot in self.bots for x in bot.submit_latencies]))
+        print(tabulate(table, headers=headers))
+
+        received = sum(bot.received for bot in self.bots)
+        received_bytes = sum(bot.received_bytes for bot in self.bots)
+        submitted = sum(bot.submitted for bot in self.bots)
+        cpu = (after['cpu_time'] - before['cpu_time']) / (after['uptime'] - before['uptime'])
+        print()
+        print(tabulate([
+            ["机器人", len(self.bots)],
+            ["完成对局的机器人", sum(bot.finished for bot in self.bots)],
+            ["中途死亡的机器人", sum(bot.died for bot in self.bots)],
+            ["连接异常", len(failures)],
+            ["错误回复", sum(bot.errors for bot in self.bots)],
+            ["总耗时(s)", f"{elapsed:.1f}"],
+            ["WebSocket消息/s", f"{received / elapsed:.0f}"],
+            ["WebSocket平均消息字节", f"{received_bytes / max(received, 1):.0f}"],
+            ["/submit 请求数", submitted],
+            ["/submit 请求/s", f"{submitted / elapsed:.0f}"],
+            ["服务器CPU", f"{cpu * 100:.0f}%"],
+        ]))
+        for failure in failures[:5]:
+            print(repr(failure))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', default='127.0.0.1:8000')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random')
+    parser.add_argument('--ramp', type=int, default=500, help='每秒最多新建多少个机器人连接')
+    parser.add_argument('--protocol', choices=['json', 'msgpack'], default='json', help='WebSocket 消息的编码')
+    parser.add_argument('--batch', action='store_true', help='投资操作合并成一次 /submit 提交')
+    args = parser.parse_args()
+    asyncio.run(LoadTest(args.server, args.rooms, args.strategy, args.ramp, args.protocol, args.batch).run())
+
+if __name__ == '__main__':
+    main()
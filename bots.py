@@ -0,0 +1,229 @@
+"""
+无界面机器人客户端和机器人策略
+和 client.py 走同样的协议：WebSocket 加入房间接收通知和状态推送，各阶段通过 /submit 提交操作。
+每个阶段提交什么由策略对象决定，策略只读取 rules.GameState，
+所以同一个策略既能接到服务器上压测（benchmarks/load_test.py），也能在模拟器（simulate.py）里直接跑
+"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+import orjson
+
+import rules
+import wire
+from state_replica import StateReplica
+
+# /submit 在服务端最多等待10秒回复
+SUBMIT_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+class Strategy:
+    """
+    机器人策略，根据当前状态决定每个阶段的操作，不能修改 state
+    :param rng: 策略自己的随机数来源，模拟器传入带种子的生成器以便复现
+    """
+    name = 'base'
+
+    def __init__(self, rng:random.Random=None):
+        self.rng = rng or random.Random()
+
+    def investment(self, state:rules.GameState, player:str) -> List:
+        """投资阶段依次提交的操作，不需要带最后的 'ok'"""
+        return []
+
+    def bid(self, state:rules.GameState, player:str) -> int:
+        """竞标出价，0 表示不参与"""
+        return 0
+
+    def wants(self, state:rules.GameState, player:str) -> List[int]:
+        """竞标成功后依次拿取的市场下标，不需要带最后的 'ok'"""
+        return []
+
+class PassiveStrategy(Strategy):
+    """什么都不做，每个阶段直接结束，用来测协议和阶段切换本身的开销"""
+    name = 'passive'
+
+class RandomStrategy(Strategy):
+    """按当前行动点和资源随机做一些一定合法的操作（兑换、探索、出价、拿取）"""
+    name = 'random'
+
+    def investment(self, state, player):
+        me = state.players[player]
+        # 每轮只能兑换一次，有农场的玩家不能兑换
+        can_exchange = me.resources['食物'] > 0 and not ('农场' in me.buildings or '无敌农场' in me.buildings)
+        exchanges = self.rng.randint(0, 1) if can_exchange else 0
+        points = me.action_points + 3 * exchanges
+        explores = self.rng.randint(0, min(3, points))
+        return ['2'] * exchanges + ['1'] * explores
+
+    def bid(self, state, player):
+        points = state.players[player].action_points
+        if not state.market or not points:
+            return 0
+        return self.rng.randint(0, min(2, points))
+
+    def wants(self, state, player):
+        if not state.market:
+            return []
+        # 拿走一个后后面的下标会前移，只拿一个
+        return [self.rng.randrange(len(state.market))]
+
+class BuilderStrategy(Strategy):
+    """每轮优先建造一个还没有的收益建筑，留够过饥荒的食物，出价1拿市场上最值钱的物品"""
+    name = 'builder'
+    PRIORITY = ['农场', '炮台', '铁镐', '伐木场', '银行', '无敌农场', '高级伐木场']
+
+    def investment(self, state, player):
+        me = state.players[player]
+        actions = []
+        points = me.action_points
+        if me.resources['食物'] > 3 and not ('农场' in me.buildings or '无敌农场' in me.buildings):
+            actions.append('2')
+            points += 3
+        # 建造方案按提交前的状态计算，所以每轮只建一个
+        options = rules.build_options(state, player) if points >= 3 else {}
+        for building in self.PRIORITY:
+            if building not in me.buildings and options.get(building) is not None:
+                actions.append({'3': building})
+                points -= 3
+                break
+        return actions + ['1'] * min(points, 2)
+
+    def bid(self, state, player):
+        return 1 if state.market and state.players[player].action_points else 0
+
+    def wants(self, state, player):
+        if not state.market:
+            return []
+        values = state.resource_values
+        return [max(range(len(state.market)), key=lambda i: values[state.market[i]])]
+
+STRATEGIES = {cls.name: cls for cls in (PassiveStrategy, RandomStrategy, BuilderStrategy)}
+
+class Bot:
+    """
+    一个机器人玩家
+    :param session: 共享的 aiohttp 会话，上千个机器人共用一个连接池
+    :param on_phase: 收到 phase_changed 时的回调 (bot, epoch, phase)，压测工具用来统计阶段耗时
+    :param protocol: WebSocket 消息的编码，'json' 或 'msgpack'（见 wire.py）
+    :param batch: 投资阶段的全部操作连同 'ok' 放在一次 /submit 里提交
+    """
+    def __init__(self, session:aiohttp.ClientSession, server_addr:str, room:str, name:str,
+                 strategy:Strategy, on_phase=None, protocol:str='json', batch:bool=False):
+        self.session = session
+        self.room = room
+        self.name = name
+        self.strategy = strategy
+        self.on_phase = on_phase
+        self.protocol = protocol
+        self.batch = batch
+        self.wsurl = f"ws://{server_addr}/ws/{room}/{name}"
+        self.submiturl = f"http://{server_addr}/submit/{room}/{{}}/{name}/"
+        self.snapurl = f"http://{server_addr}/game/{room}/snapshot"
+        self.replica = StateReplica()
+        self.received = 0           # 收到的WebSocket消息数
+        self.received_bytes = 0     # 收到的WebSocket消息的总字节数（不含帧头）
+        self.submitted = 0          # 发出的 /submit 请求数
+        self.errors = 0             # 服务器返回的 error 回复数
+        self.submit_latencies = []  # 每次 /submit 的往返耗时（秒）
+        self.finished = False       # 是否正常收到 game_over
+        self.died = False           # 是否在事件中死亡
+        self._phase_task: Optional[asyncio.Task] = None
+        self._posts = set()         # 已经发出、还没收到回复的 /submit 请求
+
+    def _view(self) -> rules.GameState:
+        return rules.load_state(self.replica.state)
+
+    async def _resync(self):
+        """增量版本不连续时重新拉取完整快照"""
+        async with self.session.get(self.snapurl) as resp:
+            if resp.status == 200:
+                self.replica.load(await resp.json(loads=orjson.loads))
+
+    async def submit(self, kind:str, data:Dict) -> Dict:
+        """
+        阶段任务被取消时已经发出的请求照常等回复并计入统计，
+        否则结束阶段的那些（通常也是最慢的）请求全被漏掉，压测的请求数和延迟分位数都会偏低
+        """
+        post = asyncio.create_task(self._post(kind, data))
+        self._posts.add(post)
+        post.add_done_callback(self._posts.discard)
+        return await asyncio.shield(post)
+
+    async def _post(self, kind:str, data:Dict) -> Dict:
+        body = {"type": kind, "data": {"player": self.name, **data}}
+        start = time.perf_counter()
+        async with self.session.post(self.submiturl.format(kind), json=body, timeout=SUBMIT_TIMEOUT) as resp:
+            reply = await resp.json(loads=orjson.loads)
+        self.submit_latencies.append(time.perf_counter() - start)
+        self.submitted += 1
+        results = reply.get('target', {}).get('results') if reply.get('type') == 'notify' else None
+        if results is not None:
+            self.errors += sum(result.get('type') == 'error' for result in results)
+        elif reply.get('type') == 'error':
+            self.errors += 1
+        return reply
+
+    async def _play_investment(self):
+        actions = self.strategy.investment(self._view(), self.name)
+        if self.batch:
+            await self.submit('investment', {'investments': actions + ['ok']})
+            return
+        for action in actions:
+            await self.submit('investment', {'investment': action})
+        await self.submit('investment', {'investment': 'ok'})
+
+    async def _play_bidding(self):
+        await self.submit('bidding', {'bid': self.strategy.bid(self._view(), self.name)})
+
+    async def _play_wants(self):
+        for want in self.strategy.wants(self._view(), self.name):
+            reply = await self.submit('bidding_wants', {'want': want})
+            if reply.get('type') == 'error':
+                break
+        else:
+            await self.submit('bidding_wants', {'want': 'ok'})
+
+    def _start_phase(self, phase:int):
+        play = {1: self._play_investment, 2: self._play_bidding, -2: self._play_wants}.get(phase)
+        if play is None or self.replica.state is None or self.name not in self.replica.state['players']:
+            return
+        # 提交放到单独的任务里，不阻塞读消息；服务端提前结束阶段时丢弃上一阶段没提交完的操作
+        if self._phase_task is not None:
+            self._phase_task.cancel()
+        self._phase_task = asyncio.create_task(play())
+
+    async def run(self):
+        """加入房间并一直玩到游戏结束或连接断开"""
+        try:
+            async with self.session.ws_connect(self.wsurl, heartbeat=30,
+                                               protocols=wire.subprotocols(self.protocol)) as ws:
+                async for msg in ws:
+                    if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                        break
+                    self.received += 1
+                    self.received_bytes += len(msg.data.encode() if msg.type == aiohttp.WSMsgType.TEXT else msg.data)
+                    data = wire.decode(msg.data)
+                    target = data.get('target', {})
+                    if data.get('type') == 'state':
+                        if not self.replica.apply(target):
+                            await self._resync()
+                        continue
+                    match target.get('type'):
+                        case 'phase_changed':
+                            if self.on_phase is not None:
+                                self.on_phase(self, target['epoch'], target['phase'])
+                        case 'data_required':
+                            self._start_phase(target['phase'])
+                        case 'died_players':
+                            self.died = self.died or self.name in target['players']
+                        case 'game_over':
+                            self.finished = True
+                            break
+        finally:
+            if self._phase_task is not None:
+                self._phase_task.cancel()
+            if self._posts:
+                await asyncio.gather(*self._posts, return_exceptions=True)
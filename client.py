@@ -7,12 +7,8 @@ import IPython
 from tabulate import tabulate
 import linecache
 import websockets
-import json
+import orjson
 import aiohttp
-async def every(__seconds: float, func, *args, **kwargs):
-    while True:
-        await func(*args, **kwargs)
-        await asyncio.sleep(__seconds)
 async def input_(prompt:str='')->str:
     global game
     res = await asyncio.get_event_loop().run_in_executor(None, input, prompt)
@@ -132,151 +128,154 @@ class ColorOutput:
     def c(self, text: str) -> None: print(self._color_wrap(text, self.COLORS['cyan']))  # 青 (cyan)
     def w(self, text: str, end: str=None) -> None: print(self._color_wrap(text, self.COLORS['white']), end=end)  # 白 (white)
 
-import random
 from collections import defaultdict
-from typing import Dict
 
-class ResourceIsland:
-    class ResourceValueCalculator:
-        def __init__(self, resource_values):
-            self.resource_values = resource_values
-
-        def calculate_equivalent_resources(self, player_resources, target_value):
-            """
-            计算等值物资组合（动态规划优化版）
-            :param player_resources: 玩家当前资源 {'钻石':1, '铁':3}
-            :param target_value: 需要匹配的目标价值
-            :return: 所有可行的资源组合列表，按最接近目标值排序
-            """
-            # 过滤掉零值资源和保留卡
-            available_res = {
-                res: qty for res, qty in player_resources.items()
-                if qty > 0 and not res.startswith('保留')
-            }
+import rules
+from resource_calculator import ResourceValueCalculator
+from state_replica import StateReplica
+import wire
 
-            # 初始化动态规划表：dp[value] = 最小资源组合
-            dp = defaultdict(list)
-            dp[0] = [{}]  # 初始状态：价值为0时，资源组合为空
-
-            # 遍历每种资源
-            for res, max_qty in available_res.items():
-                res_value = self.resource_values[res]
-                current_dp = list(dp.items())  # 复制当前状态，避免遍历时修改
-
-                # 遍历当前所有可能的价值
-                for value, combos in current_dp:
-                    # 尝试添加1到max_qty个当前资源
-                    for qty in range(1, max_qty + 1):
-                        new_value = value + res_value * qty
-                        new_combo = [{
-                            **combo,
-                            res: combo.get(res, 0) + qty
-                        } for combo in combos]
-
-                        # 如果新价值未记录，或找到更小的组合
-                        if new_value not in dp or len(new_combo[0]) < len(dp[new_value][0]):
-                            dp[new_value] = new_combo
-
-            # 收集所有≥目标价值的组合
-            valid_combinations = []
-            for value, combos in dp.items():
-                if value >= target_value:
-                    for combo in combos:
-                        valid_combinations.append({
-                            'resources': combo,
-                            'total_value': value,
-                            'difference': value - target_value
-                        })
-
-            # 按最接近目标值排序
-            return sorted(valid_combinations, key=lambda x: (x['difference'], len(x['resources'])))
-
-    def __init__(self, server_addr:str, player_name:str):
-        self.wsurl = f"ws://{server_addr}/ws/{player_name}"
-        self.gmsturl = f"http://{server_addr}/game/state"
-        self.plsturl = f"http://{server_addr}/playerinfo/{player_name}"
-        self.sbmtinvurl = f"http://{server_addr}/submit/investment/{player_name}"
-        self.sbmtbidurl = f"http://{server_addr}/submit/bidding/{player_name}"
-        self.sbmtbidwurl = f"http://{server_addr}/submit/bidding_wants/{player_name}"
+# /submit 在服务端最多等待10秒回复，总超时要比它长
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5)
+# 服务器异常断开后重试连接的次数（每秒一次），服务器重启后会从日志恢复房间
+RECONNECT_ATTEMPTS = 30
+# WebSocket 消息的编码，设为 msgpack 时握手请求二进制编码，消息更小、解析更快（见 wire.py）
+WIRE_PROTOCOL = os.getenv("RSIWIRE", "json")
+
+class ResourceIsland:
+    ResourceValueCalculator = ResourceValueCalculator
+
+    def __init__(self, server_addr:str, player_name:str, room:str='default'):
+        self.wsurl = f"ws://{server_addr}/ws/{room}/{player_name}"
+        self.gmsturl = f"http://{server_addr}/game/{room}/state"
+        self.snapurl = f"http://{server_addr}/game/{room}/snapshot"
+        self.plsturl = f"http://{server_addr}/playerinfo/{room}/{player_name}"
+        self.sbmtinvurl = f"http://{server_addr}/submit/{room}/investment/{player_name}/"
+        self.sbmtbidurl = f"http://{server_addr}/submit/{room}/bidding/{player_name}/"
+        self.sbmtbidwurl = f"http://{server_addr}/submit/{room}/bidding_wants/{player_name}/"
         self.server_addr = server_addr
+        self.room = room
         self.o = ColorOutput()
         self.player_name = player_name
-        self.all_buildings = [
-            '矿机', '农场', '伐木场',
-            '铁镐', '农田', '高级伐木场',
-            '高级矿机', '无敌农场', '银行','炮台'
-        ]
-        self.resource_deck = {
-            '金币': 10, '木材': 100,
-            '矿石': 200, '食物': 200,
-            '钻石': 10, '铁': 300,
-        }
-        self.all_resources = [
-            '金币', '木材', '矿石', '食物',
-            '钻石', '铁'
-        ]
-        self.event_deck = [
-            '火山爆发', '海盗掠夺', '海盗掠夺', '天降饥荒',
-            '天降饥荒', '出现宝藏', '祝福事件', '祝福事件'
-        ]
+        self.all_buildings = rules.ALL_BUILDINGS
+        self.all_resources = rules.ALL_RESOURCES
         self.players = {}
-        self.recipes:Dict[str,Dict] = {
-            "矿机": {"铁":5,"铁镐":1},
-            "炮台": {"金币":2},
-            "伐木场": {"铁镐":1,"铁":4},
-            "铁镐":{"铁":2},
-            "高级矿机":{"矿机":1,"金币":2},
-            "高级伐木场":{"伐木场":1,"金币":2},
-            "农场":{"金币":3},
-            "无敌农场":{"农场":1,"金币":8},
-            "银行":{"金币":2}
-        }
-        self.event_immunitie = [3,6,9,13,15]
-        self.current_deck = []
         self.market = []
-        self.resource_values = {
-            '钻石': 8, '金币': 6, '木材': 2,
-            '矿石': 3, '食物': 1, '铁': 2
-        }
-        self.ore_choices = [
-            '钻石','金币',
-            '铁','铁','铁','铁','铁',
-            '无','无','无'
-        ]
-        self.tmp_cnt_take = {}
+        self.leaderboard = []
+        self.resource_values = dict(rules.DEFAULT_RULESET.resource_values)
         self.websocket = None
+        self.started = False
+        self.snapshot_etag = None
+        # 服务器推送的状态副本，普通通知放进队列交给 handle_messages 处理
+        self.replica = StateReplica()
+        self._messages = asyncio.Queue()
+        self._started = asyncio.Event()
+        self.session = None
+        # 事件结算之前的状态，事件卡的结算预览在它上面进行
+        self._before_event = None
 
     async def connect(self):
         """连接到WebSocket服务器"""
         try:
-            self.websocket = await websockets.connect(self.wsurl)
+            self.websocket = await websockets.connect(self.wsurl, subprotocols=wire.subprotocols(WIRE_PROTOCOL))
             self.o.g(f"已连接到服务器: {self.wsurl}")
+            asyncio.create_task(self._read_loop())
             return True
         except Exception as e:
             self.o.r(f"连接服务器失败: {e}")
             sys.exit(0)
 
+    async def _reconnect(self) -> bool:
+        """重新连接到同一个房间，服务器会补发完整状态和当前阶段需要提交的通知"""
+        for _ in range(RECONNECT_ATTEMPTS):
+            await asyncio.sleep(1)
+            try:
+                self.websocket = await websockets.connect(self.wsurl, subprotocols=wire.subprotocols(WIRE_PROTOCOL))
+            except Exception:
+                continue
+            self.o.g("已重新连接到服务器")
+            return True
+        return False
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """整个进程共用一个会话，复用到服务器的长连接"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=4, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+        return self.session
+
+    async def close(self):
+        """关闭WebSocket和HTTP会话"""
+        if self.websocket:
+            await self.websocket.close()
+        if self.session is not None:
+            await self.session.close()
+
     async def fetch_url(self,url:str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                return await resp.json()
-
-    async def sync_game_state(self):
-        game_state = await self.fetch_url(self.gmsturl)
-        all_player = game_state['players']
-        all_player_state = [await self.fetch_url(f"http://{self.server_addr}/playerinfo/{name}") for name in all_player]
+        async with self._get_session().get(url) as resp:
+            return await resp.json(loads=orjson.loads)
+
+    async def fetch_snapshot(self):
+        """获取房间快照，状态没有变化（304）或房间不存在时返回 None"""
+        headers = {"If-None-Match": self.snapshot_etag} if self.snapshot_etag else {}
+        async with self._get_session().get(self.snapurl, headers=headers) as resp:
+            if resp.status != 200:
+                return None
+            self.snapshot_etag = resp.headers.get("ETag")
+            return await resp.json(loads=orjson.loads)
+
+    async def sync_game_state(self, force:bool=False):
+        """通过HTTP拉取完整快照，只在启动和推送版本不连续时使用"""
+        if force:
+            self.snapshot_etag = None
+        game_state = await self.fetch_snapshot()
+        if game_state is None:
+            return
+        self.replica.load(game_state)
+        self._load_replica()
+
+    def _load_replica(self):
+        game_state = self.replica.state
         self.resource_values = game_state['values']
         self.players = {name: {
-                'resources': defaultdict(int),
+                'resources': defaultdict(int, state['resources']),
                 'action_points': state['action_points'],
                 'buildings': state['buildings'],
                 'money': state['bank_money'],
-            } for name,state in zip(all_player,all_player_state)}
-        for i in range(len(all_player)):
-            for x in all_player_state[i]['resources']:
-                self.players[all_player[i]]['resources'][x] = all_player_state[i]['resources'][x]
+            } for name,state in game_state['players'].items()}
         self.market = game_state['market']
+        self.leaderboard = game_state['leaderboard']
         self.started = game_state['started']
+        if self.started:
+            self._started.set()
+
+    async def _read_loop(self):
+        """持续读取WebSocket：状态推送直接更新副本，其它消息交给 handle_messages"""
+        while True:
+            try:
+                message = wire.decode(await self.websocket.recv())
+            except websockets.exceptions.ConnectionClosedError as e:
+                self.o.r(f"与服务器的连接异常断开: {e}")
+                if await self._reconnect():
+                    continue
+                await self._messages.put(None)
+                return
+            except Exception as e:
+                self.o.r(f"接收消息失败: {e}")
+                await self._messages.put(None)
+                return
+            if message['type'] == 'state':
+                if self.replica.apply(message['target']):
+                    if self.replica.state is not None:
+                        self._load_replica()
+                else:
+                    await self.sync_game_state(force=True)
+                continue
+            if message['type'] == 'notify' and message['target']['type'] == 'event_choiced' \
+                    and self.replica.state is not None:
+                # 结算后的增量紧跟在这条通知后面推送，趁副本还没应用它先记下结算前的状态
+                self._before_event = rules.load_state(self.replica.state)
+            await self._messages.put(message)
 
     async def send(self, message, is_inv:bool=False, url:str=None):
         """发送消息到服务器"""
@@ -284,10 +283,8 @@ class ResourceIsland:
             self.o.r("未连接到服务器")
             return False
         try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url if url else (self.sbmtinvurl if is_inv else self.sbmtbidurl),json=message) as resp:
-                    return await resp.json()
+            async with self._get_session().post(url if url else (self.sbmtinvurl if is_inv else self.sbmtbidurl),json=message) as resp:
+                return await resp.json(loads=orjson.loads)
         except Exception as e:
             self.o.r(f"发送消息失败: {e}")
             return False
@@ -297,17 +294,16 @@ class ResourceIsland:
         if not self.websocket:
             self.o.r("未连接到服务器")
             return None
-        try:
-            message = await self.websocket.recv()
-            print(f"received {message}")
-            await asyncio.sleep(0.5)
-            return json.loads(message)
-        except Exception as e:
-            self.o.r(f"接收消息失败: {e}")
-            return None
+        message = await self._messages.get()
+        print(f"received {message}")
+        await asyncio.sleep(0.5)
+        return message
     async def handle_messages(self):
         while True:
             message = await self.receive_message()
+            if message is None:
+                self.o.r("与服务器的连接已断开")
+                return
             if message['type'] == 'notify':
                 self.o.b(f"收到服务器通知: {message}")
                 target = message['target']
@@ -332,129 +328,74 @@ class ResourceIsland:
                 'investment':inv
             }
         },is_inv=True)
+
+    async def send_investments(self, actions:list):
+        """一次提交多条投资操作，服务器按顺序执行，回复里有每条操作的结果"""
+        return await self.send({
+            'type': 'investment',
+            'data': {
+                'player': self.player_name,
+                'investments': actions
+            }
+        },is_inv=True)
+
+    def _show_investment_reply(self, resp):
+        if resp['type'] == 'notify':
+            target = resp['target']
+            if target['type'] == 'investment_success':
+                self.o.g(f"投资 {target['action']} 成功")
+        elif resp['type'] == 'error':
+            target = resp['target']
+            match target['reason']:
+                case 1:
+                    self.o.y(f"投资 {target['action']} 失败：没有足够行动点或者耗材")
+                case 2:
+                    self.o.y(f"投资 {target['action']} 失败：物品/建筑不在范围内")
+                case 3:
+                    self.o.y(f"投资 {target['action']} 失败：下标错误")
+                case 4:
+                    self.o.y(f"投资 {target['action']} 失败：行动不存在")
+                case 5:
+                    self.o.y(f"投资 {target['action']} 失败：采集数量超限")
     
     async def initialize_game(self):
         await clear()
         await self.display_game_state()
-        self.current_deck = []
-        self.market = []
-        self.resource_values = {
-            '钻石': 8, '金币': 6, '木材': 2,
-            '矿石': 3, '食物': 1, '铁': 2
-        }
-        self.tmp_cnt_take = defaultdict(int)
         await self.connect()
-        await self.sync_game_state()
-        asyncio.create_task(every(3,self.sync_game_state))
-        while not self.started:
-            await asyncio.sleep(0.5)
+        await self._started.wait()
         self.o.g("游戏开始!")
         await self.handle_messages()
 
-    async def _draw_cards(self, num:int):
-        """从牌堆抽取指定数量的卡"""
-        drawn = []
-        for _ in range(num):
-            if not self.current_deck:
-                await self._shuffle_deck()
-            if self.current_deck:
-                drawn.append(self.current_deck.pop())
-        return drawn
-
-    async def _shuffle_deck(self):
-        """将资源卡转换为可抽取的列表"""
-        self.current_deck = []
-        for card_type, count in self.resource_deck.items():
-            self.current_deck.extend([card_type] * count)
-        random.shuffle(self.current_deck)
-
     async def _trigger_event_card(self, epoch:int,event:str):
         await clear()
         await self.display_game_state()
-        if epoch not in [3,6,9,13,15,18,21,23,25,27]:
-            self.o.b("本轮无需事件卡阶段")
-            return
         self.o.b(f"当前是第 {epoch} 轮的特殊阶段事件卡。")
         self.o.b(f"本轮事件：{event}")
-        self.sync_game_state()
         if event == "火山爆发":
             self.o.w(">> 移除市场上一半资源")
-            self.market = self.market[:len(self.market)//2]
-        if event == "海盗掠夺":
-            calc = ResourceIsland.ResourceValueCalculator(self.resource_values)
-            died_player = []
-            for player,data in self.players.items():
-                can_pay = calc.calculate_equivalent_resources(data['resources'],3*self.resource_values['金币'])
-                if "炮台" in data['buildings']:
-                    data['buildings'].remove("炮台")
-                    self.o.w(f">> 玩家 {player} 使用炮台防御海盗袭击")
-                    continue
-                if not can_pay:
-                    died_player.append(player)
-                    continue
-                for item,amount in can_pay[0]['resources'].items():
-                    self.players[player]['resources'][item] -= amount
-                    self.o.w(f">> 玩家 {player} 支付 {amount} 个 {item}")
-            for x in died_player:
-                self.o.r(f">> 玩家 {x} 无法支付，死亡")
-                self.players.pop(x)
-        if event == "天降饥荒":
-            died_player = []
-            for player,data in self.players.items():
-                if data['resources']['食物'] < 3:
-                    died_player.append(player)
-                    continue
-                self.o.w(f">> 玩家 {player} 支付 3个食物")
-                data['resources']['食物'] -= 3
-            for x in died_player:
-                self.o.r(f">> 玩家 {x} 没有食物，死亡")
-                self.players.pop(x)
-        if event == "出现宝藏":
-            return
-            # calc = ResourceIsland.ResourceValueCalculator(self.resource_values)
-            # self.o.w(f">> 请各位玩家出价")
-            # bids = []
-            # for x in self.players.keys():
-            #     while True:
-            #         self.o.w(f">> 玩家 {x} 你的价格是：")
-            #         bid = int(await input_())
-            #         vaild = calc.calculate_equivalent_resources(self.players[x]['resources'], bid)
-            #         if not vaild:
-            #             self.o.y(f">> 玩家 {x} 你无法承受这个价值，请重新输入")
-            #             continue
-            #         if bid == 0:
-            #             self.o.w(f">> 玩家 {x} 放弃")
-            #             break
-            #         bids.append({"player":x,"bid":bid,"will_pay":vaild[0]})
-            #         break
-            # bids.sort(key=lambda x:x['bid'],reverse=True)
-
         if event == "祝福事件":
             self.o.w(">> 所有玩家行动点+2")
-            for player,data in self.players.items():
-                data['action_points'] += 2
+        # 事件的结算规则和服务器共用：在结算之前的状态副本上重新结算一遍，
+        # 不能用 self.replica，服务器推送的结算结果可能已经应用到它上面了
+        before, self._before_event = self._before_event, None
+        if before is None:
+            self.o.b("事件回合结束")
+            return None
+        state = before.copy()
+        rules.apply_event(state, event)
+        for player, data in before.players.items():
+            after = state.players.get(player)
+            if after is None:
+                self.o.r(f">> 玩家 {player} 无法支付，死亡")
+                continue
+            if after.buildings.count("炮台") < data.buildings.count("炮台"):
+                self.o.w(f">> 玩家 {player} 使用炮台防御海盗袭击")
+            for item, amount in data.resources.items():
+                if amount > after.resources[item]:
+                    self.o.w(f">> 玩家 {player} 支付 {amount - after.resources[item]} 个 {item}")
         self.o.b("事件回合结束")
         return None
 
-    async def _update_resource_values(self, epoch:int):
-        await asyncio.sleep(1)
-        await clear()
-        await self.display_game_state()
-        print(self.market)
-        if epoch % 3 != 0:
-            self.o.b("本轮无需价格波动")
-            return
-        self.o.b(f"现在是第 {epoch} 轮的价值波动阶段")
-        for k in self.resource_values.keys():
-            if self.tmp_cnt_take[k] == 0:
-                self.o.w(f">> 资源 {k} 未被拿取，价格+1")
-                self.resource_values[k]+=1
-        for k in self.resource_values.keys():
-            if self.tmp_cnt_take[k] >= 7:
-                if self.resource_values[k] == 1:
-                    continue
-                self.o.w(f">> 资源 {k} 被拿去许多，价格-1")
-                self.resource_values[k] -= 1
     async def _handle_bidding_wants(self,epoch:int):
         await clear()
         await self.display_game_state()
@@ -508,38 +449,40 @@ class ResourceIsland:
         await clear()
         await self.display_game_state()
 
+    def _show_build_options(self, player:str):
+        """列出现在能建造的建筑和各自要支付的资源，以及还缺前置建筑的建筑的完整前置链"""
+        if self.replica.state is None:
+            return
+        options = rules.build_options(rules.load_state(self.replica.state), player)
+        book = rules.DEFAULT_RULESET.recipe_book
+        rows = []
+        for building, plan in options.items():
+            if plan is not None:
+                rows.append([building, ' '.join(f"{res}x{qty}" for res, qty in plan.items()) or '-'])
+            elif book.chain[building]:
+                rows.append([building, f"不够（{' ← '.join([building] + book.chain[building][::-1])}）"])
+            else:
+                rows.append([building, "不够"])
+        print(tabulate(rows, headers=["建筑", "支付"]))
+
     async def _handle_investment(self, epoch:int):
         """处理投资阶段"""
         await clear()
         await self.display_game_state()
         self.o.b(f"当前是第 {epoch} 回合的投资阶段")
-        already_exchanged = []
         already_mined = []
+        # 建筑产出由服务器结算，这里只做提示
         for player in self.players.keys():
             if "农场" in self.players[player]['buildings']:
                 self.o.w(f">> 玩家 {player} 有农场，免费增加2行动点")
-                self.players[player]['action_points'] += 2
-                already_exchanged.append(player)
             if "无敌农场" in self.players[player]['buildings']:
                 self.o.w(f">> 玩家 {player} 有无敌农场，增加5行动点")
-                self.players[player]['action_points'] += 5
-                already_exchanged.append(player)
             if "伐木场" in self.players[player]['buildings']:
                 self.o.w(f">> 玩家 {player} 有伐木场，增加1木材")
-                if "木材" in self.market:
-                    self.players[player]['resources']['木材'] +=1
-                    self.market.remove("木材")
-                else:
+                if "木材" not in self.market:
                     self.o.y("市场上没有木材，增加失败")
             if "高级伐木场" in self.players[player]['buildings']:
                 self.o.w(f">> 玩家 {player} 有高级伐木场，增加2木材")
-                if self.current_deck.count("木材") <2:
-                    self.o.y("市场上没有木材，增加失败")
-                    self.players[player]['resources']['木材'] +=2
-                    self.current_deck.remove("木材")
-                    self.current_deck.remove("木材")
-                else:
-                    self.o.y("市场上没有木材，增加失败")
         await asyncio.sleep(3)
         if True:
             player = self.player_name
@@ -552,7 +495,8 @@ class ResourceIsland:
                                     ['5', '存钱',0],
                                     ['6', '挖矿',0],
                                     ['7', '铁镐',0],
-                                    ['8', '结束回合',0]
+                                    ['8', '结束回合',0],
+                                    ['9', '连续操作','-']
                                   ],headers=["编号","操作","消耗"])
                 print(table)
                 self.o.b(">> 请输入投资类型：")
@@ -575,6 +519,7 @@ class ResourceIsland:
                     if self.players[player]['action_points'] < 3:
                         self.o.y("你没行动点，建造失败")
                         continue
+                    self._show_build_options(player)
                     building = await input_("你要建造什么建筑：")
                     if building not in self.all_buildings:
                         self.o.y("建筑不存在")
@@ -583,6 +528,27 @@ class ResourceIsland:
                 elif action == '8':
                     resp = await self.send_investment('ok')
                     break
+                elif action == '9':
+                    # 不需要再输入参数的操作可以一次提交，只用一个来回
+                    codes = (await input_("依次输入操作编号，空格分开（可用1 2 4 7，最后输入8表示结束回合）：")).split()
+                    if not codes or any(code not in ('1', '2', '4', '7', '8') for code in codes):
+                        self.o.y("只能连续进行探索、兑换、开盲盒、铁镐和结束回合")
+                        continue
+                    actions = ['ok' if code == '8' else code for code in codes]
+                    resp = await self.send_investments(actions)
+                    if not resp:
+                        return
+                    if resp['type'] == 'error':
+                        self._show_investment_reply(resp)
+                        continue
+                    for result in resp['target']['results']:
+                        self._show_investment_reply(result)
+                    if 'ok' in actions:
+                        break
+                    await asyncio.sleep(0.5)
+                    await clear()
+                    await self.display_game_state()
+                    continue
                 elif action == '4':
                     if self.players[player]['action_points'] < 1:
                         self.o.y(f"玩家 {player} 没有足够的行动点数")
@@ -607,26 +573,25 @@ class ResourceIsland:
                         continue
                     resp = await self.send_investment({"5":f"{item}x{amount}"})
                 elif action == '6':
-                    ores = []
+                    wants = []
                     if "矿机" in self.players[player]['buildings']:
-                        wants = []
+                        ores = [item for item in self.market if item in rules.MINERALS]
                         for i in range(3):
-                            for x in self.market:
-                                if  x in ['钻石','金币','铁','矿石']:
-                                    ores.append(x)
                             self.o.b("当前市场上有以下矿物：" + str(ores))
-                            x = int(await input_("你要拿哪个（输入名称）："))
-                            if x >= len(ores):
-                                self.o.y(f"市场没有索引为 {i} 的物品")
-                            wants.append(x)
+                            if not ores:
+                                break
+                            x = int(await input_("你要拿哪个（输入编号）："))
+                            if not (0 <= x < len(ores)):
+                                self.o.y(f"市场没有索引为 {x} 的物品")
+                                continue
+                            wants.append(ores.pop(x))
                         resp = await self.send_investment({"6":wants})
-                        self.players[player]['buildings'].remove("矿机")
                     elif "高级矿机" in self.players[player]['buildings']:
                         if player in already_mined:
                             self.o.y("你都挖过了")
                             continue
                         already_mined.append(player)
-                        ores_in_market = [item for item in self.market if item in ['钻石','金币','铁','矿石']]
+                        ores_in_market = [item for item in self.market if item in rules.MINERALS]
                         for i in range(2):
                             self.o.b("当前市场上有以下矿物：" + str(ores_in_market))
                             if not ores_in_market:
@@ -637,7 +602,7 @@ class ResourceIsland:
                                 if not (0 <= choice_index < len(ores_in_market)):
                                     self.o.y(f"市场没有索引为 {choice_index} 的物品")
                                     continue
-                                wants.append(ores_in_market[choice_index])
+                                wants.append(ores_in_market.pop(choice_index))
                             except ValueError:
                                 self.o.y("请输入有效的数字索引。")
                                 continue
@@ -652,91 +617,18 @@ class ResourceIsland:
                     resp = await self.send_investment('7')
                 if resp == None:
                     return
-                if resp['type'] == 'notify':
-                    target = resp['target']
-                    if target['type'] == 'investment_success':
-                        self.o.g(f"投资 {target['action']} 成功")
-                elif resp['type'] == 'error':
-                    target = resp['target']
-                    match target['reason']:
-                        case 1:
-                            self.o.y(f"投资 {target['action']} 失败：没有足够行动点或者耗材")
-                        case 2:
-                            self.o.y(f"投资 {target['action']} 失败：物品/建筑不在范围内")
-                        case 3:
-                            self.o.y(f"投资 {target['action']} 失败：下标错误")
-                        case 4:
-                            self.o.y(f"投资 {target['action']} 失败：行动不存在")
-                        case 5:
-                            self.o.y(f"投资 {target['action']} 失败：采集数量超限")
+                self._show_investment_reply(resp)
                 await asyncio.sleep(0.5)
                 await clear()
-                await self.sync_game_state()
                 await self.display_game_state()
             self.o.w(f">> 玩家 {player} 投资结束")
             await clear()
             await self.display_game_state()
         self.o.b("投资阶段结束")
 
-    async def _check_can_build(self, player_name:str, building:str):
-        calc = self.__class__.ResourceValueCalculator(self.resource_values)
-        cost = 0
-        required_building = {}
-        required_resources = {}
-        for k,v in self.recipes[building].items():
-            if k in self.all_buildings:
-                required_building[k]=v
-            if k in self.all_resources:
-                required_resources[k]=v
-        for k,v in required_resources.items():
-            cost += self.resource_values[k] * v
-        res_vaild = calc.calculate_equivalent_resources(self.players[player_name]['resources'],cost)
-        if not res_vaild:
-            return False,None
-        for k,v in required_building.items():
-            if k in self.players[player_name]['buildings']:
-                if self.players[player_name]['buildings'].count(v):
-                    return False ,None
-                else :
-                    for i in range(v):
-                        self.players[player_name]['buildings'].remove(k)
-        return True,res_vaild[0]['resources']
-
-    async def _pay_to_build(self, player_name:str, pay:Dict):
-        for k,v in pay.items():
-            self.players[player_name]['resources'][k] -= v
-            self.current_deck.append(k)
-
-    async def _process_build(self, player_name:str, building:str):
-        m, x = await self._check_can_build(player_name, building)
-        if m:
-            await self._pay_to_build(player_name, x)
-            self.players[player_name]['buildings'].append(building)
-            return True
-        return False
-
     async def get_player_values(self):
-        players = defaultdict(int)
-        for player, data in self.players.items():
-            resources = data['resources']
-            resources_value = sum(self.resource_values[res] * qty for res, qty in resources.items())
-            building_value = len(data['buildings'])*4
-            players[player] = resources_value + building_value + data['money']*1.3
-        return players
-
-    async def start(self, epochs:int):
-        if epochs > 30:
-            epochs = 30
-        self.o.g("游戏开始")
-        for epoch in range(1, epochs+1):
-            await self._handle_investment(epoch)
-            await self._handle_bidding(epoch)
-            await self._update_resource_values(epoch)
-            await self._trigger_event_card(epoch)
-            await asyncio.sleep(3)
-            await clear()
-        self.o.g("游戏结束")
-        print(await self.get_player_values())
+        """各玩家的价值，由服务器按 valuation.py 统一计算后随状态推送"""
+        return {row['player']: row['score'] for row in self.leaderboard}
 
     async def _send_bidding_wants(self, want:int):
         return await self.send({
@@ -748,7 +640,6 @@ class ResourceIsland:
         },url=self.sbmtbidwurl,is_inv=False)
 
     async def _parse_bidding(self, epochs: int):
-        await self.sync_game_state()
         await clear()
         await self.display_game_state()
         self.o.b(f"当前是第{epochs}轮的竞标拿取阶段，现在轮到你拿取了")
@@ -765,7 +656,6 @@ class ResourceIsland:
             if res['type'] == 'notify':
                 if res['target']['type'] == 'bidding_success':
                     self.o.g("物品拿取成功")
-                    await self.sync_game_state()
             elif res['type'] == 'error':
                 target = res['target']
                 match target['reason']:
@@ -775,7 +665,6 @@ class ResourceIsland:
                         self.o.y("行动点不足，将自动退出")
                         return
             await clear()
-            await self.sync_game_state()
             await self.display_game_state()
 
     async def display_game_state(self):
@@ -806,8 +695,14 @@ if __name__ == '__main__':
         server_addr = input("请输入你的服务器地址：")
         if server_addr == '':
             server_addr = "localhost:8000"
+        room = input("请输入房间号（默认 default）：")
+        if room == '':
+            room = "default"
         player_name = await input_("请输入你的玩家名称: ")
-        game = ResourceIsland(server_addr, player_name)
-        await game.initialize_game()
+        game = ResourceIsland(server_addr, player_name, room)
+        try:
+            await game.initialize_game()
+        finally:
+            await game.close()
     
     asyncio.run(main())
@@ -0,0 +1,199 @@
+import random
+from collections import Counter
+
+class Deck:
+    """
+    资源牌堆
+    洗好的部分只记录每种资源还剩几张，抽牌时按剩余张数加权随机，和从洗乱的列表末尾抽牌等价；
+    放回牌堆的牌（append/extend）按顺序压在最上面，下一次抽牌先抽到它们，和原来的列表行为一致。
+    计数、按类型移除、抽牌都只和资源种类数有关，与牌堆大小无关
+    """
+    __slots__ = ('_rng', '_shuffled', '_shuffled_total', '_top', '_top_counts')
+
+    def __init__(self, rng=random):
+        self._rng = rng
+        self._shuffled = Counter()     # 洗好的部分：资源 -> 张数
+        self._shuffled_total = 0
+        self._top = []                 # 压在最上面的牌，末尾是最上面一张
+        self._top_counts = Counter()
+
+    def refill(self, composition:dict):
+        """按配置重新组成一副洗好的牌堆"""
+        self._shuffled = Counter({card: count for card, count in composition.items() if count > 0})
+        self._shuffled_total = sum(self._shuffled.values())
+        self._top.clear()
+        self._top_counts.clear()
+
+    def to_dict(self) -> dict:
+        """牌堆的完整内容，用于写入房间日志的快照"""
+        return {"shuffled": dict(self._shuffled), "top": list(self._top)}
+
+    def restore(self, data:dict):
+        """恢复 to_dict 保存的内容"""
+        self._shuffled = Counter(data["shuffled"])
+        self._shuffled_total = sum(self._shuffled.values())
+        self._top = list(data["top"])
+        self._top_counts = Counter(self._top)
+
+    def copy(self, rng=None) -> 'Deck':
+        """复制一副牌堆，rng 是副本抽牌用的随机数来源，默认和原牌堆共用"""
+        clone = Deck(self._rng if rng is None else rng)
+        clone._shuffled = Counter(self._shuffled)
+        clone._shuffled_total = self._shuffled_total
+        clone._top = list(self._top)
+        clone._top_counts = Counter(self._top_counts)
+        return clone
+
+    def __len__(self):
+        return self._shuffled_total + len(self._top)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def count(self, card:str) -> int:
+        return self._shuffled[card] + self._top_counts[card]
+
+    def counts(self) -> Counter:
+        return self._shuffled + self._top_counts
+
+    def _take_shuffled(self) -> str:
+        pick = self._rng.randrange(self._shuffled_total)
+        for card, count in self._shuffled.items():
+            if pick < count:
+                break
+            pick -= count
+        self._shuffled[card] -= 1
+        if not self._shuffled[card]:
+            del self._shuffled[card]
+        self._shuffled_total -= 1
+        return card
+
+    def _take_top(self, index:int=-1) -> str:
+        card = self._top.pop(index)
+        self._top_counts[card] -= 1
+        if not self._top_counts[card]:
+            del self._top_counts[card]
+        return card
+
+    def draw(self) -> str:
+        """从最上面抽一张牌"""
+        if self._top:
+            return self._take_top()
+        if not self._shuffled_total:
+            raise IndexError("draw from empty deck")
+        return self._take_shuffled()
+
+    def draw_bottom(self) -> str:
+        """从最下面抽一张牌（铁镐）"""
+        if self._shuffled_total:
+            return self._take_shuffled()
+        if not self._top:
+            raise IndexError("draw from empty deck")
+        return self._take_top(0)
+
+    def append(self, card:str):
+        """把一张牌压在最上面"""
+        self._top.append(card)
+        self._top_counts[card] += 1
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def remove(self, card:str):
+        """从牌堆中移除一张指定资源的牌，没有时抛出 ValueError"""
+        if self._shuffled[card]:
+            self._shuffled[card] -= 1
+            if not self._shuffled[card]:
+                del self._shuffled[card]
+            self._shuffled_total -= 1
+            return
+        if not self._top_counts[card]:
+            raise ValueError(f"{card} not in deck")
+        self._take_top(self._top.index(card))
+
+class Market:
+    """
+    市场：保持上架顺序（竞标和高级矿机按下标拿取），同时记录每种资源的数量，
+    查询某种资源有几个、有没有、一共有几种都不需要扫描列表。
+    按类型移除（remove）仍然要在列表里找到第一个同类物品并挪动后面的元素，和市场长度成正比：
+    移除的是哪一个位置决定了之后各物品的下标，换成“和末尾交换再删除”会改变顺序，
+    已有的房间日志就不能再按原样重放；市场通常只有十几个物品，这部分开销可以忽略
+    """
+    __slots__ = ('_items', '_counts')
+
+    def __init__(self, items=()):
+        self._items = []
+        self._counts = Counter()
+        self.extend(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __contains__(self, item:str):
+        return self._counts[item] > 0
+
+    def __repr__(self):
+        return f"Market({self._items!r})"
+
+    def count(self, item:str) -> int:
+        return self._counts[item]
+
+    def copy(self) -> 'Market':
+        clone = Market()
+        clone._items = list(self._items)
+        clone._counts = Counter(self._counts)
+        return clone
+
+    def kinds(self) -> int:
+        """市场上有几种不同的资源"""
+        return len(self._counts)
+
+    def to_list(self) -> list:
+        return list(self._items)
+
+    def append(self, item:str):
+        self._items.append(item)
+        self._counts[item] += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def _discount(self, item:str):
+        self._counts[item] -= 1
+        if not self._counts[item]:
+            del self._counts[item]
+
+    def remove(self, item:str):
+        """移除最早上架的一个 item，没有时抛出 ValueError"""
+        if not self._counts[item]:
+            raise ValueError(f"{item} not in market")
+        self._items.remove(item)
+        self._discount(item)
+
+    def pop(self, index:int=-1) -> str:
+        item = self._items.pop(index)
+        self._discount(item)
+        return item
+
+    def clear(self) -> list:
+        """清空市场，返回原来的物品"""
+        items, self._items = self._items, []
+        self._counts.clear()
+        return items
+
+    def truncate(self, length:int):
+        """只保留前 length 个物品"""
+        for item in self._items[length:]:
+            self._discount(item)
+        del self._items[length:]
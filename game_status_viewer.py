@@ -1,6 +1,8 @@
 import aiohttp,asyncio,os
+import orjson
 from tabulate import tabulate
 from threading import Thread
+from state_replica import StateReplica
 class ColorOutput:
     """彩色输出工具类（简写方法名版）"""
     # ANSI 颜色代码（保持原样）
@@ -26,29 +28,84 @@ class ColorOutput:
     def c(self, text: str) -> None: print(self._color_wrap(text, self.COLORS['cyan']))  # 青 (cyan)
     def w(self, text: str, end: str=None) -> None: print(self._color_wrap(text, self.COLORS['white']), end=end)  # 白 (white)
 
+# 观战器只和一台服务器通信，少量长连接就够了
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=5)
+
 class GameStatusViewer:
-    def __init__(self, server_addr :str):
-        self.staturl = f"http://{server_addr}/game/state"
+    def __init__(self, server_addr :str, room :str='default'):
+        self.staturl = f"http://{server_addr}/game/{room}/snapshot"
+        self.watchurl = f"ws://{server_addr}/watch/{room}"
+        self.snapshot_etag = None
+        self.replica = StateReplica()
+        self.session = None
         self.server_addr = server_addr
+        self.room = room
         self.o = ColorOutput()
         self.players = {}
         self.resource_values = {}
         self.epoch = 0
         self.phase = ''
         self.market = []
+        self.leaderboard = []
+        self.started = False
 
     async def start(self):
-        await self.every(1,self.display_game_state)
+        try:
+            await self.watch()
+        finally:
+            await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """整个进程共用一个会话，复用到服务器的长连接"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=2, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
 
-    async def every(self, __seconds: float, func, *args, **kwargs):
+    async def watch(self):
+        """观战连接：服务器有状态变化时推送过来，收到后刷新显示"""
         while True:
-            await func(*args, **kwargs)
-            await asyncio.sleep(__seconds)
+            try:
+                async with self._get_session().ws_connect(self.watchurl, timeout=aiohttp.ClientWSTimeout(ws_close=5)) as ws:
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        message = orjson.loads(msg.data)
+                        if message['type'] != 'state':
+                            continue
+                        if self.replica.apply(message['target']):
+                            self._load_replica()
+                        else:
+                            await self.sync_game_state(force=True)
+                        await self.display_game_state()
+            except aiohttp.ClientError:
+                pass
+            # 房间还没创建或者已经结束，稍后重连
+            self.started = False
+            await self.display_game_state()
+            await asyncio.sleep(1)
 
     async def fetch_url(self,url:str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                return await resp.json()
+        async with self._get_session().get(url) as resp:
+            if resp.status == 404:
+                return None
+            return await resp.json(loads=orjson.loads)
+
+    async def fetch_snapshot(self):
+        """获取房间快照，状态没有变化时服务器返回304，此时返回 False"""
+        headers = {"If-None-Match": self.snapshot_etag} if self.snapshot_etag else {}
+        async with self._get_session().get(self.staturl, headers=headers) as resp:
+            if resp.status == 304:
+                return False
+            if resp.status == 404:
+                self.snapshot_etag = None
+                return None
+            self.snapshot_etag = resp.headers.get("ETag")
+            return await resp.json(loads=orjson.loads)
 
     async def show_values(self):
         table = tabulate(
@@ -58,35 +115,41 @@ class GameStatusViewer:
         print(table)
 
     async def show_rank(self):
+        """排行榜由服务器随状态一起计算好推送过来"""
         self.o.b("\n=== 玩家价值排名 ===")
-        table = [[player,await self._calc_player_value(self.players[player])] for player in self.players.keys()]
-        table.sort(key=lambda x:x[1],reverse=True)
         table = tabulate(
-            [[i+1]+item for i,item in enumerate(table)],
+            [[row['rank'], row['player'], row['score']] for row in self.leaderboard],
             headers=["排名","玩家名称", "当前价值"],
         )
         print(table)
 
-    async def _calc_player_value(self,data:dict):
-        result = 0
-        for k,v in data['resources'].items():
-            result += self.resource_values[k]*v
-        result += data['money']*2
-        result += data['action_points']*0.1
-        return result
-
-    async def sync_game_state(self):
-        game_state = await self.fetch_url(self.staturl)
-        all_player = game_state['players']
-        all_player_state = [await self.fetch_url(f"http://{self.server_addr}/playerinfo/{name}") for name in all_player]
+    async def sync_game_state(self, force:bool=False):
+        """通过HTTP拉取完整快照，只在推送版本不连续时使用"""
+        if force:
+            self.snapshot_etag = None
+        game_state = await self.fetch_snapshot()
+        if game_state is False:
+            return
+        if game_state is None:
+            # 房间还没有人加入或者已经结束
+            self.started = False
+            return
+        self.replica.load(game_state)
+        self._load_replica()
+
+    def _load_replica(self):
+        game_state = self.replica.state
+        if game_state is None:
+            return
         self.resource_values = game_state['values']
         self.players = {name: {
                 'resources': state['resources'],
                 'action_points': state['action_points'],
                 'buildings': state['buildings'],
                 'money': state['bank_money'],
-            } for name,state in zip(all_player,all_player_state)}
+            } for name,state in game_state['players'].items()}
         self.market = game_state['market']
+        self.leaderboard = game_state['leaderboard']
         self.started = game_state['started']
         self.epoch = game_state['epoch']
         self.phase = game_state['phase']
@@ -95,7 +158,6 @@ class GameStatusViewer:
     async def display_game_state(self):
         """优化后的游戏状态显示方法"""
         os.system("cls" if os.name == 'nt' else "clear")
-        await self.sync_game_state()
         self.o.b("=== 游戏状态 ===")
         if self.started:
             self.o.w(f"当前是第{self.epoch}轮的{self.phase}阶段。")
@@ -127,7 +189,10 @@ if __name__ == '__main__':
         server_addr: str = input("请输入你的服务器地址：")
         if server_addr == '':
             server_addr = "localhost:8000"
-        viewer = GameStatusViewer(server_addr)
+        room: str = input("请输入房间号（默认 default）：")
+        if room == '':
+            room = "default"
+        viewer = GameStatusViewer(server_addr, room)
         await viewer.start()
 
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,337 @@
+"""
+房间日志：已开局房间的持久化和崩溃恢复
+每个房间一个只追加的日志文件（JSON Lines），依次是：
+    {"t":"meta", ...}                       房间信息：随机数种子、开局时的座位顺序和规则参数
+    {"t":"snapshot","state":{...},"rng":[...]}
+                                            完整的规则状态（牌堆、市场、玩家、轮次和阶段进度）和随机数生成器的状态
+    {"t":"rng","v":...}                     一次随机抽取的结果，写在使用它的操作之前
+    {"t":"op","op":"investment", ...}       一次规则调用及其参数
+每个房间有自己带种子的随机数生成器，同样的种子加上同样的操作一定得到同样的对局，
+重放时重新生成每次抽取并和记录的结果比对，不一致说明规则代码的行为变了（见 replay.py）。
+每隔 SNAPSHOT_EPOCHS 轮用当前状态的快照重写整个文件，日志不会无限增长；
+设置了 RSIARCHIVE 时改为在文件末尾追加快照，保留整局的记录，对局结束后移到这个目录，供 replay.py 重放。
+服务器重启后读取最后一份快照、按顺序重新执行后面的操作，就得到崩溃前的状态。
+同一轮事件循环里产生的记录合并成一次写入，fsync 的时机由环境变量 RSIFSYNC 控制：
+    always      每次写入后都 fsync，断电也不丢记录，但每次写入都要等磁盘
+    interval    最多每 FSYNC_INTERVAL 秒 fsync 一次（默认），进程崩溃不丢记录，断电最多丢这段时间
+    never       交给操作系统
+"""
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import quote
+
+import orjson
+
+import rules
+
+JOURNAL_DIR = os.getenv("RSIJOURNAL", "journal")    # 设为空字符串时不写日志
+ARCHIVE_DIR = os.getenv("RSIARCHIVE", "")           # 保存结束对局的完整记录，为空时直接删除
+FSYNC = os.getenv("RSIFSYNC", "interval")
+FSYNC_INTERVAL = 1.0
+SNAPSHOT_EPOCHS = 5             # 每隔几轮压缩一次日志
+SUFFIX = ".log"
+
+def encode(record:Dict) -> bytes:
+    return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+class ReplayDivergence(Exception):
+    """重放时重新生成的随机结果和日志里记录的不一致"""
+
+class JournalRandom:
+    """
+    房间的随机数来源：正常游戏时通过 on_draw 记录每次抽取的结果。
+    重放时 expect 放进记录的结果，之后每次抽取都和它比对：
+    strict 时不一致直接抛出 ReplayDivergence，否则以记录为准（恢复时保证和崩溃前完全一样）并计数
+    :param seed: 随机数种子，记录在房间日志的 meta 里
+    """
+    def __init__(self, seed:int=None, strict:bool=False):
+        self.seed = seed
+        self.strict = strict
+        self.divergences = 0
+        self._rng = random.Random(seed)
+        self._expected = deque()
+        self.on_draw: Callable = None
+
+    def expect(self, value):
+        self._expected.append(value)
+
+    def discard_pending(self):
+        """丢掉没用上的记录：崩溃时抽取结果已经写入、使用它的操作却没来得及写入"""
+        self._expected.clear()
+
+    def getstate(self):
+        return self._rng.getstate()
+
+    def setstate(self, state):
+        """state 可以是从 JSON 读回的列表"""
+        version, internal, gauss = state
+        self._rng.setstate((version, tuple(internal), gauss))
+
+    def _draw(self, method:str, *args):
+        value = getattr(self._rng, method)(*args)
+        if self._expected:
+            expected = self._expected.popleft()
+            if expected != value:
+                self.divergences += 1
+                if self.strict:
+                    raise ReplayDivergence(f"{method}{args} 重新生成 {value!r}，日志记录为 {expected!r}")
+                value = expected
+        elif self.on_draw is not None:
+            self.on_draw(value)
+        return value
+
+    def randrange(self, *args):
+        return self._draw('randrange', *args)
+
+    def choice(self, seq):
+        return self._draw('choice', seq)
+
+# ---------- 状态快照 ----------
+
+def dump_state(state:rules.GameState) -> Dict:
+    return {
+        "epoch": state.epoch,
+        "phase": state.phase,
+        "values": dict(state.resource_values),
+        "market": state.market.to_list(),
+        "deck": state.current_deck.to_dict(),
+        "event_immunity": list(state.event_immunitie),
+        "tmp_cnt_take": dict(state.tmp_cnt_take),
+        "finished": sorted(state.finished),
+        "exchanged": sorted(state.exchanged),
+        "mined": sorted(state.mined),
+        "bids": list(state.bids),
+        "players": {
+            name: {
+                "action_points": player.action_points,
+                "resources": player.resources.to_dict(),
+                "buildings": list(player.buildings),
+                "bank_money": player.bank_money,
+            } for name, player in state.players.items()
+        },
+    }
+
+def restore_state(state:rules.GameState, data:Dict, new_player:Callable[[], rules.PlayerState]=rules.PlayerState):
+    """
+    把 dump_state 的结果恢复到一个新建的状态上
+    :param new_player: 创建玩家对象，服务器用它创建还没有重连的玩家
+    """
+    state.epoch = data["epoch"]
+    state.phase = data["phase"]
+    # 逐项赋值，服务器的资源价值容器要据此重算得分
+    for res, value in data["values"].items():
+        state.resource_values[res] = value
+    state.market.extend(data["market"])
+    state.current_deck.restore(data["deck"])
+    state.event_immunitie = list(data["event_immunity"])
+    state.tmp_cnt_take = defaultdict(int, data["tmp_cnt_take"])
+    state.finished = set(data["finished"])
+    state.exchanged = set(data["exchanged"])
+    state.mined = set(data["mined"])
+    state.bids = list(data["bids"])
+    for name, saved in data["players"].items():
+        player = new_player()
+        player.resources = rules.Inventory(saved["resources"])
+        player.action_points = saved["action_points"]
+        player.buildings = rules.Buildings(saved["buildings"])
+        player.bank_money = saved["bank_money"]
+        state.players[name] = player
+
+# ---------- 操作 ----------
+
+def apply(state:rules.GameState, op:str, args:Dict):
+    """
+    执行一条操作记录对应的规则调用，服务器正常游戏和恢复时都走这里
+    自动阶段（3价值波动、4事件卡和结束本轮）和进入阶段合成一条记录，恢复后从下一个阶段继续
+    :return: 规则产生的消息，玩家操作返回 rules.Outcome
+    """
+    match op:
+        case "start":
+            return rules.start_game(state)
+        case "phase":
+            phase = args["phase"]
+            events = rules.enter_phase(state, phase)
+            if phase == 3:
+                events += rules.update_resource_values(state)
+            elif phase == 4:
+                events += rules.trigger_event_card(state)
+                rules.end_epoch(state)
+            return events
+        case "investment":
+            return rules.investment(state, args["player"], args["action"])
+        case "investments":
+            return rules.investments(state, args["player"], args["actions"])
+        case "bid":
+            return rules.bid(state, args["player"], args["amount"])
+        case "take":
+            return rules.take(state, args["player"], args["bid"], args["want"])
+        case "give":
+            state.players[args["player"]].resources[args["resource"]] += args["amount"]
+        case "build":
+            state.players[args["player"]].buildings.append(args["building"])
+        case "leave":
+            del state.players[args["player"]]
+        case _:
+            raise ValueError(f"unknown journal op {op!r}")
+    return []
+
+def apply_record(state:rules.GameState, record:Dict):
+    """执行一条 rng 或 op 记录，返回 op 的结果"""
+    if record["t"] == "rng":
+        state.rng.expect(record["v"])
+    elif record["t"] == "op":
+        args = dict(record)
+        del args["t"], args["op"]
+        return apply(state, record["op"], args)
+
+def replay(state:rules.GameState, records:List[Dict]):
+    """在 restore_state 之后按顺序重新执行快照后面的记录，state.rng 需要是 JournalRandom"""
+    for record in records:
+        apply_record(state, record)
+    state.rng.discard_pending()
+
+# ---------- 文件 ----------
+
+def path_for(room:str) -> str:
+    return os.path.join(JOURNAL_DIR, quote(room, safe="") + SUFFIX)
+
+def list_logs() -> List[str]:
+    if not JOURNAL_DIR or not os.path.isdir(JOURNAL_DIR):
+        return []
+    return [os.path.join(JOURNAL_DIR, name) for name in sorted(os.listdir(JOURNAL_DIR)) if name.endswith(SUFFIX)]
+
+def iter_records(path:str):
+    """依次读出日志里的每条记录，崩溃时写了一半的最后一行会被忽略"""
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+            except ValueError:
+                return
+            yield record
+
+def read(path:str) -> Tuple[Dict, Dict, List[Dict]]:
+    """
+    :return: (meta, 最后一份快照记录, 快照之后的记录)
+    """
+    meta, snapshot, records = None, None, []
+    for record in iter_records(path):
+        match record["t"]:
+            case "meta":
+                meta = record
+            case "snapshot":
+                snapshot, records = record, []
+            case _:
+                records.append(record)
+    return meta, snapshot, records
+
+def snapshot_record(state:rules.GameState, **extra) -> Dict:
+    return {"t": "snapshot", "state": dump_state(state), "rng": state.rng.getstate(), **extra}
+
+class Journal:
+    """
+    一个房间的日志文件，append 只放进缓冲区，本轮事件循环结束前合并成一次写入
+    :param meta: 房间信息，每次压缩都写在文件开头
+    """
+    def __init__(self, path:str, meta:Dict, fsync:str=FSYNC):
+        self.path = path
+        self.meta = {"t": "meta", **meta}
+        self.fsync = fsync
+        self._buffer = []
+        self._flush_scheduled = False
+        self._last_sync = 0.0
+        self._sync_timer = None
+        self._fd = None
+
+    @classmethod
+    def create(cls, room:str, meta:Dict, state:rules.GameState):
+        """开局时新建日志，写入开局状态的快照；没有配置日志目录时返回 None"""
+        if not JOURNAL_DIR:
+            return None
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        journal = cls(path_for(room), meta)
+        journal._rewrite(snapshot_record(state, initial=True))
+        return journal
+
+    def append(self, record:Dict):
+        self._buffer.append(encode(record))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if not self._buffer or self._fd is None:
+            return
+        data, self._buffer = b"".join(self._buffer), []
+        os.write(self._fd, data)
+        if self.fsync == "always":
+            self._sync()
+        elif self.fsync == "interval" and self._sync_timer is None:
+            delay = self._last_sync + FSYNC_INTERVAL - time.monotonic()
+            if delay <= 0:
+                self._sync()
+            else:
+                self._sync_timer = asyncio.get_running_loop().call_later(delay, self._sync)
+
+    def _sync(self):
+        self._sync_timer = None
+        self._last_sync = time.monotonic()
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+    def compact(self, state:rules.GameState):
+        """
+        用当前状态的快照替换整个日志；保留完整记录（RSIARCHIVE）时只在末尾追加一份快照，
+        恢复时从最后一份快照开始，重放时用它们检查中途的状态
+        """
+        if ARCHIVE_DIR:
+            # 从日志恢复的房间还没有打开文件，接着原来的记录往后追加
+            self._open()
+            self.append(snapshot_record(state))
+            self.flush()
+        else:
+            self._rewrite(snapshot_record(state))
+
+    def _rewrite(self, snapshot:Dict):
+        """先写临时文件再原子替换，中途崩溃时旧日志仍然完整"""
+        self._buffer.clear()
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(encode(self.meta) + encode(snapshot))
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._open()
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def close(self, remove:bool=False):
+        """
+        :param remove: 对局已经正常结束，不再需要恢复，删除日志文件（或者移到 RSIARCHIVE）
+        """
+        if self._fd is None:
+            return
+        self.flush()
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+        if not remove and self.fsync != "never":
+            self._sync()
+        os.close(self._fd)
+        self._fd = None
+        if remove and ARCHIVE_DIR:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            name = f"{self.meta['room']}-{self.meta['seed']}"
+            os.replace(self.path, os.path.join(ARCHIVE_DIR, quote(name, safe="") + SUFFIX))
+        elif remove:
+            os.remove(self.path)
@@ -0,0 +1,117 @@
+"""
+对局重放工具：不经过网络，按房间日志重新执行一整局，用来复现和定位线上问题
+用法:
+    python replay.py journal/default.log                 重放并核对，输出最后的轮次和排行榜
+    python replay.py archive/default-123.log --trace     打印每条操作和它产生的消息
+    python replay.py default.log --until 500 --dump      只执行到日志第500行，输出那一刻的完整状态
+    python replay.py default.log --repeat 100            重复重放，测量重放速度
+日志从开局快照开始时（设置了 RSIARCHIVE 保存下来的完整记录），按 meta 里的种子和座位顺序从头开局，
+并和开局快照核对；日志被压缩过时从第一份快照（带随机数生成器的状态）开始。
+每次随机抽取都重新生成并和记录的结果比对，每遇到一份快照都和重放得到的状态比对，
+第一次不一致时报告所在的行并返回 1
+"""
+import argparse
+import dataclasses
+import json
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import journal
+import rules
+import valuation
+
+def load(path:str) -> Tuple[Dict, List[Dict]]:
+    """:return: (meta, meta 之后的全部记录)"""
+    records = list(journal.iter_records(path))
+    if not records or records[0]["t"] != "meta" or len(records) < 2 or records[1]["t"] != "snapshot":
+        raise ValueError(f"{path} 不是完整的房间日志")
+    return records[0], records[1:]
+
+def _normalize(data):
+    """统一成从 JSON 读回的形式（元组变列表），和日志里的快照比较"""
+    return json.loads(json.dumps(data))
+
+def initial_state(meta:Dict, snapshot:Dict) -> rules.GameState:
+    """按 meta 和第一份快照构造重放的起点，随机数生成器是严格模式"""
+    ruleset = dataclasses.replace(rules.DEFAULT_RULESET, **meta["ruleset"])
+    state = rules.GameState(ruleset, rng=journal.JournalRandom(meta["seed"], strict=True))
+    if snapshot.get("initial"):
+        for name in meta["players"]:
+            state.players[name] = rules.PlayerState()
+        journal.apply(state, "start", {})
+    else:
+        journal.restore_state(state, snapshot["state"])
+        state.rng.setstate(snapshot["rng"])
+    return state
+
+def check_snapshot(state:rules.GameState, snapshot:Dict, line:int):
+    """重放得到的状态和日志里的快照不一致时抛出 ReplayDivergence"""
+    dumped = _normalize(journal.dump_state(state))
+    diff = [key for key in snapshot["state"] if dumped.get(key) != snapshot["state"][key]]
+    if _normalize(state.rng.getstate()) != snapshot["rng"]:
+        diff.append("rng")
+    if diff:
+        raise journal.ReplayDivergence(f"第{line}行的快照和重放结果不一致: {', '.join(diff)}")
+
+def run(meta:Dict, records:List[Dict], until:int=None, trace:bool=False) -> Tuple[rules.GameState, int]:
+    """
+    从头重放到 until 行（日志的行号，meta 是第1行）
+    :return: (重放后的状态, 核对过的快照数)
+    """
+    state = initial_state(meta, records[0])
+    checked = 0
+    for line, record in enumerate(records, 2):
+        if until is not None and line > until:
+            break
+        try:
+            if record["t"] == "snapshot":
+                check_snapshot(state, record, line)
+                checked += 1
+                continue
+            result = journal.apply_record(state, record)
+        except journal.ReplayDivergence as e:
+            raise journal.ReplayDivergence(f"第{line}行: {e}") from None
+        if trace and record["t"] == "op":
+            args = {k: v for k, v in record.items() if k not in ("t", "op")}
+            print(f"{line:>6} [{state.epoch}-{state.phase}] {record['op']} {json.dumps(args, ensure_ascii=False)}")
+            if isinstance(result, rules.Outcome):
+                print(f"{'':>8}-> {json.dumps(result.reply, ensure_ascii=False)}")
+                result = result.events
+            for recipient, message in result or []:
+                print(f"{'':>8}{recipient or '*'}: {json.dumps(message, ensure_ascii=False)}")
+    return state, checked
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='房间日志文件')
+    parser.add_argument('--until', type=int, help='只执行到日志的第几行')
+    parser.add_argument('--trace', action='store_true', help='打印每条操作和它产生的消息')
+    parser.add_argument('--dump', action='store_true', help='输出重放结束时的完整状态（JSON）')
+    parser.add_argument('--repeat', type=int, default=1, help='重复重放的次数，用来测量速度')
+    args = parser.parse_args()
+
+    meta, records = load(args.log)
+    print(f"房间 {meta['room']}  种子 {meta['seed']}  座位 {', '.join(meta['players'])}  "
+          f"{'开局' if records[0].get('initial') else '压缩后的快照'}起，共 {len(records)} 条记录")
+    start = time.perf_counter()
+    try:
+        for i in range(args.repeat):
+            state, checked = run(meta, records, args.until, args.trace and i == 0)
+    except journal.ReplayDivergence as e:
+        print(f"重放不一致: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    print(f"重放到第 {state.epoch} 轮阶段 {state.phase}，核对了 {checked} 份快照，全部一致"
+          f"{'，游戏已结束' if rules.game_over(state) else ''}")
+    if args.repeat > 1:
+        print(f"{args.repeat} 次用时 {elapsed:.2f}s（{len(records) * args.repeat / elapsed:.0f} 条记录/s）")
+    dumped = journal.dump_state(state)
+    for row in valuation.leaderboard(dumped["players"], state.resource_values):
+        print(f"  {row['rank']:>2}. {row['player']}  {row['score']}")
+    if args.dump:
+        print(json.dumps(dumped, ensure_ascii=False, indent=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+from collections import deque
+from itertools import islice
+
+INF = float('inf')
+
+class ResourceValueCalculator:
+    """
+    等值物资计算器（服务端和客户端共用）
+    使用单调队列优化的有界背包：每种资源一遍 O(价值上限)，不再为每个数量复制组合字典
+    """
+    def __init__(self, resource_values):
+        self.resource_values = resource_values
+
+    def _available(self, player_resources):
+        # 过滤掉零值资源和保留卡
+        return [
+            (res, self.resource_values.get(res, 0), qty)
+            for res, qty in player_resources.items()
+            if qty > 0 and not res.startswith('保留') and self.resource_values.get(res, 0) > 0
+        ]
+
+    @staticmethod
+    def _solve(items, limit):
+        """
+        有界背包：求凑出每个价值 0..limit 最少需要几种资源
+        :return: (types, choices) types[s] 为凑出价值s的最少资源种类数，choices[i][s] 为第i种资源用了几个
+        """
+        types = [0] + [INF] * limit
+        choices = []
+        for _, value, qty in items:
+            qty = min(qty, limit // value)
+            new_types = types[:]
+            choice = [0] * (limit + 1)
+            if qty:
+                # 按余数分组，每组内是一个长度为qty的滑动窗口取最小值
+                for r in range(min(value, limit + 1)):
+                    window = deque()
+                    j = 0
+                    for s in range(r, limit + 1, value):
+                        while window and window[0] < j - qty:
+                            window.popleft()
+                        if window:
+                            best = window[0]
+                            cand = types[r + best * value] + 1
+                            if cand < new_types[s]:
+                                new_types[s] = cand
+                                choice[s] = j - best
+                        cur = types[s]
+                        if cur != INF:
+                            while window and types[r + window[-1] * value] >= cur:
+                                window.pop()
+                            window.append(j)
+                        j += 1
+            types = new_types
+            choices.append(choice)
+        return types, choices
+
+    @staticmethod
+    def _rebuild(items, choices, total):
+        combo = {}
+        for (res, value, _), choice in zip(reversed(items), reversed(choices)):
+            qty = choice[total]
+            if qty:
+                combo[res] = qty
+                total -= qty * value
+        return combo
+
+    def iter_combinations(self, player_resources, target_value):
+        """
+        按最接近目标值的顺序惰性地产出可行组合，每个总价值只给出资源种类最少的一个组合
+        :param player_resources: 玩家当前资源 {'钻石':1, '铁':3}
+        :param target_value: 需要匹配的目标价值
+        """
+        items = self._available(player_resources)
+        total = sum(value * qty for _, value, qty in items)
+        target_value = max(target_value, 0)
+        if target_value > total:
+            return
+        # 最优组合的总价值一定小于 目标值+单个资源最大价值
+        max_value = max((value for _, value, _ in items), default=1)
+        lower, limit = target_value, min(total, target_value + max_value - 1)
+        while True:
+            types, choices = self._solve(items, limit)
+            for s in range(lower, limit + 1):
+                if types[s] != INF:
+                    yield {
+                        'resources': self._rebuild(items, choices, s),
+                        'total_value': s,
+                        'difference': s - target_value
+                    }
+            if limit >= total:
+                return
+            lower, limit = limit + 1, min(total, limit * 2 + 1)
+
+    def best_combination(self, player_resources, target_value):
+        """
+        计算最接近目标值的等值物资组合
+        :return: {'resources':..., 'total_value':..., 'difference':...}，无法凑出时返回 None
+        """
+        return next(self.iter_combinations(player_resources, target_value), None)
+
+    def best_combinations(self, player_resources, targets):
+        """
+        一次背包求出多个目标值各自最接近的组合，结果和对每个目标分别调用 best_combination 相同：
+        背包表的前缀和上限无关，按最大的目标求一次就能覆盖所有目标
+        :param targets: 目标价值的集合
+        :return: {目标价值: {'resources':..., 'total_value':..., 'difference':...} 或 None}
+        """
+        items = self._available(player_resources)
+        total = sum(value * qty for _, value, qty in items)
+        max_value = max((value for _, value, _ in items), default=1)
+        result = dict.fromkeys(targets)
+        reachable = [t for t in result if max(t, 0) <= total]
+        if not reachable:
+            return result
+        limit = min(total, max(max(t, 0) for t in reachable) + max_value - 1)
+        types, choices = self._solve(items, limit)
+        for t in reachable:
+            target = max(t, 0)
+            # 总价值不少于目标时，目标 + 最大单价 - 1 以内一定有解
+            for s in range(target, min(limit, target + max_value - 1) + 1):
+                if types[s] != INF:
+                    result[t] = {
+                        'resources': self._rebuild(items, choices, s),
+                        'total_value': s,
+                        'difference': s - target
+                    }
+                    break
+        return result
+
+    def calculate_equivalent_resources(self, player_resources, target_value, top_k=1):
+        """
+        计算等值物资组合
+        :param player_resources: 玩家当前资源 {'钻石':1, '铁':3}
+        :param target_value: 需要匹配的目标价值
+        :param top_k: 最多返回几个组合，None 表示全部
+        :return: 可行的资源组合列表，按最接近目标值排序
+        """
+        return list(islice(self.iter_combinations(player_resources, target_value), top_k))
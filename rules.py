@@ -0,0 +1,832 @@
+"""
+游戏规则核心（服务端、客户端和模拟器共用）
+纯同步，不做任何网络I/O。每个规则函数直接修改传入的 GameState，并返回要发出的消息：
+    events: [(接收者, 消息)]，接收者为 None 表示广播给所有玩家
+    玩家操作返回 Outcome，其中 reply 是回复给操作者本人的消息
+服务器负责把消息发出去，模拟器可以直接丢弃
+"""
+import dataclasses
+import functools
+import random
+from array import array
+from collections import defaultdict
+from itertools import repeat
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from deck import Deck, Market
+from resource_calculator import ResourceValueCalculator
+
+ALL_BUILDINGS = [
+    '矿机', '农场', '伐木场',
+    '铁镐', '农田', '高级伐木场',
+    '高级矿机', '无敌农场', '银行', '炮台'
+]
+ALL_RESOURCES = [
+    '金币', '木材', '矿石', '食物',
+    '钻石', '铁'
+]
+MINERALS = ['钻石', '金币', '铁', '矿石']
+RESOURCE_INDEX = {res: i for i, res in enumerate(ALL_RESOURCES)}
+BUILDING_INDEX = {building: i for i, building in enumerate(ALL_BUILDINGS)}
+
+# 投资失败的原因
+NOT_ENOUGH = 1          # 行动点不足/耗材不足
+OUT_OF_RANGE = 2        # 物品，建筑不在所有物品范围内
+BAD_INDEX = 3           # 下标错误
+UNKNOWN_ACTION = 4      # 行动不存在
+TOO_MANY = 5            # 采集数量超限
+# 拿取失败的原因
+TAKEN = 1               # 物品被他人拿取
+NO_POINTS = 2           # 行动点不足
+
+class RecipeBook:
+    """
+    编译好的配方依赖图，每个规则参数只编译一次（Ruleset.recipe_book）
+        resources   建筑 -> 资源部分 {资源: 数量}，折合的价值随资源价值变化，用 cost 计算
+        buildings   建筑 -> 建造时消耗的前置建筑 {建筑: 数量}
+        chain       建筑 -> 全部直接和间接的前置建筑，从最底层开始（高级矿机: [铁镐, 矿机]）
+        order       所有可建造的建筑，前置建筑排在前面
+    plans 一次背包求出所有建筑资源部分的支付方案，按 (库存指纹, 资源价值指纹) 缓存，
+    库存或资源价值一变指纹就不同，不会用到过期的结果
+    :param recipes: Ruleset.recipes，出现未知物品或循环依赖时抛出 ValueError
+    """
+    PLAN_CACHE_SIZE = 4096
+
+    def __init__(self, recipes:Dict[str, Dict[str, int]]):
+        self.resources: Dict[str, Dict[str, int]] = {}
+        self.buildings: Dict[str, Dict[str, int]] = {}
+        for building, recipe in recipes.items():
+            self.resources[building] = {k: v for k, v in recipe.items() if k in ALL_RESOURCES}
+            self.buildings[building] = {k: v for k, v in recipe.items() if k in ALL_BUILDINGS}
+            unknown = recipe.keys() - self.resources[building].keys() - self.buildings[building].keys()
+            if unknown:
+                raise ValueError(f"配方 {building} 里有未知的物品: {', '.join(unknown)}")
+        self.order: List[str] = []
+        self.chain: Dict[str, List[str]] = {}
+        for building in recipes:
+            self._visit(building, ())
+        self._plans = {}
+
+    def _visit(self, building:str, path:Tuple[str, ...]):
+        if building in path:
+            raise ValueError(f"配方循环依赖: {' ← '.join(path + (building,))}")
+        if building in self.chain:
+            return
+        chain = []
+        for required in self.buildings.get(building, {}):
+            if required in self.buildings:
+                self._visit(required, path + (building,))
+                chain += [b for b in self.chain[required] if b not in chain]
+            if required not in chain:
+                chain.append(required)
+        self.chain[building] = chain
+        if building in self.buildings:
+            self.order.append(building)
+
+    def cost(self, building:str, values:Dict[str, int]) -> int:
+        """资源部分折合的价值"""
+        return sum(values[k] * v for k, v in self.resources[building].items())
+
+    def plans(self, resources:Dict[str, int], values:Dict[str, int]) -> Dict[str, Optional[Dict[str, int]]]:
+        """
+        只看资源：每个建筑的资源部分用哪些资源支付，支付不起时为 None，不检查前置建筑
+        返回的是缓存里的结果，不能修改
+        """
+        # 按固定的资源顺序取指纹，也按这个顺序求解：同样的库存不管字典顺序如何都得到同一个方案，
+        # 缓存被哪个房间先填上都不影响结果，重放时才能完全一致
+        counts = tuple(resources.get(res, 0) for res in ALL_RESOURCES)
+        key = (counts, tuple(values.get(res, 0) for res in ALL_RESOURCES))
+        plans = self._plans.get(key)
+        if plans is None:
+            costs = {building: self.cost(building, values) for building in self.order}
+            best = ResourceValueCalculator(values).best_combinations(dict(zip(ALL_RESOURCES, counts)),
+                                                                     set(costs.values()))
+            plans = {building: None if best[cost] is None else best[cost]['resources']
+                     for building, cost in costs.items()}
+            if len(self._plans) >= self.PLAN_CACHE_SIZE:
+                self._plans.clear()
+            self._plans[key] = plans
+        return plans
+
+    def __getstate__(self):
+        # 复制到模拟器的子进程时不带缓存
+        state = dict(self.__dict__)
+        state['_plans'] = {}
+        return state
+
+@dataclasses.dataclass
+class Ruleset:
+    """可调整的规则参数，模拟器用它比较不同配置下的平衡性"""
+    resource_deck: Dict[str, int] = dataclasses.field(default_factory=lambda: {
+        '金币': 10, '木材': 100,
+        '矿石': 200, '食物': 200,
+        '钻石': 10, '铁': 300,
+    })
+    resource_values: Dict[str, int] = dataclasses.field(default_factory=lambda: {
+        '钻石': 8, '金币': 6, '木材': 2,
+        '矿石': 3, '食物': 1, '铁': 2
+    })
+    recipes: Dict[str, Dict[str, int]] = dataclasses.field(default_factory=lambda: {
+        "矿机": {"铁": 5, "铁镐": 1},
+        "炮台": {"金币": 2},
+        "伐木场": {"铁镐": 1, "铁": 4},
+        "铁镐": {"铁": 2},
+        "高级矿机": {"矿机": 1, "金币": 2},
+        "高级伐木场": {"伐木场": 1, "金币": 2},
+        "农场": {"金币": 3},
+        "无敌农场": {"农场": 1, "金币": 8},
+        "银行": {"金币": 2}
+    })
+    ore_choices: List[str] = dataclasses.field(default_factory=lambda: [
+        '钻石', '金币',
+        '铁', '铁', '铁', '铁', '铁',
+        '无', '无', '无'
+    ])
+    event_deck: List[str] = dataclasses.field(default_factory=lambda: [
+        '火山爆发', '海盗掠夺', '海盗掠夺', '天降饥荒',
+        '天降饥荒', '出现宝藏', '祝福事件', '祝福事件'
+    ])
+    event_epochs: List[int] = dataclasses.field(default_factory=lambda: [3, 6, 9, 13, 15, 18, 21, 23, 25, 27])
+    event_immunity: List[int] = dataclasses.field(default_factory=lambda: [3, 6, 9, 13, 15])
+    max_epoch: int = 30
+    initial_market: int = 20
+    initial_food: int = 10
+    value_update_interval: int = 3      # 每隔几轮波动一次价值
+    value_drop_threshold: int = 5       # 累计被拿取多少个后价值-1
+
+    @functools.cached_property
+    def recipe_book(self) -> RecipeBook:
+        """编译好的配方，规则参数视为不可变，要改配方请用 dataclasses.replace 生成新的 Ruleset"""
+        return RecipeBook(self.recipes)
+
+DEFAULT_RULESET = Ruleset()
+
+class _Counts:
+    """
+    按固定下标记录数量的 array('i')。copy() 和原对象共用同一个数组，
+    哪一方先修改才真正复制（写时复制），没有修改的快照不占额外的数组
+    """
+    __slots__ = ('_counts', '_shared', 'on_change')
+
+    @property
+    def counts(self) -> array:
+        """按下标排列的数量，只能读：修改要通过容器自己的方法，否则写时复制和 on_change 都会失效"""
+        return self._counts
+
+    def _writable(self) -> array:
+        if self._shared:
+            self._counts = array('i', self._counts)
+            self._shared = False
+        return self._counts
+
+    def copy(self):
+        """写时复制的副本，不带 on_change"""
+        clone = object.__new__(type(self))
+        clone._counts = self._counts
+        clone._shared = self._shared = True
+        clone.on_change = None
+        return clone
+
+class Inventory(_Counts):
+    """
+    玩家的资源：按 RESOURCE_INDEX 的下标记录每种资源的数量，用法和原来的 defaultdict(int) 一样，
+    迭代时按 ALL_RESOURCES 的顺序给出全部资源（没有的数量为0）。只能存放 ALL_RESOURCES 里的资源
+    :param on_change: 某种资源数量变化时调用 on_change(资源, 差值)，排行榜用它维护得分
+    """
+    __slots__ = ()
+
+    def __init__(self, items:Mapping[str, int]=(), on_change:Callable[[str, int], None]=None):
+        self._counts = array('i', bytes(4 * len(ALL_RESOURCES)))
+        self._shared = False
+        self.on_change = None
+        self.update(items)
+        self.on_change = on_change
+
+    def _index(self, res:str) -> int:
+        index = RESOURCE_INDEX.get(res)
+        if index is None:
+            raise KeyError(res)
+        return index
+
+    def __getitem__(self, res:str) -> int:
+        return self._counts[self._index(res)]
+
+    def __setitem__(self, res:str, qty:int):
+        index = self._index(res)
+        delta = qty - self._counts[index]
+        if delta:
+            self._writable()[index] = qty
+            if self.on_change is not None:
+                self.on_change(res, delta)
+
+    def __delitem__(self, res:str):
+        self[res] = 0
+
+    def __len__(self):
+        return len(ALL_RESOURCES)
+
+    def __iter__(self):
+        return iter(ALL_RESOURCES)
+
+    def __contains__(self, res:str):
+        return res in RESOURCE_INDEX
+
+    def __eq__(self, other):
+        if not isinstance(other, Inventory):
+            return NotImplemented
+        return self._counts == other._counts
+
+    def __repr__(self):
+        return f"Inventory({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # 复制或序列化出去的不带 on_change
+        return Inventory, (self.to_dict(),)
+
+    def get(self, res:str, default=None):
+        index = RESOURCE_INDEX.get(res)
+        return default if index is None else self._counts[index]
+
+    def keys(self):
+        return iter(ALL_RESOURCES)
+
+    def values(self):
+        return iter(self._counts)
+
+    def items(self):
+        return zip(ALL_RESOURCES, self._counts)
+
+    def update(self, items:Mapping[str, int]=(), **kwargs):
+        for res, qty in dict(items, **kwargs).items():
+            self[res] = qty
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(zip(ALL_RESOURCES, self._counts))
+
+class Buildings(_Counts):
+    """
+    玩家的建筑：按 BUILDING_INDEX 的下标记录每种建筑有几个，
+    有没有、有几个、加一个、消耗一个都是 O(1)，不用扫描列表。
+    迭代时按 ALL_BUILDINGS 的顺序逐个给出，同一种建筑有几个就给出几次，推送和日志里仍然是列表
+    :param on_change: 建筑总数变化时调用 on_change(差值)，排行榜用它维护得分
+    """
+    __slots__ = ('_total',)
+
+    def __init__(self, items:Iterable[str]=(), on_change:Callable[[int], None]=None):
+        self._counts = array('i', bytes(4 * len(ALL_BUILDINGS)))
+        self._shared = False
+        self._total = 0
+        self.on_change = None
+        for building in items:
+            self._add(building, 1)
+        self.on_change = on_change
+
+    def _add(self, building:str, delta:int):
+        index = BUILDING_INDEX.get(building)
+        if index is None:
+            raise ValueError(f"未知的建筑 {building}")
+        self._writable()[index] += delta
+        self._total += delta
+        if self.on_change is not None:
+            self.on_change(delta)
+
+    def copy(self) -> 'Buildings':
+        clone = super().copy()
+        clone._total = self._total
+        return clone
+
+    def __len__(self):
+        return self._total
+
+    def __contains__(self, building:str):
+        index = BUILDING_INDEX.get(building)
+        return index is not None and self._counts[index] > 0
+
+    def __iter__(self):
+        for building, count in zip(ALL_BUILDINGS, self._counts):
+            yield from repeat(building, count)
+
+    def __eq__(self, other):
+        if not isinstance(other, Buildings):
+            return NotImplemented
+        return self._counts == other._counts
+
+    def __repr__(self):
+        return f"Buildings({self.to_list()!r})"
+
+    def __reduce__(self):
+        # 复制或序列化出去的不带 on_change
+        return Buildings, (self.to_list(),)
+
+    def count(self, building:str) -> int:
+        index = BUILDING_INDEX.get(building)
+        return 0 if index is None else self._counts[index]
+
+    def append(self, building:str):
+        self._add(building, 1)
+
+    def extend(self, buildings:Iterable[str]):
+        for building in buildings:
+            self._add(building, 1)
+
+    def remove(self, building:str):
+        """消耗一个建筑，没有时抛出 ValueError"""
+        if building not in self:
+            raise ValueError(f"{building} not in buildings")
+        self._add(building, -1)
+
+    def to_list(self) -> List[str]:
+        return list(self)
+
+class PlayerState:
+    """
+    一个玩家的规则状态，资源和建筑都是定长的整数数组（Inventory、Buildings）
+    转换成 JSON 只在推送、接口和日志这些边界上进行（Inventory.to_dict、Buildings.to_list）
+    """
+    __slots__ = ('resources', 'action_points', 'buildings', 'bank_money')
+
+    def __init__(self, resources:Mapping[str, int]=(), action_points:int=3,
+                 buildings:Iterable[str]=(), bank_money:int=0):
+        self.resources = Inventory(resources)
+        self.action_points = action_points
+        self.buildings = Buildings(buildings)
+        self.bank_money = bank_money
+
+    def __repr__(self):
+        return (f"PlayerState(resources={self.resources.to_dict()!r}, action_points={self.action_points!r}, "
+                f"buildings={self.buildings.to_list()!r}, bank_money={self.bank_money!r})")
+
+    def same_as(self, other:'PlayerState') -> bool:
+        """推送给客户端的内容是否相同"""
+        return (self.action_points == other.action_points and self.bank_money == other.bank_money
+                and self.resources == other.resources and self.buildings == other.buildings)
+
+    def copy(self) -> 'PlayerState':
+        """
+        写时复制的快照，总是普通的 PlayerState（服务器的玩家复制出来不带连接，也不属于排行榜）
+        资源和建筑的数组在任何一方修改之前都是共用的
+        """
+        clone = object.__new__(PlayerState)
+        clone.resources = self.resources.copy()
+        clone.action_points = self.action_points
+        clone.buildings = self.buildings.copy()
+        clone.bank_money = self.bank_money
+        return clone
+
+class GameState:
+    """
+    一局游戏的全部规则状态
+    :param ruleset: 规则参数，默认使用 DEFAULT_RULESET
+    :param rng: 随机数来源，洗牌、开盲盒和事件卡都从这里取
+    """
+    __slots__ = ('ruleset', 'rng', 'players', 'market', 'event_immunitie', 'current_deck', 'epoch', 'phase',
+                 'resource_values', 'tmp_cnt_take', 'finished', 'exchanged', 'mined', 'bids')
+
+    def __init__(self, ruleset:Ruleset=None, rng=random):
+        self.ruleset = ruleset or DEFAULT_RULESET
+        self.rng = rng
+        self.players: Dict[str, PlayerState] = {}
+        self.market: Market = Market()
+        self.event_immunitie = list(self.ruleset.event_immunity)
+        self.current_deck: Deck = Deck(rng)
+        self.epoch = 1
+        self.phase = 1
+        self.resource_values = dict(self.ruleset.resource_values)
+        self.tmp_cnt_take = defaultdict(int)
+        # 当前阶段的进度
+        self.finished = set()       # 本阶段已经结束操作的玩家（拿取阶段为已经拿完的竞标者）
+        self.exchanged = set()      # 本轮已经兑换过行动点的玩家
+        self.mined = set()          # 本轮已经用高级矿机挖过矿的玩家
+        self.bids: List[Dict] = []  # 本轮非0的出价 {"player":..., "bid":...}
+
+    def copy(self) -> 'GameState':
+        """
+        独立的规则状态副本（总是 rules.GameState）。玩家写时复制，其余的容器都很小，直接复制；
+        随机数生成器复制当前状态，副本里的抽取不影响原来的对局
+        """
+        # 马上就要 setstate，跳过 __init__ 里从系统熵源播种的开销
+        rng = random.Random.__new__(random.Random)
+        rng.setstate(self.rng.getstate())
+        clone = object.__new__(GameState)
+        clone.ruleset = self.ruleset
+        clone.rng = rng
+        clone.players = {name: player.copy() for name, player in self.players.items()}
+        clone.market = self.market.copy()
+        clone.event_immunitie = list(self.event_immunitie)
+        clone.current_deck = self.current_deck.copy(rng)
+        clone.epoch = self.epoch
+        clone.phase = self.phase
+        clone.resource_values = dict(self.resource_values)
+        clone.tmp_cnt_take = defaultdict(int, self.tmp_cnt_take)
+        clone.finished = set(self.finished)
+        clone.exchanged = set(self.exchanged)
+        clone.mined = set(self.mined)
+        clone.bids = [dict(bid) for bid in self.bids]
+        return clone
+
+def load_state(snapshot:Dict, ruleset:Ruleset=None) -> GameState:
+    """
+    从房间快照（/game/{room}/snapshot 或推送的完整状态）构造规则状态
+    客户端和机器人用它在本地预览或评估操作，牌堆不在快照里，构造出来是空的
+    """
+    state = GameState(ruleset)
+    state.epoch = snapshot['epoch']
+    state.phase = snapshot['phase']
+    state.resource_values = dict(snapshot['values'])
+    state.market.extend(snapshot['market'])
+    for name, data in snapshot['players'].items():
+        state.players[name] = PlayerState(
+            resources=data['resources'],
+            action_points=data['action_points'],
+            buildings=data['buildings'],
+            bank_money=data['bank_money'],
+        )
+    return state
+
+Event = Tuple[Optional[str], Dict]
+
+class Outcome(NamedTuple):
+    reply: Dict             # 回复给操作者的消息
+    events: List[Event]     # 需要额外发出的消息
+    done: bool              # 操作者在本阶段（拿取阶段为本次拿取）是否已经结束
+
+def notify(kind:str, **target) -> Dict:
+    return {"type": "notify", "target": {"type": kind, **target}}
+
+def error(kind:str, **target) -> Dict:
+    return {"type": "error", "target": {"type": kind, **target}}
+
+# ---------- 牌堆和市场 ----------
+
+def shuffle_deck(state:GameState):
+    state.current_deck.refill(state.ruleset.resource_deck)
+
+def draw_cards(state:GameState, num:int) -> List[str]:
+    """从牌堆抽取指定数量的卡，抽空了就重新洗牌"""
+    drawn = []
+    for _ in range(num):
+        if not state.current_deck:
+            shuffle_deck(state)
+        if state.current_deck:
+            drawn.append(state.current_deck.draw())
+    return drawn
+
+def refresh_market(state:GameState) -> List[Event]:
+    """市场只剩一种物品时全部放回牌堆；市场为空时所有还有行动点的玩家强制探索一次"""
+    events = []
+    if state.market.kinds() == 1:
+        events.append((None, error("market_error")))
+        state.current_deck.extend(state.market.clear())
+    if not state.market:
+        events.append((None, error("market_empty")))
+        for player in state.players.values():
+            if player.action_points:
+                player.action_points -= 1
+                state.market.extend(draw_cards(state, 2))
+    return events
+
+# ---------- 流程 ----------
+
+def start_game(state:GameState) -> List[Event]:
+    shuffle_deck(state)
+    state.market.extend(draw_cards(state, state.ruleset.initial_market))
+    for player in state.players.values():
+        player.resources['食物'] += state.ruleset.initial_food
+    return [(None, notify("game_start"))]
+
+def game_over(state:GameState) -> bool:
+    return state.epoch > state.ruleset.max_epoch or not state.players
+
+def enter_phase(state:GameState, phase:int) -> List[Event]:
+    """
+    进入某个阶段并重置该阶段的进度
+    1=投资 2=竞标 -2=按出价顺序拿取 3=价值波动 4=事件卡
+    进入投资阶段时结算每个玩家建筑的自动产出，每轮每个玩家只结算这一次
+    """
+    state.phase = phase
+    events = [(None, notify("phase_changed", epoch=state.epoch, phase=phase))]
+    if phase in (1, 2, -2):
+        state.finished.clear()
+    if phase in (1, 2):
+        events.append((None, notify("data_required", epoch=state.epoch, phase=phase)))
+    if phase == 1:
+        state.exchanged.clear()
+        state.mined.clear()
+        for player in state.players:
+            events += produce(state, player)
+    elif phase == 2:
+        state.bids.clear()
+    elif phase == -2:
+        state.bids.sort(key=lambda y: y['bid'], reverse=True)
+        events.append((None, notify("bidding_sorted", sorted=[bid['player'] for bid in state.bids])))
+    return events
+
+def phase_done(state:GameState) -> bool:
+    """投资/竞标阶段是否所有玩家都已经结束"""
+    return all(name in state.finished for name in state.players)
+
+def end_epoch(state:GameState):
+    state.epoch += 1
+
+# ---------- 阶段1：投资 ----------
+
+def produce(state:GameState, player:str) -> List[Event]:
+    """建筑的自动产出，由 enter_phase 在每轮进入投资阶段时调用"""
+    data = state.players[player]
+    events = []
+    def worked(building):
+        events.append((player, notify("building_worked", player=player, building=building)))
+    if "农场" in data.buildings:
+        worked("农场")
+        data.action_points += 2
+        state.exchanged.add(player)
+    if "无敌农场" in data.buildings:
+        worked("无敌农场")
+        data.action_points += 5
+        state.exchanged.add(player)
+    if "伐木场" in data.buildings:
+        worked("伐木场")
+        if "木材" in state.market:
+            data.resources['木材'] += 1
+            state.market.remove("木材")
+    if "高级伐木场" in data.buildings:
+        worked("高级伐木场")
+        if state.current_deck.count("木材") >= 2:
+            data.resources['木材'] += 2
+            state.current_deck.remove("木材")
+            state.current_deck.remove("木材")
+    return events
+
+def build_cost(state:GameState, building:str) -> Tuple[int, Dict[str, int]]:
+    """
+    :return: (资源部分折合的价值, 需要消耗的前置建筑 {建筑: 数量})
+    """
+    book = state.ruleset.recipe_book
+    return book.cost(building, state.resource_values), book.buildings[building]
+
+def build_plan(state:GameState, player:str, building:str) -> Optional[Dict[str, int]]:
+    """
+    检查玩家能否建造，不修改状态
+    :return: 需要支付的资源组合，不能建造时返回 None
+    """
+    book = state.ruleset.recipe_book
+    if building not in book.buildings:
+        return None
+    data = state.players[player]
+    for k, v in book.buildings[building].items():
+        if data.buildings.count(k) < v:
+            return None
+    return book.plans(data.resources, state.resource_values)[building]
+
+def build_options(state:GameState, player:str) -> Dict[str, Optional[Dict[str, int]]]:
+    """
+    玩家现在能建造哪些建筑，所有建筑一共只做一次背包，不修改状态
+    :return: 建筑 -> 需要支付的资源组合，资源或前置建筑不够时为 None，前置建筑排在前面
+    """
+    book = state.ruleset.recipe_book
+    data = state.players[player]
+    plans = book.plans(data.resources, state.resource_values)
+    owned = data.buildings
+    return {building: plans[building] if all(owned.count(k) >= v for k, v in book.buildings[building].items())
+            else None for building in book.order}
+
+def build(state:GameState, player:str, building:str) -> bool:
+    """建造建筑：消耗前置建筑，支付的资源放回牌堆"""
+    pay = build_plan(state, player, building)
+    if pay is None:
+        return False
+    data = state.players[player]
+    for k, v in build_cost(state, building)[1].items():
+        for _ in range(v):
+            data.buildings.remove(k)
+    for k, v in pay.items():
+        data.resources[k] -= v
+        state.current_deck.extend([k] * v)
+    data.buildings.append(building)
+    return True
+
+def _mine(state:GameState, player:str, action, wants, limit:int) -> Tuple[List[Event], bool]:
+    """
+    从市场拿取矿物，wants 中可以是市场下标也可以是资源名称
+    :return: (拿取失败的错误消息, 是否超过数量上限)
+    """
+    if not isinstance(wants, list) or len(wants) > limit:
+        return [], False
+    events = []
+    for want in wants:
+        if isinstance(want, int) and 0 <= want < len(state.market):
+            item = state.market[want]
+        elif isinstance(want, str) and want in state.market:
+            item = want
+        else:
+            item = None
+        if item not in MINERALS:
+            events.append((player, error("investment_error", player=player, action=action, reason=BAD_INDEX)))
+            continue
+        state.market.remove(item)
+        state.players[player].resources[item] += 1
+    return events, True
+
+def investment(state:GameState, player:str, action) -> Outcome:
+    """
+    处理一条投资操作
+    action: '1'探索 '2'兑换 {'3':建筑}建造 '4'开盲盒 {'5':'物品x数量'}存钱
+            {'6':[下标或名称]}挖矿 '7'铁镐 'ok'结束
+    """
+    events = refresh_market(state)
+    data = state.players[player]
+    success = Outcome(notify("investment_success", player=player, action=action), events, False)
+    def fail(reason):
+        return Outcome(error("investment_error", player=player, action=action, reason=reason), events, False)
+
+    if action == 'ok':
+        state.finished.add(player)
+        return success._replace(done=True)
+    if action == '1':
+        if data.action_points < 1:
+            return fail(NOT_ENOUGH)
+        data.action_points -= 1
+        state.market.extend(draw_cards(state, 2))
+    elif action == '2':
+        if data.resources['食物'] < 1 or player in state.exchanged:
+            return fail(NOT_ENOUGH)
+        data.resources['食物'] -= 1
+        data.action_points += 3
+        state.current_deck.append('食物')
+        state.exchanged.add(player)
+    elif isinstance(action, dict) and "3" in action:
+        building = action['3']
+        if building not in ALL_BUILDINGS:
+            return fail(OUT_OF_RANGE)
+        if data.action_points < 3 or not build(state, player, building):
+            return fail(NOT_ENOUGH)
+        data.action_points -= 3
+    elif action == '4':
+        if data.action_points < 1 or data.resources['矿石'] < 1:
+            return fail(NOT_ENOUGH)
+        data.action_points -= 1
+        data.resources['矿石'] -= 1
+        award = state.rng.choice(state.ruleset.ore_choices)
+        if award != '无':
+            data.resources[award] += 1
+            if state.current_deck.count(award):
+                state.current_deck.remove(award)
+            state.current_deck.append("矿石")
+    elif isinstance(action, dict) and "5" in action:
+        if "银行" not in data.buildings:
+            return fail(NOT_ENOUGH)
+        item, _, amount = str(action['5']).rpartition('x')
+        if item not in ALL_RESOURCES or not amount.isdigit():
+            return fail(OUT_OF_RANGE)
+        amount = int(amount)
+        if not amount or data.resources[item] < amount:
+            return fail(NOT_ENOUGH)
+        data.bank_money += state.resource_values[item] * amount
+        data.resources[item] -= amount
+    elif isinstance(action, dict) and "6" in action:
+        if "矿机" in data.buildings:
+            mined, ok = _mine(state, player, action, action['6'], 3)
+            if not ok:
+                return fail(TOO_MANY)
+            data.buildings.remove("矿机")
+        elif "高级矿机" in data.buildings:
+            if player in state.mined:
+                return fail(NOT_ENOUGH)
+            mined, ok = _mine(state, player, action, action['6'], 2)
+            if not ok:
+                return fail(TOO_MANY)
+            state.mined.add(player)
+        else:
+            return fail(NOT_ENOUGH)
+        events += mined
+    elif action == '7':
+        if "铁镐" not in data.buildings:
+            return fail(NOT_ENOUGH)
+        if not state.current_deck:
+            shuffle_deck(state)
+        data.resources[state.current_deck.draw_bottom()] += 1
+        data.buildings.remove("铁镐")
+    else:
+        return fail(UNKNOWN_ACTION)
+    return success
+
+def investments(state:GameState, player:str, actions) -> Outcome:
+    """
+    一次提交的多条投资操作，按顺序逐条执行，中间不会插入其它玩家的操作。
+    单条操作失败不影响后面的操作；遇到 'ok' 结束本阶段，之后的操作不再执行
+    :param actions: 操作列表，每一项和 investment 的 action 相同
+    :return: reply 为 investment_results，results 是已执行的每条操作各自的回复
+    """
+    if not isinstance(actions, list):
+        return Outcome(error("investment_error", player=player, action=actions, reason=UNKNOWN_ACTION), [], False)
+    events, results, done = [], [], False
+    for action in actions:
+        outcome = investment(state, player, action)
+        events += outcome.events
+        results.append(outcome.reply)
+        if outcome.done:
+            done = True
+            break
+    return Outcome(notify("investment_results", player=player, results=results), events, done)
+
+# ---------- 阶段2：竞标和拿取 ----------
+
+def bid(state:GameState, player:str, amount) -> Outcome:
+    """出价，0 表示不参与；每轮只有第一次出价有效"""
+    if player not in state.finished:
+        state.finished.add(player)
+        if isinstance(amount, int) and amount > 0:
+            state.bids.append({"player": player, "bid": amount})
+    return Outcome(notify("bidding_success", player=player), [], True)
+
+def take(state:GameState, player:str, bid_amount:int, want) -> Outcome:
+    """
+    竞标成功的玩家按出价从市场拿取一个物品，每拿一个支付一次出价
+    want 为 'ok' 时结束拿取
+    """
+    success = Outcome(notify("bidding_success", player=player), [], False)
+    if want == 'ok':
+        state.finished.add(player)
+        return success._replace(done=True)
+    if not isinstance(want, int) or not 0 <= want < len(state.market):
+        return Outcome(error("bidding_error", player=player, reason=TAKEN), [], False)
+    data = state.players[player]
+    if data.action_points < bid_amount:
+        state.finished.add(player)
+        return Outcome(error("bidding_error", player=player, reason=NO_POINTS), [], True)
+    item = state.market.pop(want)
+    state.tmp_cnt_take[item] += 1
+    data.action_points -= bid_amount
+    data.resources[item] += 1
+    return success
+
+# ---------- 阶段3：价值波动 ----------
+
+def update_resource_values(state:GameState) -> List[Event]:
+    """每隔几轮：没人拿过的资源价值+1，被拿取很多的资源价值-1（最低为1）"""
+    if state.epoch % state.ruleset.value_update_interval != 0:
+        return []
+    events = []
+    values = state.resource_values
+    for k in values:
+        if state.tmp_cnt_take[k] == 0:
+            values[k] += 1
+            events.append((None, notify("value_changed", resource=k, value=values[k])))
+    for k in values:
+        if state.tmp_cnt_take[k] >= state.ruleset.value_drop_threshold and values[k] > 1:
+            values[k] -= 1
+            events.append((None, notify("value_changed", resource=k, value=values[k])))
+    return events
+
+# ---------- 阶段4：事件卡 ----------
+
+def draw_event(state:GameState) -> Optional[str]:
+    """本轮的事件，不是事件轮时返回 None；免疫轮不会抽到海盗掠夺和天降饥荒"""
+    if state.epoch not in state.ruleset.event_epochs:
+        return None
+    event_deck = state.ruleset.event_deck
+    if state.epoch in state.event_immunitie:
+        event_deck = [e for e in event_deck if e not in ("海盗掠夺", "天降饥荒")]
+    return state.rng.choice(event_deck)
+
+def apply_event(state:GameState, event:str) -> List[Event]:
+    """结算事件，死亡的玩家会从 state.players 中移除"""
+    events = []
+    died_players = []
+    if event == "火山爆发":
+        state.market.truncate(len(state.market) // 2)
+    elif event == "海盗掠夺":
+        calc = ResourceValueCalculator(state.resource_values)
+        for player, data in state.players.items():
+            if "炮台" in data.buildings:
+                data.buildings.remove("炮台")
+                continue
+            can_pay = calc.best_combination(data.resources, 3 * state.resource_values['金币'])
+            if can_pay is None:
+                died_players.append(player)
+                continue
+            for item, amount in can_pay['resources'].items():
+                data.resources[item] -= amount
+    elif event == "天降饥荒":
+        for player, data in state.players.items():
+            if data.resources['食物'] < 3:
+                died_players.append(player)
+                continue
+            data.resources['食物'] -= 3
+    elif event == "出现宝藏":
+        # 宝藏竞拍玩法还没有实现
+        pass
+    elif event == "祝福事件":
+        for data in state.players.values():
+            data.action_points += 2
+    if event in ("海盗掠夺", "天降饥荒"):
+        events.append((None, notify("died_players", players=died_players)))
+    for player in died_players:
+        del state.players[player]
+    return events
+
+def trigger_event_card(state:GameState) -> List[Event]:
+    event = draw_event(state)
+    if event is None:
+        return []
+    return [(None, notify("event_choiced", epoch=state.epoch, event=event))] + apply_event(state, event)
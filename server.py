@@ -1,15 +1,33 @@
 import asyncio
 import dataclasses
+import heapq
+import itertools
+import os
 from email.policy import default
 from operator import truediv
-import random
-from collections import defaultdict
-from threading import Thread
-from typing import Dict, List
+import secrets
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI()
+import journal
+import rules
+import valuation
+import wire
+
+PLAYERS_PER_ROOM = int(os.getenv("RSIPLAYERS", 2))        # 设置人数
+MAX_PLAYERS_PER_ROOM = 5
+LOBBY_TIMEOUT = 300         # 房间等待玩家的最长时间（秒）
+LOBBY_TIMEOUT_CODE = 4000   # 等待超时、房间解散时断开玩家用的关闭码，客户端据此重连进新房间
+SEND_QUEUE_SIZE = 64        # 每个连接最多积压的待发送消息数
+# 投资、竞标阶段（拿取阶段为每个竞标者）最长等待多少秒，超时的玩家按 TIMEOUT_DEFAULTS 提交；0 表示一直等待
+PHASE_TIMEOUT = float(os.getenv("RSITIMEOUT", 120))
 
 def process_command(command_string):
     """
@@ -34,165 +52,585 @@ def process_command(command_string):
     arguments = parts[1:] if len(parts) > 1 else []
     return command_name, arguments
 
-@dataclasses.dataclass
-class Player:
-    ws:WebSocket
-    resources: Dict[str, int] = dataclasses.field(default_factory=dict)
-    action_points: int = 3
-    buildings: List[str] = dataclasses.field(default_factory=list)
-    bank_money: int = 0
-
-class ResourceValueCalculator:
-    def __init__(self, resource_values):
-        self.resource_values = resource_values
-    def calculate_equivalent_resources(self, player_resources, target_value):
-        """
-        计算等值物资组合（动态规划优化版）
-        :param player_resources: 玩家当前资源 {'钻石':1, '铁':3}
-        :param target_value: 需要匹配的目标价值
-        :return: 所有可行的资源组合列表，按最接近目标值排序
-        """
-        available_res = {
-            res: qty for res, qty in player_resources.items()
-            if qty > 0 and not res.startswith('保留')
-        }
-        dp = defaultdict(list)
-        dp[0] = [{}]
-        for res, max_qty in available_res.items():
-            res_value = self.resource_values[res]
-            current_dp = list(dp.items())
-            for value, combos in current_dp:
-                for qty in range(1, max_qty + 1):
-                    new_value = value + res_value * qty
-                    new_combo = [{
-                        **combo,
-                        res: combo.get(res, 0) + qty
-                    } for combo in combos]
-                    if new_value not in dp or len(new_combo[0]) < len(dp[new_value][0]):
-                        dp[new_value] = new_combo
-        valid_combinations = []
-        for value, combos in dp.items():
-            if value >= target_value:
-                for combo in combos:
-                    valid_combinations.append({
-                        'resources': combo,
-                        'total_value': value,
-                        'difference': value - target_value
-                    })
-        return sorted(valid_combinations, key=lambda x: (x['difference'], len(x['resources'])))
-# 共享游戏状态（替换你原有的GameRoom）
-class GameState:
+def encode_message(data) -> bytes:
+    """HTTP 响应体和状态增量用的 JSON，和 WebSocket 文本帧（wire.JSON）的编码相同"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+class Connection:
+    """
+    玩家连接：每个连接有自己的有界发送队列和写协程，发送方只入队不等待网络
+    队列满时先丢掉最早的可丢弃消息（会被后续消息覆盖的状态快照），
+    没有可丢弃的消息就断开这个慢客户端，避免拖慢整个房间
+    :param codec: 握手时协商的编码（wire.JSON 或 wire.MSGPACK）
+    """
+    _CLOSE = object()
+
+    def __init__(self, ws:WebSocket, codec=wire.JSON, max_queue:int=SEND_QUEUE_SIZE):
+        self.ws = ws
+        self.codec = codec
+        self.max_queue = max_queue
+        self.closed = False
+        self._close_code = 1000
+        self._close_reason = ''
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+        # abort 发起的关闭任务，保留引用，避免还没执行完就被回收
+        self._closing = set()
+
+    def send_message(self, message:wire.Message, droppable:bool=False):
+        if self.closed:
+            return
+        if len(self._queue) >= self.max_queue:
+            for i, (_, old_droppable) in enumerate(self._queue):
+                if old_droppable:
+                    del self._queue[i]
+                    break
+            else:
+                if droppable:
+                    return
+                self.abort(code=1008, reason="slow consumer")
+                return
+        self._queue.append((message.frame(self.codec), droppable))
+        self._wakeup.set()
+
+    async def send_json(self, data, droppable:bool=False):
+        self.send_message(wire.Message(data), droppable)
+
+    async def receive(self):
+        """读取并解码客户端发来的一条消息，对端断开时抛出 WebSocketDisconnect"""
+        message = await self.ws.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        # 按帧类型解码：文本帧是 JSON，二进制帧是 msgpack
+        frame = message.get("text")
+        return wire.decode(frame if frame is not None else message["bytes"])
+
+    async def close(self, code:int=1000, reason:str=''):
+        """发完已入队的消息后关闭连接"""
+        self.close_nowait(code, reason)
+
+    def close_nowait(self, code:int=1000, reason:str=''):
+        if self.closed:
+            return
+        self._queue.append((self._CLOSE, False))
+        self._close_code = code
+        self._close_reason = reason
+        self._wakeup.set()
+        self.closed = True
+
+    def abort(self, code:int=1011, reason:str=''):
+        """立即丢弃积压的消息并断开连接"""
+        self.closed = True
+        self._queue.clear()
+        if not self._writer.done():
+            self._writer.cancel()
+        task = asyncio.create_task(self._close_ws(code, reason))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_ws(self, code:int, reason:str=''):
+        try:
+            await self.ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                frame, _ = self._queue.popleft()
+                if frame is self._CLOSE:
+                    await self._close_ws(self._close_code, self._close_reason)
+                    return
+                if self.codec.binary:
+                    await self.ws.send_bytes(frame)
+                else:
+                    await self.ws.send_text(frame)
+        except Exception:
+            # 对端已经断开
+            self.closed = True
+            self._queue.clear()
+
+class OfflineConnection:
+    """从日志恢复出来、还没有重连的玩家的连接，发给它的消息直接丢弃"""
+    closed = True
+
+    def send_message(self, message:wire.Message, droppable:bool=False):
+        pass
+
+    async def send_json(self, data, droppable:bool=False):
+        pass
+
+    async def close(self, code:int=1000, reason:str=''):
+        pass
+
+    def close_nowait(self, code:int=1000, reason:str=''):
+        pass
+
+    def abort(self, code:int=1011, reason:str=''):
+        pass
+
+class Player(valuation.ScoredPlayer, rules.PlayerState):
+    __slots__ = ('ws', '_leaderboard', '_name')
+
+    def __init__(self, ws:Connection=None, **state):
+        self._leaderboard = None
+        self._name = None
+        super().__init__(**state)
+        self.ws = ws
+
+# 消息类型对应的阶段
+MESSAGE_PHASES = {
+    "investment": 1,
+    "bidding": 2,
+    "bidding_wants": -2,
+}
+# 阶段对应的消息类型
+PHASE_MESSAGES = {phase: msg_type for msg_type, phase in MESSAGE_PHASES.items()}
+# 每轮依次进行的阶段
+PHASES = [1, 2, -2, 3, 4]
+# 超时的玩家替他提交的默认操作：消息类型 -> (字段, 值)
+TIMEOUT_DEFAULTS = {
+    "investment": ("investment", "ok"),
+    "bidding": ("bid", 0),
+    "bidding_wants": ("want", "ok"),
+}
+# 放进消息分发器唤醒阶段循环的占位消息（见 Game._wake）
+WAKE = object()
+
+class MessageDispatcher:
+    """
+    按键分发消息，键的格式为 (玩家, 消息类型, 轮次, ...)
+    等待方挂在 Future 上，不占用CPU；没有等待方的消息先缓存到对应键下
+    等待时玩家填 None 表示接收任意玩家的消息
+    """
     def __init__(self):
-        self.players: Dict[str, Player] = {}
-        self.market: List[str] = []
-        self.event_immunitie = [3, 6, 9, 13, 15]
-        self.current_deck = []
-        self.epoch = 1
-        self.phase = 1
-        self.resource_values = {
-            '钻石': 8, '金币': 6, '木材': 2,
-            '矿石': 3, '食物': 1, '铁': 2
-        }
-        self.tmp_cnt_take = defaultdict(int)
-        self.started = False
-class Game:
+        self._buffered: Dict[tuple, deque] = defaultdict(deque)
+        self._waiters: Dict[tuple, deque] = defaultdict(deque)
+
+    def put(self, key: tuple, item):
+        for k in (key, (None, *key[1:])):
+            waiters = self._waiters.get(k)
+            while waiters:
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_result(item)
+                    return
+            self._waiters.pop(k, None)
+        self._buffered[key].append(item)
+
+    def _pop_buffered(self, key: tuple):
+        if key[0] is not None:
+            keys = [key] if key in self._buffered else []
+        else:
+            keys = [k for k in self._buffered if k[1:] == key[1:]]
+        for k in keys:
+            items = self._buffered[k]
+            item = items.popleft()
+            if not items:
+                del self._buffered[k]
+            return True, item
+        return False, None
+
+    async def get(self, key: tuple):
+        found, item = self._pop_buffered(key)
+        if found:
+            return item
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[key].append(fut)
+        try:
+            return await fut
+        finally:
+            if not fut.done():
+                fut.cancel()
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                if fut in waiters:
+                    waiters.remove(fut)
+                if not waiters:
+                    del self._waiters[key]
+
+    def discard_before(self, epoch: int):
+        """丢弃早于指定轮次的缓存消息"""
+        for k in [k for k in self._buffered if k[2] < epoch]:
+            del self._buffered[k]
+
+class Deadline:
+    __slots__ = ("when", "callback", "args", "active", "_scheduler")
+
+    def __init__(self, scheduler:'DeadlineScheduler', when:float, callback:Callable, args:tuple):
+        self._scheduler = scheduler
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.active = True
+
+    def cancel(self):
+        """到期之前取消；已经到期或取消过的什么也不做"""
+        if self.active:
+            self.active = False
+            self._scheduler._cancelled(self)
+
+class DeadlineScheduler:
+    """
+    所有房间共用的截止时间表：一个按时刻排序的最小堆，事件循环里只为堆顶设置一个定时器，
+    不为每个玩家或房间创建任务。添加是 O(log n)；取消只做标记，出堆时跳过，
+    被取消的条目超过一半时重建一次堆，几万个等待中的截止时间也不会拖慢
+    """
+    COMPACT_MIN = 1024
+
     def __init__(self):
-        self.ore_choices = [
-            '钻石','金币',
-            '铁','铁','铁','铁','铁',
-            '无','无','无'
-        ]
-        self.state: GameState = GameState()
-        self.all_buildings = [
-            '矿机', '农场', '伐木场',
-            '铁镐', '农田', '高级伐木场',
-            '高级矿机', '无敌农场', '银行', '炮台'
-        ]
-        self.resource_deck = {
-            '金币': 10, '木材': 100,
-            '矿石': 200, '食物': 200,
-            '钻石': 10, '铁': 300,
+        self._heap = []             # [(时刻, 序号, Deadline)]
+        self._seq = itertools.count()
+        self._cancelled_count = 0
+        self._loop = None
+        self._timer: asyncio.TimerHandle = None
+        self._timer_at = None
+
+    def __len__(self):
+        """等待中的截止时间数"""
+        return len(self._heap) - self._cancelled_count
+
+    def schedule(self, delay:float, callback:Callable, *args) -> Deadline:
+        """delay 秒后在事件循环里调用 callback(*args)"""
+        loop = asyncio.get_running_loop()
+        deadline = Deadline(self, loop.time() + delay, callback, args)
+        heapq.heappush(self._heap, (deadline.when, next(self._seq), deadline))
+        if loop is not self._loop or self._timer_at is None or deadline.when < self._timer_at:
+            self._arm(loop)
+        return deadline
+
+    def _arm(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._loop = loop
+        self._timer = self._timer_at = None
+        heap = self._heap
+        while heap and not heap[0][2].active:
+            heapq.heappop(heap)
+            self._cancelled_count -= 1
+        if heap:
+            self._timer_at = heap[0][0]
+            self._timer = loop.call_at(self._timer_at, self._fire)
+
+    def _fire(self):
+        self._timer = self._timer_at = None
+        now = self._loop.time()
+        try:
+            # 回调里可能取消别的截止时间并重建堆，所以每次都从 self._heap 取
+            while self._heap and self._heap[0][0] <= now:
+                _, _, deadline = heapq.heappop(self._heap)
+                if not deadline.active:
+                    self._cancelled_count -= 1
+                    continue
+                deadline.active = False
+                deadline.callback(*deadline.args)
+        finally:
+            self._arm(self._loop)
+
+    def _cancelled(self, deadline:Deadline):
+        self._cancelled_count += 1
+        if self._cancelled_count > max(self.COMPACT_MIN, len(self._heap) // 2):
+            self._heap = [entry for entry in self._heap if entry[2].active]
+            heapq.heapify(self._heap)
+            self._cancelled_count = 0
+
+# 共享游戏状态（替换你原有的GameRoom）
+class GameState(rules.GameState):
+    __slots__ = ('started', 'version', 'dirty', 'on_change')
+
+    def __init__(self, seed:int=None):
+        # 每个房间独立的带种子随机数，抽取结果写进房间日志，重放时可以逐次核对
+        super().__init__(rng=journal.JournalRandom(seed))
+        # 玩家字典同时增量维护排行榜，资源价值也要换成它的容器才能在变化时重算得分
+        self.players: valuation.Leaderboard = valuation.Leaderboard(self.resource_values)
+        self.resource_values = self.players.resource_values
+        self.started = False
+        # 推送给客户端的状态版本号，只有内容真的变化时才加一
+        self.version = 0
+        self.dirty = False
+        self.on_change = None
+
+    def touch(self):
+        """标记状态可能已经变化，由 Game 在本轮事件循环结束前统一计算增量"""
+        self.dirty = True
+        if self.on_change is not None:
+            self.on_change()
+
+    @staticmethod
+    def player_dict(player:rules.PlayerState) -> Dict:
+        return {
+            "action_points": player.action_points,
+            "resources": player.resources.to_dict(),
+            "buildings": player.buildings.to_list(),
+            "bank_money": player.bank_money
         }
-        self.all_resources = [
-            '金币', '木材', '矿石', '食物',
-            '钻石', '铁'
-        ]
-        self.event_deck = [
-            '火山爆发', '海盗掠夺', '海盗掠夺', '天降饥荒',
-            '天降饥荒', '出现宝藏', '祝福事件', '祝福事件'
-        ]
-        self.recipes: Dict[str, Dict] = {
-            "矿机": {"铁": 5, "铁镐": 1},
-            "炮台": {"金币": 2},
-            "伐木场": {"铁镐": 1, "铁": 4},
-            "铁镐": {"铁": 2},
-            "高级矿机": {"矿机": 1, "金币": 2},
-            "高级伐木场": {"伐木场": 1, "金币": 2},
-            "农场": {"金币": 3},
-            "无敌农场": {"农场": 1, "金币": 8},
-            "银行": {"金币": 2}
+
+    def _summary(self) -> Dict:
+        """状态里除了玩家以外的部分"""
+        return {
+            "started": self.started,
+            "epoch": self.epoch,
+            "phase": self.phase,
+            "market": self.market.to_list(),
+            "values": dict(self.resource_values),
+            "leaderboard": self.players.ranking(),
         }
-        self._player_resp = asyncio.Queue()
+
+    def to_dict(self) -> Dict:
+        """
+        整个房间的状态，排行榜随状态一起推送，观战器不用各自再算
+        返回的都是新建的 JSON 对象，不和规则状态共用容器
+        """
+        return {
+            "version": self.version,
+            **self._summary(),
+            "players": {name: self.player_dict(player) for name, player in self.players.items()},
+        }
+
+    def changes_since(self, pushed:Dict, copies:Dict[str, rules.PlayerState]) -> Dict:
+        """
+        和上次推送的状态 pushed 之间的增量，玩家按整条记录比较。
+        玩家不转换成 JSON 比较，而是和推送时的写时复制快照 copies 比较数组，只有变化的玩家才转换；
+        copies 同时更新成当前的玩家
+        """
+        changes = {k: v for k, v in self._summary().items() if pushed.get(k) != v}
+        players = {}
+        for name, player in self.players.items():
+            copy = copies.get(name)
+            if copy is None or not player.same_as(copy):
+                players[name] = self.player_dict(player)
+                copies[name] = player.copy()
+        removed = [name for name in copies if name not in self.players]
+        for name in removed:
+            del copies[name]
+        if players:
+            changes["players"] = players
+        if removed:
+            changes["removed_players"] = removed
+        return changes
+
+def apply_changes(state:Dict, changes:Dict) -> Dict:
+    """把增量应用到推送过的状态上，返回新的字典：原来的状态可能还在发送队列里，不能修改"""
+    players = dict(state["players"])
+    players.update(changes.get("players", {}))
+    for name in changes.get("removed_players", ()):
+        del players[name]
+    new = dict(state)
+    new.update((k, v) for k, v in changes.items() if k not in ("players", "removed_players"))
+    new["players"] = players
+    return new
+
+class Game:
+    """
+    :param seed: 房间随机数的种子，默认随机生成，和其它房间互不影响
+    """
+    def __init__(self, room_id:str='default', on_finished=None, seed:int=None):
+        self.room_id = room_id
+        self.seed = secrets.randbits(63) if seed is None else seed
+        # 同名房间被回收后重新创建时，用它区分新旧房间的ETag
+        self.instance_id = uuid.uuid4().hex[:8]
+        self._on_finished = on_finished
+        self._snapshot = None
+        self._leaderboard = None
+        # 最近一次推送出去的状态，后续增量都以它为基准；玩家另外保存写时复制的快照，用来找出变化的玩家
+        self._pushed_state = None
+        self._pushed_players: Dict[str, rules.PlayerState] = {}
+        self._push_scheduled = False
+        self.spectators = set()
+        self.state: GameState = GameState(self.seed)
+        self.state.on_change = self._schedule_push
+        self._player_resp = MessageDispatcher()
         self._gm_cmd = asyncio.Queue()
         self._game_task = None
-        self._server_resp = asyncio.Queue()
-
-    async def _shuffle_deck(self):
-        self.state.current_deck = []
-        for card_type, count in self.resource_deck.items():
-            self.state.current_deck.extend([card_type] * count)
-        random.shuffle(self.state.current_deck)
-
-    async def _draw_cards(self, num:int):
-        """从牌堆抽取指定数量的卡"""
-        drawn = []
-        for _ in range(num):
-            if not self.state.current_deck:
-                await self._shuffle_deck()
-            if self.state.current_deck:
-                drawn.append(self.state.current_deck.pop())
-        return drawn
-
-    async def broadcast(self, data):
+        self._lobby_timer = None
+        # 开局后才有日志，大厅阶段的房间不持久化
+        self.journal: journal.Journal = None
+        # 拿取阶段正在等待拿取的玩家，重连时要重新通知他
+        self._taking = None
+        # /submit 请求的关联ID -> 等待回复的 Future
+        self._pending: Dict[str, asyncio.Future] = {}
+        # 玩家 -> 正在处理的那条消息的关联ID，send_to 发出的回复直接交给对应的请求
+        self._inflight: Dict[str, str] = {}
+
+    def snapshot(self):
+        """
+        房间状态快照，同一版本只编码一次
+        :return: (etag, 编码后的json)
+        """
+        self._flush_state()
+        version = self.state.version
+        if self._snapshot is None or self._snapshot[0] != version:
+            # 刚推送过的状态就是当前版本，直接复用，不再重新生成一遍
+            state = self._pushed_state if self._pushed_state is not None else self.state.to_dict()
+            self._snapshot = (version, f'"{self.instance_id}-{version}"', encode_message(state))
+        return self._snapshot[1], self._snapshot[2]
+
+    def leaderboard(self) -> str:
+        """编码后的排行榜，排名没有变化时直接复用上次的结果"""
+        ranking = self.state.players.ranking()
+        if self._leaderboard is None or self._leaderboard[0] is not ranking:
+            self._leaderboard = (ranking, encode_message({"leaderboard": ranking}))
+        return self._leaderboard[1]
+
+    def _schedule_push(self):
+        if self._push_scheduled:
+            return
+        self._push_scheduled = True
+        asyncio.get_running_loop().call_soon(self._flush_state)
+
+    def _flush_state(self):
+        """把上次推送以来的变化算成增量，版本号加一后推送给所有玩家和观众"""
+        self._push_scheduled = False
+        if not self.state.dirty:
+            return
+        self.state.dirty = False
+        if self._pushed_state is None:
+            current = self.state.to_dict()
+            self._pushed_players = {name: player.copy() for name, player in self.state.players.items()}
+        else:
+            changes = self.state.changes_since(self._pushed_state, self._pushed_players)
+            if not changes:
+                return
+            current = apply_changes(self._pushed_state, changes)
+        base = self.state.version
+        self.state.version += 1
+        current["version"] = self.state.version
+        self._pushed_state = current
+        if base:
+            # 增量可以丢弃：客户端发现版本不连续会自己拉一次快照
+            message = wire.Message({"type": "state", "target": {
+                "type": "delta", "base": base, "version": self.state.version, "changes": changes}})
+            self._fan_out(message, droppable=True, spectators=True)
+
+    async def send_full_state(self, conn:Connection):
+        """给新连接发送完整状态，之后它就能接着应用增量"""
+        self._flush_state()
+        await conn.send_json({"type": "state", "target": {"type": "full", "state": self._pushed_state}})
+
+    async def watch(self, conn:Connection):
+        self.spectators.add(conn)
+        await self.send_full_state(conn)
+
+    def _fan_out(self, message:wire.Message, droppable:bool=False, spectators:bool=False):
         for player in self.state.players.values():
-            await player.ws.send_json(data)
-
-    async def _game_loop(self):
-        await self._shuffle_deck()
-        self.state.market.extend(await self._draw_cards(20))
-        for player in game.state.players.keys():
-            self.state.players[player].resources['食物'] += 10
-        await self.broadcast({"type":"notify","target":{"type":"game_start"}})
-        # while self.state.epoch <= 30: 
-        while True:
-            self.state.phase = 1
-            if self.state.phase == 1:
-                await self.broadcast({"type": "notify", "target": {"type": "phase_changed","epoch":self.state.epoch,"phase":self.state.phase}})
-                await self.broadcast({"type": "notify", "target": {"type": "data_required", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self._handle_investment()
-                self.state.phase = 2
-            if self.state.phase == 2:
-                await self.broadcast({"type": "notify", "target": {"type": "phase_changed", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self.broadcast({"type": "notify", "target": {"type": "data_required", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self._handle_bidding()
-                self.state.phase = -2
-                await self.broadcast({"type": "notify", "target": {"type": "phase_changed", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self._parse_bidding()
-                self.state.phase = 3
-            if self.state.phase == 3:
-                await self.broadcast({"type": "notify", "target": {"type": "phase_changed", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self._update_resource_values()
-                self.state.phase = 4
-            if self.state.phase == 4:
-                await self.broadcast({"type": "notify", "target": {"type": "phase_changed", "epoch": self.state.epoch,
-                                                                   "phase": self.state.phase}})
-                await self._trigger_event_card()
-            self.state.epoch += 1
+            player.ws.send_message(message, droppable)
+        if spectators:
+            for conn in self.spectators:
+                conn.send_message(message, droppable)
+
+    async def broadcast(self, data, droppable:bool=False):
+        self.state.touch()
+        # 每种编码只编码一次，然后放进每个连接各自的发送队列，不等待任何一个客户端
+        self._fan_out(wire.Message(data), droppable)
+
+    async def _game_loop(self, start_events:List[rules.Event]=None):
+        completed = False
+        try:
+            await self._run_epochs(start_events)
+            await self.broadcast({"type":"notify","target":{"type":"game_over","epoch":self.state.epoch}})
+            for player in list(self.state.players.values()):
+                await player.ws.close()
+            completed = True
+        finally:
+            # 异常退出的对局保留日志，重启后还能恢复
+            self.finish(keep_journal=not completed)
+
+    def finish(self, keep_journal:bool=False):
+        """
+        结束房间：取消房间内的任务并通知房间管理器回收
+        :param keep_journal: 保留房间日志（服务器关闭时），否则删除
+        """
+        if self.journal is not None:
+            self.journal.close(remove=not keep_journal)
+            self.journal = None
+        if self._lobby_timer is not None:
+            self._lobby_timer.cancel()
+        for conn in self.spectators:
+            conn.close_nowait()
+        if not self.state.started:
+            # 没开局就结束（大厅等待超时）：断开还在等待的玩家，他们重连时会进入新建的同名房间
+            for player in self.state.players.values():
+                player.ws.close_nowait(LOBBY_TIMEOUT_CODE, "lobby timeout")
+        current = asyncio.current_task()
+        task = self._game_task
+        if task is not None and task is not current and not task.done():
+            task.cancel()
+        if self._on_finished is not None:
+            callback, self._on_finished = self._on_finished, None
+            callback(self)
+
+    def _rule(self, op:str, **args):
+        """执行一次规则调用（见 journal.apply）并写入房间日志"""
+        result = journal.apply(self.state, op, args)
+        if self.journal is not None:
+            self.journal.append({"t": "op", "op": op, **args})
+        return result
+
+    def _attach_journal(self, log:journal.Journal):
+        """之后的规则调用和随机抽取都写入这个日志"""
+        self.journal = log
+        if log is not None:
+            self.state.rng.on_draw = lambda value: log.append({"t": "rng", "v": value})
+
+    def restore(self, path:str, meta:Dict, snapshot:Dict, records:List[Dict]):
+        """
+        从日志恢复一个已开局的房间，玩家都处于离线状态，等待他们重新连接
+        :return: 恢复用时（秒）
+        """
+        start = time.perf_counter()
+        journal.restore_state(self.state, snapshot['state'], new_player=lambda: Player(ws=OfflineConnection()))
+        self.state.rng.setstate(snapshot['rng'])
+        journal.replay(self.state, records)
+        self.state.started = True
+        self.state.touch()
+        log = journal.Journal(path, meta)
+        log.compact(self.state)
+        self._attach_journal(log)
+        self._game_task = asyncio.create_task(self._game_loop())
+        self._lobby_timer = asyncio.get_running_loop().call_later(LOBBY_TIMEOUT, self._abandon_if_offline)
+        return time.perf_counter() - start
+
+    def _abandon_if_offline(self):
+        """恢复后一直没有玩家重连的房间直接结束"""
+        if all(isinstance(player.ws, OfflineConnection) for player in self.state.players.values()):
+            self.finish()
+
+    async def reconnect(self, player:str, conn:Connection):
+        """恢复出来的玩家重新连接：换上新连接，补发完整状态和当前阶段需要他提交的通知"""
+        self.state.players[player].ws = conn
+        await self.send_full_state(conn)
+        state = self.state
+        if (state.phase in (1, 2) and player not in state.finished) or (state.phase == -2 and self._taking == player):
+            await conn.send_json({"type":"notify","target":{"type":"data_required","epoch":state.epoch,"phase":state.phase}})
+
+    async def _run_epochs(self, start_events:List[rules.Event]=None):
+        """
+        :param start_events: 开局产生的消息；为 None 表示从日志恢复的房间，
+            此时 state.phase 是已经进入的阶段，从这个阶段接着进行
+        """
+        state = self.state
+        phases, entered = PHASES, None
+        if start_events is not None:
+            await self._emit(start_events)
+        elif state.phase != PHASES[-1]:
+            # 第4阶段的记录已经包含了结束本轮，停在这个阶段时从下一轮开始
+            phases, entered = PHASES[PHASES.index(state.phase):], state.phase
+        handlers = {1: self._handle_investment, 2: self._handle_bidding, -2: self._parse_bidding}
+        while not rules.game_over(state):
+            self._player_resp.discard_before(state.epoch)
+            for phase in phases:
+                if phase != entered:
+                    await self._enter_phase(phase)
+                entered = None
+                if phase in handlers:
+                    await handlers[phase]()
+            phases = PHASES
+            if self.journal is not None and state.epoch % journal.SNAPSHOT_EPOCHS == 0:
+                self.journal.compact(state)
 
     async def _handle_player_message(self,player:str,data:str):
         if data['type'] == "command":
@@ -211,10 +649,11 @@ class Game:
                         if args[0]in self.state.players:
                             await self.send_to(args[0],{"type":"notify","target":{"type":"kicked","reason":args[1] if args[1] else "You have been kicked!"}})
                             await self.state.players[args[0]].ws.close()
-                            del self.state.players[args[0]]
+                            self.leave(args[0])
                     case "give": # /give playera 金币 100
-                        if args[0]in self.state.players and args[1] and args[2]:
-                            self.state.players[args[0]].resources[args[1]] += int(args[2])
+                        if args[0]in self.state.players and args[1] in rules.ALL_RESOURCES and args[2]:
+                            self._rule("give", player=args[0], resource=args[1], amount=int(args[2]))
+                            self.state.touch()
                         else:
                             await self.send_to(player,{"type":"error","target":{"type":"cmd_syntax_error"}})
                     case "send": # /send playera { __your_data_here__ }
@@ -223,14 +662,17 @@ class Game:
                         else:
                             await self.send_to(player,{"type":"error","target":{"type":"cmd_syntax_error"}})
                     case "build": # /build 伐木场
-                        if args[0]in self.state.players and args[1]:
-                            self.state.players[args[0]].buildings.append(args[1])
+                        if args[0]in self.state.players and args[1] in rules.ALL_BUILDINGS:
+                            self._rule("build", player=args[0], building=args[1])
+                            self.state.touch()
                         else:
                             await self.send_to(player,{"type":"error","target":{"type":"cmd_syntax_error"}})
                     case "stop": # /stop
-                        self.broadcast({"type":"notify","target":{"type":"server_stop"}})
+                        await self.broadcast({"type":"notify","target":{"type":"server_stop"}})
                         for x in self.state.players.keys():
                             await self.state.players[x].ws.close()
+                        # 日志写入磁盘后再退出，重启后所有已开局的房间都能恢复
+                        rooms.shutdown()
                         import sys;sys.exit(0)
                     case "exec": # /exec __some_code_here__
                         try:exec(args[1])
@@ -238,44 +680,98 @@ class Game:
                 return
             else:
                 await self.send_to(player,{"type":"error","target":{"type":"permission_denied"}})
-        await self._player_resp.put(data)
+                self._resolve(data.get('rid'), {"type":"error","target":{"type":"permission_denied"}})
+        sender = data.get('data', {}).get('player', player)
+        msg_type = data.get('type')
+        self._player_resp.put((sender, msg_type, self.state.epoch, MESSAGE_PHASES.get(msg_type)), data)
 
-    async def get_server_resp(self,cur_player:str,cur_phase:str):
-        while True:
-            if self._player_resp.qsize() == 0:
-                continue
-            data = await self._server_resp.get()
-            if data['type'] == cur_phase and data['player'] == cur_player:
-                return data['data']
-            else:
-                await self._server_resp.put(data)
+    def register_request(self) -> tuple:
+        """为一次 /submit 请求分配关联ID和等待回复的 Future"""
+        rid = uuid.uuid4().hex
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        return rid, fut
+
+    def forget_request(self, rid:str):
+        self._pending.pop(rid, None)
+
+    def _resolve(self, rid:str, data:Dict):
+        fut = self._pending.pop(rid, None) if rid else None
+        if fut is not None and not fut.done():
+            fut.set_result(data)
+
+    @contextmanager
+    def _deadline(self, msg_type:str, player:str=None):
+        """
+        在这段等待期间设置截止时间（PHASE_TIMEOUT），到期后替还没结束的玩家提交默认操作
+        :param player: 只等这一个玩家（拿取阶段），默认是所有玩家
+        """
+        deadline = None
+        if PHASE_TIMEOUT > 0:
+            deadline = deadlines.schedule(PHASE_TIMEOUT, self._timed_out, msg_type, self.state.epoch, player)
+        try:
+            yield
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+
+    def _timed_out(self, msg_type:str, epoch:int, player:str=None):
+        """
+        超时的玩家按 TIMEOUT_DEFAULTS 提交，和玩家自己提交的消息走同一条路径，照常回复并写入日志
+        """
+        state = self.state
+        if state.epoch != epoch or state.phase != MESSAGE_PHASES[msg_type]:
+            return
+        field, value = TIMEOUT_DEFAULTS[msg_type]
+        waiting = [name for name in ([player] if player is not None else state.players)
+                   if name in state.players and name not in state.finished]
+        for name in waiting:
+            self._player_resp.put((name, msg_type, epoch, MESSAGE_PHASES[msg_type]),
+                                  {"type": msg_type, "data": {"player": name, field: value}})
+        if not waiting:
+            # 等待的玩家都已经离开，阶段循环可能还挂在分发器上，唤醒它重新检查
+            self._wake(player)
+
+    def leave(self, player:str):
+        """玩家离开房间（断线或被踢出），正在等待他提交的阶段不再等他"""
+        self._rule("leave", player=player)
+        self._wake(player)
+
+    def _wake(self, player:str=None):
+        """
+        让等待提交的阶段循环重新检查阶段是否已经结束：投资、竞标阶段可能只差刚离开的玩家，
+        拿取阶段刚离开的可能就是正在拿取的玩家
+        """
+        msg_type = PHASE_MESSAGES.get(self.state.phase)
+        if msg_type is not None:
+            self._player_resp.put((player, msg_type, self.state.epoch, self.state.phase), WAKE)
 
     async def _collect_player_data(self,x:str,cur_player:str=None):
-        while True:
-            if self._player_resp.qsize() == 0:
-                continue
-            data = await self._player_resp.get()
-            if cur_player != None and data['data']['player'] != cur_player:
-                continue
-            if data['type'] == x:
-                return data
+        """:return: 玩家提交的消息，被 _wake 唤醒时返回 None"""
+        data = await self._player_resp.get((cur_player, x, self.state.epoch, MESSAGE_PHASES[x]))
+        if data is WAKE:
+            return None
+        self._inflight[data['data']['player']] = data.get('rid')
+        return data
 
     async def send_to(self,player:str,data:Dict):
         # The use of WebSocket protocol for transmission has been abandoned
+        self.state.touch()
         await self.state.players[player].ws.send_json(data)
-        x = None
-        match self.state.phase:
-            case 1:
-                x = "investment"
-            case 2:
-                x = "bidding"
-            case 3:
-                x = "value_update"
-            case 4:
-                x = "event_card"
-            case -2:
-                x = "bidding_wants"
-        await self._server_resp.put({'player':player,'type':x,'data':data})
+        self._resolve(self._inflight.pop(player, None), data)
+
+    async def _emit(self, events:List[rules.Event]):
+        """发出规则引擎产生的消息，这些消息不作为 /submit 的回复"""
+        for to, message in events:
+            if to is None:
+                await self.broadcast(message)
+            elif to in self.state.players:
+                self.state.touch()
+                await self.state.players[to].ws.send_json(message)
+
+    async def _apply(self, player:str, outcome:rules.Outcome):
+        await self._emit(outcome.events)
+        await self.send_to(player, outcome.reply)
 
     async def _handle_investment(self):
         """
@@ -293,279 +789,57 @@ class Game:
                 'investment': '1', # {'3':'xxx'},{'5':'0x5'},{'6':[]]},'ok'
             }
         }
-        :return:
+        也可以一次提交多条操作，按顺序一起执行，回复 investment_results，其中 results 是每条操作的回复：
+            'data': {'player': '', 'investments': ['1', {'3':'xxx'}, 'ok']}
+        单个操作失败只回复错误，所有玩家都提交 'ok' 后阶段结束，超过 PHASE_TIMEOUT 秒时替没结束的玩家提交 'ok'
         """
-        already = list()
-        already_exchanged = False
-        already_mined = False
-        while True:
-            data = await self._collect_player_data("investment")
-            player = data['data']['player']
-            if len(set(self.state.market)) == 1 and self.state.market:
-                await self.broadcast({"type":"error","target":{"type":"market_error"}})
-                self.state.current_deck.extend(self.state.market)
-                self.state.market = []
-            if not self.state.market:
-                await self.broadcast({"type":"error","target":{"type":"market_empty"}})
-                for k in self.state.players.keys():
-                    if self.state.players[k].action_points:
-                        self.state.players[k].action_points -= 1
-                        self.state.market.extend(await self._draw_cards(2))
-            if "农场" in self.state.players[player].buildings:
-                await self.send_to(player,{"type":"notify","target":{"type":"building_worked","player":player,"building":"农场"}})
-                self.state.players[player].action_points += 2
-                already_exchanged = True
-            if "无敌农场" in self.state.players[player].buildings:
-                await self.send_to(player,{"type":"notify","target":{"type":"building_worked","player":player,"building":"无敌农场"}})
-                self.state.players[player].action_points += 5
-                already_exchanged = True
-            if "伐木场" in self.state.players[player].buildings:
-                await self.send_to(player,{"type":"notify","target":{"type":"building_worked","player":player,"building":"伐木场"}})
-                if "木材" in self.state.market:
-                    self.state.players[player].resources['木材'] +=1
-                    self.state.market.remove("木材")
-            if "高级伐木场" in self.state.players[player].buildings:
-                await self.send_to(player,{"type":"notify","target":{"type":"building_worked","player":player,"building":"高级伐木场"}})
-                if self.state.current_deck.count("木材") >=2:
-                    self.state.players[player].resources['木材'] +=2
-                    self.state.current_deck.remove("木材")
-                    self.state.current_deck.remove("木材")
-
-            # table = [['1', '探索',1],
-            #             ['2', '兑换',0],
-            #             ['3', '建造',3],
-            #             ['4', '开盲盒',1],
-            #             ['5', '存钱',0],
-            #             ['6', '挖矿',0],
-            #             ['7', '铁镐',0],
-            #             ],headers=["编号","操作","消耗"]
-            action = data['data']['investment']
-            if action == 'ok':
-                await self.send_to(player,{"type":"notify", "target":{"type":"investment_success","player":player,"action":action}})
-                already.append(player)
-            elif action == '1':
-                if self.state.players[player].action_points <1:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":1}})
-                    return False
-                self.state.players[player].action_points -= 1
-                self.state.market.extend(await self._draw_cards(2))
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            elif action == '2':
-                if self.state.players[player].resources['食物'] < 1:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":1}})
-                    return False
-                if already_exchanged:
-                    return False
-                self.state.players[player].resources['食物'] -= 1
-                self.state.players[player].action_points += 3
-                self.state.current_deck.append('食物')
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            elif isinstance(action,dict) and action.__contains__("3"):
-                if self.state.players[player].action_points < 3:
-                    await self.send_to(player,{"type": "error",
-                                            "target": {"type": "investment_error", "player": player, "action": action,
-                                                        "reason": 1}})
-                    return False
-                self.state.players[player].action_points -= 3
-                building = action['3']
-                if building not in self.all_buildings:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":2}})
-                    return False
-                else :
-                    if not await self._process_build(player,building):
-                        await self.send_to(player,{"type": "error",
-                                                "target": {"type": "investment_error", "player": player, "action": action,
-                                                            "reason": 1}})
-                        self.state.players[player].action_points += 3
-                        return False
-                    await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                        "action": action}})
-            elif action == '4':
-                if self.state.players[player].action_points < 1:
-                    await self.send_to(player,{"type": "error",
-                                            "target": {"type": "investment_error", "player": player, "action": action,
-                                                        "reason": 1}})
-                    return False
-                if self.state.players[player].resources['矿石'] < 1:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":1}})
-                    return False
-                self.state.players[player].action_points -= 1
-                self.state.players[player].resources['矿石'] -= 1
-                award = random.choice(self.ore_choices)
-                if award == '无':
-                    await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                        "action": action}})
-                    return False
-                self.state.players[player].resources[award] += 1
-                self.state.current_deck.remove(award)
-                self.state.current_deck.append("矿石")
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            elif isinstance(action,dict) and action.__contains__("5"):
-                if "银行" not in self.state.players[player].buildings:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":1}})
-                    return False
-                item = action['5'].split('x')[0]
-                amount = action['5'].split('x')[1]
-                if self.state.players[player].resources[item] < amount:
-                    await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":1}})
-                    return False
-                value = self.state.players[player].resources[item] * \
-                    self.state.resource_values[item]
-                value *= amount
-                self.state.players[player].bank_money += value
-                self.state.players[player].resources[item] -= amount
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            elif isinstance(action,dict) and action.__contains__("6"):
-                if "矿机" in self.state.players[player].buildings:
-                    if len(action['6']) >3:
-                        await self.send_to(player,{"type": "error",
-                                                "target": {"type": "investment_error", "player": player, "action": action,
-                                                            "reason": 5}})
-                        return False
-                    will_remove = []
-                    for i in action['6']:
-                        x = i
-                        if x not in self.state.market:
-                            await self.send_to(player,{"type": "error",
-                                                    "target": {"type": "investment_error", "player": player,
-                                                                "action": action, "reason": 3}})
-                            continue
-                        self.state.players[player].resources[x] += 1
-                        will_remove.append(x)
-                    for i in will_remove:
-                        self.state.market.remove(i)
-                    self.state.players[player].buildings.remove("矿机")
-                elif "高级矿机" in self.state.players[player].buildings:
-                    if already_mined:
-                        return False
-                    if len(action['6']) >2:
-                        await self.send_to(player,{"type": "error",
-                                                "target": {"type": "investment_error", "player": player, "action": action,
-                                                            "reason": 5}})
-                    will_remove = []
-                    for i in action['6']:
-                        x = i
-                        if x >= len(self.state.market):
-                            await self.send_to(player,{"type": "error",
-                                                    "target": {"type": "investment_error", "player": player,
-                                                                "action": action, "reason": 3}})
-                        self.state.players[player].resources[self.state.market[x]] += 1
-                        will_remove.append(self.state.market[x])
-                    for i in will_remove:
-                        self.state.market.remove(i)
-                    already_mined = True
+        with self._deadline("investment"):
+            while not rules.phase_done(self.state):
+                data = await self._collect_player_data("investment")
+                if data is None:
+                    continue
+                player = data['data']['player']
+                if player not in self.state.players:
+                    continue
+                if 'investments' in data['data']:
+                    outcome = self._rule("investments", player=player, actions=data['data']['investments'])
                 else:
-                    await self.send_to(player,{"type": "error",
-                                            "target": {"type": "investment_error", "player": player, "action": action,
-                                                        "reason": 1}})
-                    return False
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            elif action == '7':
-                if "铁镐" not in self.state.players[player].buildings:
-                    await self.send_to(player,{"type": "error",
-                                            "target": {"type": "investment_error", "player": player, "action": action,
-                                                        "reason": 1}})
-                    return False
-                self.state.players[player].resources[self.state.current_deck[0]] += 1
-                self.state.current_deck.pop(0)
-                self.state.players[player].buildings.remove("铁镐")
-                await self.send_to(player,{"type": "notify", "target": {"type": "investment_success", "player": player,
-                                                                    "action": action}})
-            else:
-                await self.send_to(player,{"type": "error", "target": {"type":"investment_error","player": player,"action": action,"reason":4}})
-            flag = False
-            for x in self.state.players.keys():
-                if x not in already:
-                    flag=True
-            if flag == False:
-                return True
+                    outcome = self._rule("investment", player=player, action=data['data']['investment'])
+                await self._apply(player, outcome)
 
     async def start_game(self):
-        self._game_task = asyncio.create_task(self._game_loop())
-        
-    async def _check_can_build(self, player_name:str, building:str):
-        calc = ResourceValueCalculator(self.state.resource_values)
-        cost = 0
-        required_building = {}
-        required_resources = {}
-        for k,v in self.recipes[building].items():
-            if k in self.all_buildings:
-                required_building[k]=v
-            if k in self.all_resources:
-                required_resources[k]=v
-        for k,v in required_resources.items():
-            cost += self.state.resource_values[k] * v
-        res_vaild = calc.calculate_equivalent_resources(self.state.players[player_name].resources,cost)
-        if not res_vaild:
-            return False,None
-        for k,v in required_building.items():
-            if k in self.state.players[player_name].buildings:
-                if self.state.players[player_name].buildings.count(v):
-                    return False ,None
-                else :
-                    for i in range(v):
-                        self.state.players[player_name].buildings.remove(k)
-        return True,res_vaild[0]['resources']
-
-    async def _pay_to_build(self, player_name:str, pay:Dict):
-        for k,v in pay.items():
-            self.state.players[player_name].resources[k] -= v
-            self.state.current_deck.append(k)
-
-    async def _process_build(self,player_name:str, building:str):
-        m , x=await self._check_can_build(player_name,building)
-        if m:
-            await self._pay_to_build(player_name,x)
-            self.state.players[player_name].buildings.append(building)
-            return True
-        return False
+        # 种子、座位顺序和规则参数足以从头重新生成整局（replay.py）
+        meta = {"room": self.room_id, "seed": self.seed, "players": list(self.state.players),
+                "ruleset": dataclasses.asdict(self.state.ruleset)}
+        events = self._rule("start")
+        # 开局之后再建日志，第一份快照里已经有洗好的牌堆和市场
+        self._attach_journal(journal.Journal.create(self.room_id, meta, self.state))
+        self._game_task = asyncio.create_task(self._game_loop(events))
+
     async def _handle_bidding(self):
         """
-        error:
-        :param data:
         {
             'type': 'bidding',
             'data': {
                 'player': 'xxx',
                 'bid': 9,
-                'wants': ['铁','木材']
             }
         }
-        :return:
+        超过 PHASE_TIMEOUT 秒还没出价的玩家按出价0处理
         """
-        already = list()
-        self.tmp = []
-        while True:
-            data = await self._collect_player_data("bidding")
-            player = data['data']['player']
-            bid = data['data']['bid']
-            if bid == 0:
-                await self.send_to(player,{"type": "notify", "target": {"type": "bidding_success", "player": player}})
-                already.append(player)
-                flag = False
-                for x in self.state.players.keys():
-                    if x not in already:
-                        flag = True
-                if not flag:
-                    return True
-                continue
-            self.tmp.append({"player":player,"bid":bid})
-            already.append(player)
-            await self.send_to(player,{"type": "notify", "target": {"type": "bidding_success", "player": player}})
-            flag = False
-            for x in self.state.players.keys():
-                if x not in already:
-                    flag = True
-            if not flag:
-                return True
+        with self._deadline("bidding"):
+            while not rules.phase_done(self.state):
+                data = await self._collect_player_data("bidding")
+                if data is None:
+                    continue
+                player = data['data']['player']
+                if player not in self.state.players:
+                    continue
+                await self._apply(player, self._rule("bid", player=player, amount=data['data']['bid']))
 
     async def _parse_bidding(self):
         """
+        按出价从高到低依次让玩家从市场拿取，每个竞标者超过 PHASE_TIMEOUT 秒没拿完就替他结束
         error:
         1=物品被他人拿取
         2=行动点不足
@@ -576,167 +850,235 @@ class Game:
                 'want': 1
             }
         }
-        :return:
         """
-        self.tmp.sort(key=lambda y: y['bid'], reverse=True)
-        await self.broadcast({"type": "notify", "target": {"type": "bidding_sorted", "sorted": [bid['player'] for bid in self.tmp]}})
-        for x in self.tmp:
-            if x['bid'] == 0:
+        for x in list(self.state.bids):
+            player = x['player']
+            if player not in self.state.players or player in self.state.finished:
                 continue
-            await self.state.players[x['player']].ws.send_json({"type":"notify","target":{"type":"data_required","epoch":self.state.epoch,"phase":-2}})
-            while True:
-                dt = await self._collect_player_data("bidding_wants",cur_player=x['player'])
-                if dt['data']['want'] == 'ok':
-                    await self.send_to(x['player'],{"type": "notify",
-                                          "target": {"type": "bidding_success", "player": x['player']}})
-                    break
-                if dt['data']['want'] >= len(self.state.market):
-                    await self.send_to(x['player'],{"type": "error",
-                                          "target": {"type": "bidding_error", "player": x['player'], "reason": 1}})
-                    continue
-                if self.state.players[x['player']].action_points < x['bid']:
-                    await self.send_to(x['player'],{"type": "error",
-                                          "target": {"type": "bidding_error", "player": x['player'], "reason": 2}})
-                    break
-                self.state.tmp_cnt_take[self.state.market[dt['data']['want']]] += 1
-                self.state.players[x['player']].action_points -= x['bid']
-                self.state.players[x['player']].resources[self.state.market[dt['data']['want']]] += 1
-                self.state.market.pop(dt['data']['want'])
-                await self.send_to(x['player'],{"type": "notify",
-                                          "target": {"type": "bidding_success", "player": x['player']}})
-    async def _update_resource_values(self):
-        if self.state.epoch % 3 != 0:
-            return
-        for k in self.state.resource_values.keys():
-            if self.state.tmp_cnt_take[k] == 0:
-                self.state.resource_values[k]+=1
-                await game.broadcast({"type": "notify", "target": {"type": "value_changed", "resource":k, "value": self.state.resource_values[k]}})
-        for k in self.state.resource_values.keys():
-            if self.state.tmp_cnt_take[k] >= 5:
-                if self.state.resource_values[k] == 1:
-                    continue
-                self.state.resource_values[k] -= 1
-                await game.broadcast({"type": "notify", "target": {"type": "value_changed", "resource":k, "value": self.state.resource_values[k]}})
-    async def _trigger_event_card(self):
-        print(self.state.epoch)
-        if self.state.epoch not in [3,6,9,13,15,18,21,23,25,27]:
-            return
-        event_deck = self.event_deck
-        if self.state.epoch in self.state.event_immunitie:
-            while "海盗掠夺" in event_deck:
-                event_deck.remove("海盗掠夺")
-            while "天降饥荒" in event_deck:
-                event_deck.remove("天降饥荒")
-        event = random.choice(event_deck)
-        await game.broadcast({"type": "notify", "target": {"type": "event_choiced", "epoch":self.state.epoch,"event":event}})
-        if event == "火山爆发":
-            self.state.market = self.state.market[:len(self.state.market)//2]
-        if event == "海盗掠夺":
-            calc = ResourceValueCalculator(self.state.resource_values)
-            died_player = []
-            for player,data in self.state.players.items():
-                can_pay = calc.calculate_equivalent_resources(data.resources,3*self.state.resource_values['金币'])
-                if "炮台" in data.buildings:
-                    data.buildings.remove("炮台")
-                    continue
-                if not can_pay:
-                    died_player.append(player)
-                    continue
-                for item,amount in can_pay[0]['resources'].items():
-                    self.state.players[player].resources[item] -= amount
-            await self.state.players[player].ws.send_json({"type": "notify", "target": {"type": "died_players", "players": died_player}})
-            for x in died_player:
-                del self.state.players[x]
-                await self.state.players[x].ws.close()
-        if event == "天降饥荒":
-            died_player = []
-            for player,data in self.state.players.items():
-                if data.resources['食物'] < 3:
-                    died_player.append(player)
-                    continue
-                data.resources['食物'] -= 3
-            await self.broadcast({"type": "notify", "target": {"type": "died_players", "players": died_player}})
-            for x in died_player:
-                del self.state.players[x]
-                await self.state.players[x].ws.close()
-        if event == "出现宝藏":
-            return
-            # calc = ResourceIsland.ResourceValueCalculator(self.resource_values)
-            # self.o.w(f">> 请各位玩家出价")
-            # bids = []
-            # for x in self.players.keys():
-            #     while True:
-            #         self.o.w(f">> 玩家 {x} 你的价格是：")
-            #         bid = int(input_())
-            #         vaild = calc.calculate_equivalent_resources(self.players[x]['resources'], bid)
-            #         if not vaild:
-            #             self.o.y(f">> 玩家 {x} 你无法承受这个价值，请重新输入")
-            #             continue
-            #         if bid == 0:
-            #             self.o.w(f">> 玩家 {x} 放弃")
-            #             break
-            #         bids.append({"player":x,"bid":bid,"will_pay":vaild[0]})
-            #         break
-            # bids.sort(key=lambda x:x['bid'],reverse=True)
-
-game = Game()
-@app.get("/game/state")
+            self._taking = player
+            await self.state.players[player].ws.send_json({"type":"notify","target":{"type":"data_required","epoch":self.state.epoch,"phase":-2}})
+            with self._deadline("bidding_wants", player):
+                while player in self.state.players:
+                    dt = await self._collect_player_data("bidding_wants",cur_player=player)
+                    if dt is None:
+                        continue
+                    outcome = self._rule("take", player=player, bid=x['bid'], want=dt['data']['want'])
+                    await self._apply(player, outcome)
+                    if outcome.done:
+                        break
+        self._taking = None
+
+    async def _enter_phase(self, phase:int):
+        """进入阶段，自动阶段的结算也在这里完成（见 journal.apply）"""
+        before = dict(self.state.players)
+        if phase == 4:
+            # 第3、4阶段之间不会让出事件循环，先把价值波动推送出去，
+            # 客户端收到 event_choiced 时副本已经是事件结算前的最新状态（client._before_event）
+            self._flush_state()
+        events = self._rule("phase", phase=phase)
+        await self._emit(events)
+        for name, player in before.items():
+            if name in self.state.players:
+                continue
+            # 死亡的玩家已经从状态里移除，广播收不到，单独补发后断开
+            for to, message in events:
+                if to is None:
+                    await player.ws.send_json(message)
+            await player.ws.close()
+
+class RoomManager:
+    """
+    管理同一进程内的所有房间，房间结束或被放弃后自动回收
+    大厅完全由加入/离开事件驱动：人数凑齐的那一刻直接开局，不轮询
+    """
+    def __init__(self, players_per_room:int=PLAYERS_PER_ROOM):
+        self.players_per_room = players_per_room
+        self.rooms: Dict[str, Game] = {}
+
+    def get(self, room_id:str) -> Game:
+        if room_id not in self.rooms:
+            raise HTTPException(status_code=404, detail="Room not found")
+        return self.rooms[room_id]
+
+    def get_or_create(self, room_id:str) -> Game:
+        if room_id not in self.rooms:
+            game = Game(room_id, on_finished=self._remove)
+            game._lobby_timer = asyncio.get_running_loop().call_later(LOBBY_TIMEOUT, game.finish)
+            self.rooms[room_id] = game
+        return self.rooms[room_id]
+
+    async def player_joined(self, game:Game):
+        if not game.state.started and len(game.state.players) >= self.players_per_room:
+            game._lobby_timer.cancel()
+            game.state.started = True
+            await game.start_game()
+
+    def player_left(self, game:Game):
+        if not game.state.players:
+            game.finish()
+
+    def shutdown(self):
+        """关闭服务器：已开局房间的日志保留下来，下次启动时恢复"""
+        for game in list(self.rooms.values()):
+            game.finish(keep_journal=True)
+
+    def recover(self):
+        """启动时从日志目录恢复所有已开局的房间"""
+        for path in journal.list_logs():
+            meta, snapshot, records = journal.read(path)
+            if meta is None or snapshot is None:
+                continue
+            game = Game(meta['room'], on_finished=self._remove, seed=meta['seed'])
+            elapsed = game.restore(path, meta, snapshot, records)
+            self.rooms[game.room_id] = game
+            print(f"恢复房间 {game.room_id}：第{game.state.epoch}轮，{len(game.state.players)}名玩家，"
+                  f"重放{len(records)}条记录，用时{elapsed * 1000:.1f}ms")
+            if game.state.rng.divergences:
+                print(f"  {game.state.rng.divergences} 次随机抽取和日志记录不一致，已按记录恢复")
+
+    def _remove(self, game:Game):
+        if self.rooms.get(game.room_id) is game:
+            del self.rooms[game.room_id]
+
+rooms = RoomManager()
+deadlines = DeadlineScheduler()
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    rooms.recover()
+    yield
+    rooms.shutdown()
+
+# 返回字典的路由也用 orjson 编码；热点路由直接返回 ORJSONResponse，连 jsonable_encoder 也跳过
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+@app.get("/rooms")
 async def _():
     return {
-        "market" :game.state.market,
+        room_id: {"players": len(game.state.players), "started": game.state.started}
+        for room_id, game in rooms.rooms.items()
+    }
+
+@app.get("/stats")
+async def _():
+    """进程级运行数据，压测工具用两次采样之差计算服务器CPU占用"""
+    return {
+        "rooms": len(rooms.rooms),
+        "players": sum(len(game.state.players) for game in rooms.rooms.values()),
+        "players_per_room": PLAYERS_PER_ROOM,
+        "deadlines": len(deadlines),
+        "cpu_time": time.process_time(),
+        "uptime": time.monotonic(),
+    }
+@app.get("/game/{room}/state")
+async def _(room:str):
+    game = rooms.get(room)
+    return ORJSONResponse({
+        "market" :game.state.market.to_list(),
         "epoch": game.state.epoch,
         "phase": game.state.phase,
         "players": [player for player in game.state.players.keys()],
         "values": game.state.resource_values,
         "started": game.state.started
-    }
-@app.get("/playerinfo/{player}")
-async def _(player:str):
+    })
+@app.get("/game/{room}/leaderboard")
+async def _(room:str):
+    """按得分从高到低的排行榜，得分在每次修改时已经更新好"""
+    return Response(content=rooms.get(room).leaderboard(), media_type="application/json")
+@app.get("/game/{room}/snapshot")
+async def _(room:str, request:Request):
+    """一次返回整个房间的状态，带版本号和ETag，未变化时返回304"""
+    game = rooms.get(room)
+    etag, body = game.snapshot()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+@app.get("/playerinfo/{room}/{player}")
+async def _(room:str, player:str):
+    game = rooms.get(room)
     if player not in game.state.players:
-        return {}
-    return {
+        return ORJSONResponse({})
+    return ORJSONResponse({
         "action_points" : game.state.players[player].action_points,
-        "resources": game.state.players[player].resources,
-        "buildings": game.state.players[player].buildings,
+        "resources": game.state.players[player].resources.to_dict(),
+        "buildings": game.state.players[player].buildings.to_list(),
         "bank_money": game.state.players[player].bank_money
-    }
-@app.websocket("/ws/{player}")
-async def _(ws: WebSocket, player: str):
-    if game.state.players.__len__() > 4:
+    })
+@app.websocket("/ws/{room}/{player}")
+async def _(ws: WebSocket, room: str, player: str):
+    game = rooms.get_or_create(room)
+    existing = game.state.players.get(player)
+    if existing is not None and isinstance(existing.ws, OfflineConnection):
+        # 服务器重启后恢复的房间，玩家重新连接
+        conn = await _accept(ws)
+        await game.reconnect(player, conn)
+        await game.broadcast({"type": "notify", "target": {"type": "player_join", "player": player}})
+        await _serve_player(game, player, conn)
+        return
+    if game.state.players.__len__() >= MAX_PLAYERS_PER_ROOM:
         return
     if game.state.started:
         return
-    await ws.accept()
-    game.state.players[player] = Player(ws=ws,resources=defaultdict(int))
+    conn = await _accept(ws)
+    if game.state.started or game.state.players.__len__() >= MAX_PLAYERS_PER_ROOM:
+        # 等待握手期间房间可能已经开局或满员
+        await conn.close()
+        return
+    game.state.players[player] = Player(ws=conn)
     await game.broadcast({"type": "notify", "target": {"type": "player_join", "player": player}})
+    await game.send_full_state(conn)
+    await rooms.player_joined(game)
+    await _serve_player(game, player, conn)
+
+async def _accept(ws:WebSocket) -> Connection:
+    """完成握手，客户端请求了 msgpack 子协议时这个连接改用二进制帧（见 wire.py）"""
+    subprotocol = wire.negotiate(ws.scope.get("subprotocols", []))
+    await ws.accept(subprotocol=subprotocol)
+    return Connection(ws, wire.codec_for(subprotocol))
+
+async def _serve_player(game:Game, player:str, conn:Connection):
     try:
         while True:
             # The use of WebSocket protocol for transmission has been abandoned
-            data = await ws.receive_json()
+            data = await conn.receive()
             await game._handle_player_message(player, data)
     except WebSocketDisconnect:
-        del game.state.players[player]
+        conn.abort()
+        if game.state.players.get(player) is not None and game.state.players[player].ws is conn:
+            game.leave(player)
         await game.broadcast({"type":"notify","target":{"type":"player_left","player":player}})
+        rooms.player_left(game)
+
+@app.websocket("/watch/{room}")
+async def _(ws: WebSocket, room: str):
+    """观战连接，只接收状态推送"""
+    if room not in rooms.rooms:
+        await ws.close()
+        return
+    game = rooms.rooms[room]
+    conn = await _accept(ws)
+    await game.watch(conn)
+    try:
+        while True:
+            await conn.receive()
+    except WebSocketDisconnect:
+        conn.abort()
+        game.spectators.discard(conn)
 
-async def game_starter():
-    async def a():
-        while len(game.state.players)!=2:          # 设置人数
-            await asyncio.sleep(0.1)
-        game.state.started = True
-        return True
-    await asyncio.wait_for(a(),timeout=300)
-    await game.start_game()
-
-@app.post("/submit/{type}/{player}/")
-async def _(player:str,type:str,data:dict):
-    await game._handle_player_message(player,data)
+@app.post("/submit/{room}/{type}/{player}/")
+async def _(room:str,player:str,type:str,data:dict):
+    game = rooms.get(room)
+    # 每次提交带上关联ID，游戏循环处理这条消息时的第一条回复直接完成这个 Future
+    rid, fut = game.register_request()
+    data['rid'] = rid
     try:
-        resp = await asyncio.wait_for(game.get_server_resp(player,cur_phase=type),timeout=10)
-        return resp
+        await game._handle_player_message(player,data)
+        return ORJSONResponse(await asyncio.wait_for(fut,timeout=10))
     except asyncio.TimeoutError:
-        return {}
+        return ORJSONResponse({})
+    finally:
+        game.forget_request(rid)
 
 if __name__ == "__main__":
-    Thread(target=lambda: asyncio.run(game_starter()),name="game_starter",daemon=True).start()
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
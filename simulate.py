@@ -0,0 +1,175 @@
+"""
+蒙特卡洛批量模拟器：在进程池里用规则核心跑完整对局，统计胜率和平衡性
+用法:
+    python simulate.py --games 1000000 --strategies builder,random,passive --out results.npz
+    python simulate.py --games 100000 --ruleset my_rules.json       用 JSON 覆盖 Ruleset 里的参数
+每局的结果按列存成 NumPy 数组写入压缩的 .npz，规则参数和名称表一起写在 meta 里，可以用
+    numpy.load('results.npz') 读回做进一步分析
+"""
+import argparse
+import dataclasses
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+from tabulate import tabulate
+
+import rules
+import valuation
+from bots import STRATEGIES, Strategy
+
+MAX_SEATS = 5           # 和服务器的 MAX_PLAYERS_PER_ROOM 一致
+CHUNK_SIZE = 2000       # 每个进程任务跑多少局
+
+def play_game(ruleset:rules.Ruleset, strategies:List[Strategy], seed:int):
+    """
+    不经过网络跑完一整局
+    :param strategies: 每个座位的策略对象
+    :return: (结束时的状态, 依次发生的事件)，死亡的玩家已经从 state.players 中移除
+    """
+    state = rules.GameState(ruleset, rng=random.Random(seed))
+    for seat in range(len(strategies)):
+        state.players[f'p{seat}'] = rules.PlayerState()
+    seats = dict(zip(state.players, strategies))
+    events = []
+    rules.start_game(state)
+    while not rules.game_over(state):
+        rules.enter_phase(state, 1)
+        for player in list(state.players):
+            for action in seats[player].investment(state, player):
+                rules.investment(state, player, action)
+            rules.investment(state, player, 'ok')
+        rules.enter_phase(state, 2)
+        for player in list(state.players):
+            rules.bid(state, player, seats[player].bid(state, player))
+        rules.enter_phase(state, -2)
+        for x in list(state.bids):
+            for want in seats[x['player']].wants(state, x['player']):
+                if rules.take(state, x['player'], x['bid'], want).done:
+                    break
+        rules.enter_phase(state, 3)
+        rules.update_resource_values(state)
+        rules.enter_phase(state, 4)
+        event = rules.draw_event(state)
+        if event is not None:
+            rules.apply_event(state, event)
+            events.append(event)
+        rules.end_epoch(state)
+    return state, events
+
+def run_chunk(ruleset:rules.Ruleset, lineup:List[str], first_seed:int, games:int):
+    """在子进程里跑 games 局，返回按列组织的结果"""
+    seats = len(lineup)
+    event_names = sorted(set(ruleset.event_deck))
+    columns = {
+        'seed': np.arange(first_seed, first_seed + games, dtype=np.int64),
+        'epochs': np.zeros(games, dtype=np.int16),
+        'winner': np.full(games, -1, dtype=np.int8),
+        'alive': np.zeros((games, seats), dtype=bool),
+        'score': np.zeros((games, seats), dtype=np.float32),
+        'buildings': np.zeros((games, seats), dtype=np.int16),
+        'action_points': np.zeros((games, seats), dtype=np.int16),
+        'events': np.zeros((games, len(event_names)), dtype=np.int8),
+        'values': np.zeros((games, len(rules.ALL_RESOURCES)), dtype=np.int16),
+    }
+    inventory = np.zeros((games, seats, len(rules.ALL_RESOURCES)), dtype=np.int64)
+    bank_money = np.zeros((games, seats), dtype=np.int64)
+    for i in range(games):
+        seed = first_seed + i
+        strategy_rng = random.Random(seed ^ 0x5EED)
+        state, events = play_game(ruleset, [STRATEGIES[name](strategy_rng) for name in lineup], seed)
+        columns['epochs'][i] = state.epoch - 1
+        for seat in range(seats):
+            data = state.players.get(f'p{seat}')
+            if data is None:
+                continue
+            columns['alive'][i, seat] = True
+            inventory[i, seat] = valuation.inventory_matrix([data.resources])[0]
+            bank_money[i, seat] = data.bank_money
+            columns['buildings'][i, seat] = len(data.buildings)
+            columns['action_points'][i, seat] = data.action_points
+        for event in events:
+            columns['events'][i, event_names.index(event)] += 1
+        columns['values'][i] = [state.resource_values[res] for res in rules.ALL_RESOURCES]
+    # 整块对局一起结算，死亡的玩家不参与比较，得分相同取座位靠前的
+    score = valuation.scores(inventory, columns['values'].astype(np.int64), columns['buildings'], bank_money)
+    columns['score'] = np.where(columns['alive'], score, 0).astype(np.float32)
+    ranked = np.where(columns['alive'], score, np.iinfo(np.int64).min)
+    columns['winner'] = np.where(columns['alive'].any(axis=1), ranked.argmax(axis=1), -1).astype(np.int8)
+    return columns
+
+def simulate(ruleset:rules.Ruleset, lineup:List[str], games:int, seed:int=0, workers:int=None, chunk:int=CHUNK_SIZE):
+    """把 games 局分成若干块交给进程池，按局的顺序拼回完整的列"""
+    starts = list(range(0, games, chunk))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_chunk, ruleset, lineup, seed + start, min(chunk, games - start))
+                   for start in starts]
+        parts = [future.result() for future in futures]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def summarize(results, lineup:List[str], ruleset:rules.Ruleset):
+    games = len(results['seed'])
+    rows = []
+    for seat, name in enumerate(lineup):
+        alive = results['alive'][:, seat]
+        rows.append([
+            seat, name,
+            f"{np.mean(results['winner'] == seat) * 100:.1f}%",
+            f"{np.mean(alive) * 100:.1f}%",
+            f"{results['score'][alive, seat].mean() if alive.any() else 0:.1f}",
+            f"{results['buildings'][alive, seat].mean() if alive.any() else 0:.2f}",
+        ])
+    print(tabulate(rows, headers=["座位", "策略", "胜率", "存活率", "平均价值(存活)", "平均建筑数(存活)"]))
+    print()
+    print(f"全灭的对局: {np.mean(results['winner'] == -1) * 100:.1f}%  平均进行轮数: {results['epochs'].mean():.1f}")
+    event_names = sorted(set(ruleset.event_deck))
+    print(tabulate([[name, f"{results['events'][:, i].sum() / games:.2f}"] for i, name in enumerate(event_names)],
+                   headers=["事件", "每局平均次数"]))
+    print(tabulate([[res, f"{results['values'][:, i].mean():.2f}"] for i, res in enumerate(rules.ALL_RESOURCES)],
+                   headers=["资源", "结束时平均价值"]))
+
+def load_ruleset(path:str=None) -> rules.Ruleset:
+    if path is None:
+        return rules.DEFAULT_RULESET
+    with open(path, encoding='utf-8') as f:
+        return dataclasses.replace(rules.DEFAULT_RULESET, **json.load(f))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--strategies', default='builder,random',
+                        help=f"逗号分隔，每个座位一个策略，可选 {', '.join(sorted(STRATEGIES))}")
+    parser.add_argument('--ruleset', help='覆盖规则参数的 JSON 文件')
+    parser.add_argument('--seed', type=int, default=0, help='第一局的种子，第i局使用 seed+i')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--out', default='simulation.npz')
+    args = parser.parse_args()
+
+    lineup = args.strategies.split(',')
+    if not 1 <= len(lineup) <= MAX_SEATS or any(name not in STRATEGIES for name in lineup):
+        parser.error(f"需要 1~{MAX_SEATS} 个策略，可选 {', '.join(sorted(STRATEGIES))}")
+    ruleset = load_ruleset(args.ruleset)
+
+    start = time.perf_counter()
+    results = simulate(ruleset, lineup, args.games, args.seed, args.workers, args.chunk)
+    elapsed = time.perf_counter() - start
+    print(f"{args.games} 局用时 {elapsed:.1f}s（{args.games / elapsed:.0f} 局/s，{args.workers} 个进程）\n")
+    summarize(results, lineup, ruleset)
+
+    meta = {
+        'strategies': lineup,
+        'resources': rules.ALL_RESOURCES,
+        'events': sorted(set(ruleset.event_deck)),
+        'seed': args.seed,
+        'ruleset': dataclasses.asdict(ruleset),
+    }
+    np.savez_compressed(args.out, meta=np.array(json.dumps(meta, ensure_ascii=False)), **results)
+    print(f"\n结果已写入 {args.out}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+class StateReplica:
+    """
+    服务器房间状态的本地副本（客户端和观战器共用）
+    服务器通过WebSocket推送 {"type":"state","target":{...}}，target 有两种：
+        {"type":"full","state":{...}}                               完整状态
+        {"type":"delta","base":1,"version":2,"changes":{...}}      相对 base 版本的增量
+    """
+    def __init__(self):
+        self.state = None
+        self.version = 0
+
+    def load(self, state:dict):
+        self.state = state
+        self.version = state['version']
+
+    def apply(self, target:dict) -> bool:
+        """
+        应用一条推送
+        :return: False 表示版本不连续（中间的增量丢了），需要重新拉取快照
+        """
+        if target['type'] == 'full':
+            self.load(target['state'])
+            return True
+        if self.state is None or target['version'] <= self.version:
+            # 还没收到完整状态，或者是已经包含在快照里的旧增量
+            return True
+        if target['base'] != self.version:
+            return False
+        changes = target['changes']
+        for key, value in changes.items():
+            if key not in ('players', 'removed_players'):
+                self.state[key] = value
+        self.state['players'].update(changes.get('players', {}))
+        for name in changes.get('removed_players', []):
+            self.state['players'].pop(name, None)
+        self.state['version'] = self.version = target['version']
+        return True
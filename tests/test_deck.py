@@ -0,0 +1,92 @@
+"""
+牌堆和市场测试
+运行: python -m pytest -q tests
+"""
+import os
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from deck import Deck, Market
+
+def test_deck_counts_and_draw():
+    deck = Deck(random.Random(0))
+    deck.refill({'木材': 3, '铁': 2, '钻石': 0})
+    assert len(deck) == 5 and deck.count('木材') == 3 and deck.count('钻石') == 0
+    drawn = Counter(deck.draw() for _ in range(5))
+    assert drawn == Counter({'木材': 3, '铁': 2})
+    assert not deck
+    with pytest.raises(IndexError):
+        deck.draw()
+    with pytest.raises(IndexError):
+        deck.draw_bottom()
+
+def test_deck_top_cards_come_first():
+    deck = Deck(random.Random(0))
+    deck.refill({'铁': 10})
+    deck.extend(['木材', '食物'])
+    assert deck.count('木材') == 1 and len(deck) == 12
+    assert deck.draw() == '食物'
+    assert deck.draw() == '木材'
+    # 铁镐从最下面抽，不会抽到压在上面的牌
+    deck.append('钻石')
+    assert deck.draw_bottom() == '铁'
+    assert deck.count('钻石') == 1
+
+def test_deck_remove():
+    deck = Deck(random.Random(0))
+    deck.refill({'木材': 1})
+    deck.append('木材')
+    deck.remove('木材')
+    deck.remove('木材')
+    assert len(deck) == 0
+    with pytest.raises(ValueError):
+        deck.remove('木材')
+
+def test_deck_draw_follows_remaining_counts():
+    # 加权抽取和从洗乱的列表里抽牌等价：每种牌被抽到的频率和剩余张数成正比
+    rng = random.Random(1)
+    first = Counter()
+    for _ in range(4000):
+        deck = Deck(rng)
+        deck.refill({'铁': 3, '木材': 1})
+        first[deck.draw()] += 1
+    assert 0.7 < first['铁'] / 4000 < 0.8
+
+def test_deck_restore_and_copy():
+    deck = Deck(random.Random(0))
+    deck.refill({'铁': 4, '矿石': 2})
+    deck.append('金币')
+    restored = Deck(random.Random(0))
+    restored.restore(deck.to_dict())
+    assert restored.counts() == deck.counts() and restored.to_dict() == deck.to_dict()
+
+    clone = deck.copy(random.Random(0))
+    clone.draw()
+    clone.remove('铁')
+    assert len(deck) == 7 and deck.count('金币') == 1 and deck.count('铁') == 4
+
+def test_market_keeps_order_and_counts():
+    market = Market(['铁', '木材', '铁', '钻石'])
+    assert len(market) == 4 and market.count('铁') == 2 and market.kinds() == 3
+    assert '钻石' in market and '金币' not in market
+    market.remove('铁')
+    assert market.to_list() == ['木材', '铁', '钻石']
+    assert market.pop(0) == '木材' and market.count('木材') == 0
+    with pytest.raises(ValueError):
+        market.remove('木材')
+    market.extend(['食物', '食物'])
+    market.truncate(2)
+    assert market.to_list() == ['铁', '钻石'] and market.count('食物') == 0
+    assert market.clear() == ['铁', '钻石'] and not market and market.kinds() == 0
+
+def test_market_copy_is_independent():
+    market = Market(['铁', '木材'])
+    clone = market.copy()
+    clone.pop()
+    clone.append('钻石')
+    assert market.to_list() == ['铁', '木材'] and market.count('钻石') == 0
+    assert clone.to_list() == ['铁', '钻石']
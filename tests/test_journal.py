@@ -0,0 +1,133 @@
+"""
+房间日志测试：快照往返、按日志重放、日志文件的写入和恢复
+运行: python -m pytest -q tests
+"""
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import journal
+import replay
+import rules
+
+PHASES = [1, 2, -2, 3, 4]
+
+class Recorder:
+    """像服务器一样执行规则调用：每次调用和每次随机抽取都记下来"""
+    def __init__(self, seed:int, players):
+        self.state = rules.GameState(rng=journal.JournalRandom(seed))
+        for name in players:
+            self.state.players[name] = rules.PlayerState()
+        self.meta = {"t": "meta", "room": "test", "seed": seed, "players": list(players),
+                     "ruleset": dataclasses.asdict(self.state.ruleset)}
+        journal.apply(self.state, "start", {})
+        self.records = [json.loads(json.dumps(journal.snapshot_record(self.state, initial=True)))]
+        self.state.rng.on_draw = lambda value: self.records.append({"t": "rng", "v": value})
+
+    def rule(self, op:str, **args):
+        result = journal.apply(self.state, op, args)
+        self.records.append({"t": "op", "op": op, **args})
+        return result
+
+    def snapshot(self):
+        self.records.append(json.loads(json.dumps(journal.snapshot_record(self.state))))
+
+def play(recorder:Recorder, rng:random.Random, epochs:int):
+    """随机操作玩几轮，和服务器的阶段流程相同"""
+    state = recorder.state
+    actions = ['1', '2', '4', '7', {'3': '铁镐'}, {'3': '农场'}, {'6': [0, 1]}, {'5': '食物x1'}]
+    for _ in range(epochs):
+        if rules.game_over(state):
+            return
+        for phase in PHASES:
+            recorder.rule("phase", phase=phase)
+            if phase == 1:
+                for name in list(state.players):
+                    recorder.rule("investments", player=name, actions=rng.sample(actions, 3) + ['ok'])
+            elif phase == 2:
+                for name in list(state.players):
+                    recorder.rule("bid", player=name, amount=rng.randint(0, 2))
+            elif phase == -2:
+                for bid in list(state.bids):
+                    if bid["player"] in state.players:
+                        recorder.rule("take", player=bid["player"], bid=bid["bid"], want=0)
+                        recorder.rule("take", player=bid["player"], bid=bid["bid"], want='ok')
+        recorder.snapshot()
+
+def test_dump_and_restore_round_trip():
+    recorder = Recorder(1, ['a', 'b'])
+    play(recorder, random.Random(1), 4)
+    dumped = json.loads(json.dumps(journal.dump_state(recorder.state)))
+    restored = rules.GameState(rng=journal.JournalRandom())
+    journal.restore_state(restored, dumped)
+    assert json.loads(json.dumps(journal.dump_state(restored))) == dumped
+
+def test_replay_reproduces_the_game():
+    recorder = Recorder(2, ['a', 'b', 'c'])
+    play(recorder, random.Random(2), 12)
+    state, checked = replay.run(recorder.meta, recorder.records)
+    assert checked == 1 + 12      # 开局快照和每轮一份
+    assert journal.dump_state(state) == journal.dump_state(recorder.state)
+
+def test_replay_detects_divergence():
+    recorder = Recorder(3, ['a', 'b'])
+    play(recorder, random.Random(3), 3)
+    for record in recorder.records:
+        if record["t"] == "rng" and isinstance(record["v"], int):
+            record["v"] += 1
+            break
+    else:
+        pytest.skip("这局没有整数的随机抽取")
+    with pytest.raises(journal.ReplayDivergence):
+        replay.run(recorder.meta, recorder.records)
+
+def test_restore_from_compacted_log():
+    recorder = Recorder(4, ['a', 'b'])
+    play(recorder, random.Random(4), 3)
+    # 压缩过的日志从一份快照开始，后面接着记录
+    start = len(recorder.records)
+    recorder.snapshot()
+    play(recorder, random.Random(5), 2)
+    records = recorder.records[start:]
+    state = rules.GameState(rng=journal.JournalRandom(4))
+    journal.restore_state(state, records[0]["state"])
+    state.rng.setstate(records[0]["rng"])
+    journal.replay(state, records[1:])
+    assert state.rng.divergences == 0
+    assert journal.dump_state(state) == journal.dump_state(recorder.state)
+
+def test_journal_file_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(journal, "ARCHIVE_DIR", "")
+
+    async def run():
+        state = rules.GameState(rng=journal.JournalRandom(6))
+        state.players['a'] = rules.PlayerState()
+        journal.apply(state, "start", {})
+        log = journal.Journal.create("room/1", {"room": "room/1", "seed": 6}, state)
+        state.rng.on_draw = lambda value: log.append({"t": "rng", "v": value})
+        for phase in (1, 2):
+            journal.apply(state, "phase", {"phase": phase})
+            log.append({"t": "op", "op": "phase", "phase": phase})
+        await asyncio.sleep(0)
+        assert journal.list_logs() == [log.path]
+        meta, snapshot, records = journal.read(log.path)
+        assert meta["seed"] == 6 and snapshot["initial"] and [r["phase"] for r in records] == [1, 2]
+
+        # 压缩后只剩 meta 和当前状态的快照
+        log.compact(state)
+        meta, snapshot, records = journal.read(log.path)
+        assert records == [] and snapshot["state"]["phase"] == 2
+        # 写了一半的最后一行被忽略
+        with open(log.path, "ab") as f:
+            f.write(b'{"t":"op","op":')
+        assert journal.read(log.path)[2] == []
+        log.close(remove=True)
+        assert journal.list_logs() == []
+    asyncio.run(run())
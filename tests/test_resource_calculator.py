@@ -0,0 +1,78 @@
+"""
+等值物资计算器测试：和穷举所有组合的结果比较
+运行: python -m pytest -q tests
+"""
+import itertools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from resource_calculator import INF, ResourceValueCalculator
+
+VALUES = {'钻石': 8, '金币': 6, '木材': 2, '矿石': 3, '食物': 1, '铁': 2}
+
+def brute_force(resources, values, target):
+    """:return: (最接近目标的总价值, 这个总价值下最少的资源种类数)，凑不出时为 None"""
+    items = [(res, values[res], qty) for res, qty in resources.items() if qty > 0 and values.get(res, 0) > 0]
+    best = None
+    for qtys in itertools.product(*(range(qty + 1) for _, _, qty in items)):
+        total = sum(q * value for q, (_, value, _) in zip(qtys, items))
+        if total < max(target, 0):
+            continue
+        key = (total, sum(1 for q in qtys if q))
+        if best is None or key < best:
+            best = key
+    return best
+
+def random_inventory(rng):
+    return {res: rng.randint(0, 3) for res in rng.sample(sorted(VALUES), rng.randint(1, 4))}
+
+def check(result, resources, values, target):
+    expected = brute_force(resources, values, target)
+    if expected is None:
+        assert result is None
+        return
+    combo = result['resources']
+    assert all(0 < qty <= resources[res] for res, qty in combo.items())
+    assert sum(values[res] * qty for res, qty in combo.items()) == result['total_value']
+    assert (result['total_value'], len(combo)) == expected
+    assert result['difference'] == result['total_value'] - max(target, 0)
+
+def test_best_combination_matches_brute_force():
+    rng = random.Random(0)
+    calc = ResourceValueCalculator(VALUES)
+    for _ in range(300):
+        resources = random_inventory(rng)
+        target = rng.randint(-2, 40)
+        check(calc.best_combination(resources, target), resources, VALUES, target)
+
+def test_best_combinations_matches_single_targets():
+    rng = random.Random(1)
+    calc = ResourceValueCalculator(VALUES)
+    for _ in range(100):
+        resources = random_inventory(rng)
+        targets = {rng.randint(0, 40) for _ in range(5)}
+        results = calc.best_combinations(resources, targets)
+        assert results.keys() == targets
+        for target in targets:
+            assert results[target] == calc.best_combination(resources, target)
+            check(results[target], resources, VALUES, target)
+
+def test_solve_counts_fewest_types():
+    items = [('铁', 2, 3), ('金币', 6, 1)]
+    types, choices = ResourceValueCalculator._solve(items, 12)
+    assert types[0] == 0 and types[1] == INF
+    assert types[6] == 1            # 一个金币比三个铁少一种
+    assert types[8] == 2 and types[12] == 2
+    assert types[11] == INF
+    assert ResourceValueCalculator._rebuild(items, choices, 8) == {'铁': 1, '金币': 1}
+
+def test_ignores_reserved_and_worthless_resources():
+    calc = ResourceValueCalculator({'铁': 2, '保留铁': 2, '石头': 0})
+    assert calc.best_combination({'保留铁': 5, '石头': 5}, 1) is None
+    assert calc.best_combination({'铁': 1, '保留铁': 5}, 2)['resources'] == {'铁': 1}
+    assert calc.calculate_equivalent_resources({'铁': 3}, 3, top_k=None) == [
+        {'resources': {'铁': 2}, 'total_value': 4, 'difference': 1},
+        {'resources': {'铁': 3}, 'total_value': 6, 'difference': 3},
+    ]
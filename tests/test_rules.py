@@ -0,0 +1,199 @@
+"""
+规则核心测试：容器、投资、竞标拿取、价值波动和事件
+运行: python -m pytest -q tests
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rules
+
+def make_state(**players) -> rules.GameState:
+    """:param players: 玩家名 -> {resources, buildings, action_points}"""
+    state = rules.GameState(rng=random.Random(0))
+    for name, data in players.items():
+        state.players[name] = rules.PlayerState(**data)
+    rules.shuffle_deck(state)
+    return state
+
+def test_inventory_behaves_like_a_counter():
+    changes = []
+    inv = rules.Inventory({'铁': 2}, on_change=lambda res, delta: changes.append((res, delta)))
+    assert inv['铁'] == 2 and inv['钻石'] == 0 and len(inv) == len(rules.ALL_RESOURCES)
+    inv['铁'] += 3
+    inv['铁'] = 5
+    del inv['铁']
+    assert changes == [('铁', 3), ('铁', -5)]
+    assert inv.to_dict() == dict.fromkeys(rules.ALL_RESOURCES, 0)
+    with pytest.raises(KeyError):
+        inv['石头'] += 1
+    assert inv.get('石头') is None and '石头' not in inv
+
+def test_buildings_count_and_remove():
+    changes = []
+    owned = rules.Buildings(['农场', '铁镐', '铁镐'], on_change=changes.append)
+    assert len(owned) == 3 and owned.count('铁镐') == 2 and '银行' not in owned
+    owned.remove('铁镐')
+    owned.append('银行')
+    assert changes == [-1, 1]
+    assert owned.to_list() == ['农场', '铁镐', '银行']
+    with pytest.raises(ValueError):
+        owned.remove('炮台')
+    with pytest.raises(ValueError):
+        owned.append('城堡')
+
+def test_copy_on_write():
+    player = rules.PlayerState(resources={'铁': 1}, buildings=['农场'])
+    snapshot = player.copy()
+    assert snapshot.same_as(player)
+    player.resources['铁'] += 1
+    player.buildings.append('银行')
+    assert snapshot.resources['铁'] == 1 and snapshot.buildings.to_list() == ['农场']
+    assert not snapshot.same_as(player)
+    snapshot.resources['金币'] = 4
+    assert player.resources['金币'] == 0
+
+def test_game_state_copy_is_independent():
+    state = make_state(a={'resources': {'矿石': 3}})
+    rules.start_game(state)
+    clone = state.copy()
+    assert clone.rng.random() == state.rng.random()
+    clone.players['a'].resources['矿石'] = 0
+    clone.market.pop()
+    clone.current_deck.draw()
+    assert state.players['a'].resources['矿石'] == 3
+    assert len(state.market) == len(clone.market) + 1
+    assert len(state.current_deck) == len(clone.current_deck) + 1
+
+def test_start_game_fills_market_and_food():
+    state = make_state(a={}, b={})
+    rules.start_game(state)
+    assert len(state.market) == state.ruleset.initial_market
+    assert all(p.resources['食物'] == state.ruleset.initial_food for p in state.players.values())
+    deck_total = sum(state.ruleset.resource_deck.values())
+    assert len(state.current_deck) == deck_total - state.ruleset.initial_market
+
+def test_investment_explore_and_exchange():
+    state = make_state(a={'resources': {'食物': 1}, 'action_points': 1})
+    rules.start_game(state)
+    market = len(state.market)
+    assert rules.investment(state, 'a', '1').reply['type'] == 'notify'
+    assert len(state.market) == market + 2 and state.players['a'].action_points == 0
+    assert rules.investment(state, 'a', '1').reply['target']['reason'] == rules.NOT_ENOUGH
+    rules.investment(state, 'a', '2')
+    assert state.players['a'].action_points == 3
+    assert rules.investment(state, 'a', '2').reply['target']['reason'] == rules.NOT_ENOUGH
+    assert rules.investment(state, 'a', 'x').reply['target']['reason'] == rules.UNKNOWN_ACTION
+
+def test_investment_build_pays_with_resources():
+    state = make_state(a={'action_points': 3})
+    # 市场空着时投资前会强制探索，先开局摆好市场；开局发的食物也能用来支付，清掉
+    rules.start_game(state)
+    state.players['a'].resources.update({'食物': 0, '铁': 2})
+    outcome = rules.investment(state, 'a', {'3': '铁镐'})
+    assert outcome.reply['type'] == 'notify'
+    player = state.players['a']
+    assert player.buildings.to_list() == ['铁镐'] and player.resources['铁'] == 0 and player.action_points == 0
+    # 矿机需要前置建筑铁镐，建造时消耗掉
+    player.resources['铁'] = 5
+    player.action_points = 3
+    assert rules.build_options(state, 'a')['矿机'] == {'铁': 5}
+    rules.investment(state, 'a', {'3': '矿机'})
+    assert player.buildings.to_list() == ['矿机']
+    assert rules.investment(state, 'a', {'3': '城堡'}).reply['target']['reason'] == rules.OUT_OF_RANGE
+
+def test_build_options_agree_with_build_plan():
+    rng = random.Random(0)
+    state = make_state(a={})
+    player = state.players['a']
+    for _ in range(50):
+        player.resources.update({res: rng.randint(0, 6) for res in rules.ALL_RESOURCES})
+        player.buildings = rules.Buildings(rng.sample(rules.ALL_BUILDINGS, 2))
+        options = rules.build_options(state, 'a')
+        assert list(options) == state.ruleset.recipe_book.order
+        for building, plan in options.items():
+            assert plan == rules.build_plan(state, 'a', building)
+
+def test_investments_stop_at_ok():
+    state = make_state(a={'resources': {'食物': 2}, 'action_points': 0})
+    # 市场空着时投资前会强制探索，先开局摆好市场
+    rules.start_game(state)
+    outcome = rules.investments(state, 'a', ['2', '1', 'ok', '1'])
+    assert outcome.done and 'a' in state.finished
+    results = outcome.reply['target']['results']
+    assert [r['type'] for r in results] == ['notify', 'notify', 'notify']
+    assert state.players['a'].action_points == 2
+    bad = rules.investments(state, 'a', '1')
+    assert bad.reply['target']['reason'] == rules.UNKNOWN_ACTION and not bad.done
+
+def test_bid_and_take():
+    state = make_state(a={'action_points': 4}, b={'action_points': 1})
+    state.market.extend(['铁', '钻石'])
+    rules.enter_phase(state, 2)
+    rules.bid(state, 'a', 2)
+    rules.bid(state, 'a', 9)        # 只有第一次出价有效
+    rules.bid(state, 'b', 0)
+    assert rules.phase_done(state) and state.bids == [{'player': 'a', 'bid': 2}]
+    rules.enter_phase(state, -2)
+    assert not rules.take(state, 'a', 2, 1).done
+    assert state.players['a'].resources['钻石'] == 1 and state.players['a'].action_points == 2
+    assert rules.take(state, 'a', 2, 5).reply['target']['reason'] == rules.TAKEN
+    assert rules.take(state, 'a', 2, 'ok').done and 'a' in state.finished
+    assert state.tmp_cnt_take['钻石'] == 1
+
+def test_update_resource_values():
+    state = make_state(a={})
+    state.epoch = state.ruleset.value_update_interval
+    state.tmp_cnt_take['铁'] = state.ruleset.value_drop_threshold
+    state.tmp_cnt_take['木材'] = 1
+    before = dict(state.resource_values)
+    events = rules.update_resource_values(state)
+    assert state.resource_values['铁'] == before['铁'] - 1
+    assert state.resource_values['木材'] == before['木材']
+    assert state.resource_values['钻石'] == before['钻石'] + 1
+    assert len(events) == len(rules.ALL_RESOURCES) - 1
+    state.epoch += 1
+    assert rules.update_resource_values(state) == []
+
+def test_pirates_and_famine():
+    state = make_state(
+        a={'resources': {'金币': 3}, 'buildings': ['炮台']},
+        b={'resources': {'金币': 3, '食物': 3}},
+        c={'resources': {'食物': 1}},
+    )
+    events = rules.apply_event(state, '海盗掠夺')
+    assert events[0][1]['target']['players'] == ['c']
+    assert list(state.players) == ['a', 'b']
+    assert state.players['a'].buildings.count('炮台') == 0 and state.players['a'].resources['金币'] == 3
+    assert state.players['b'].resources['金币'] == 0
+    rules.apply_event(state, '天降饥荒')
+    assert list(state.players) == ['b'] and state.players['b'].resources['食物'] == 0
+
+def test_produce_on_entering_investment():
+    state = make_state(a={'buildings': ['农场', '伐木场'], 'action_points': 0})
+    state.market.extend(['木材'])
+    rules.enter_phase(state, 1)
+    player = state.players['a']
+    assert player.action_points == 2 and player.resources['木材'] == 1 and '木材' not in state.market
+    assert 'a' in state.exchanged
+
+def test_recipe_book_rejects_cycles_and_unknown_items():
+    with pytest.raises(ValueError):
+        rules.RecipeBook({'矿机': {'农场': 1}, '农场': {'矿机': 1}})
+    with pytest.raises(ValueError):
+        rules.RecipeBook({'矿机': {'石头': 1}})
+    book = rules.DEFAULT_RULESET.recipe_book
+    assert book.chain['高级矿机'] == ['铁镐', '矿机']
+    assert book.order.index('铁镐') < book.order.index('矿机') < book.order.index('高级矿机')
+
+def test_load_state_from_snapshot():
+    snapshot = {'epoch': 2, 'phase': 1, 'values': dict(rules.DEFAULT_RULESET.resource_values),
+                'market': ['铁'], 'players': {'a': {'resources': {'铁': 1}, 'action_points': 3,
+                                                    'buildings': ['银行'], 'bank_money': 4}}}
+    state = rules.load_state(snapshot)
+    assert state.epoch == 2 and state.market.to_list() == ['铁']
+    player = state.players['a']
+    assert player.resources['铁'] == 1 and '银行' in player.buildings and player.bank_money == 4
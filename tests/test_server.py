@@ -0,0 +1,198 @@
+"""
+服务器房间流程测试：玩家中途离开时，等待提交的阶段不能卡住
+运行: python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import journal
+import server
+import wire
+from state_replica import StateReplica
+
+class FakeConnection:
+    """记录发出的消息的连接，receive 直接抛出断开，模拟玩家断线"""
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, message, droppable=False):
+        self.sent.append(message.data)
+
+    async def send_json(self, data, droppable=False):
+        self.send_message(wire.Message(data), droppable)
+
+    async def receive(self):
+        raise WebSocketDisconnect(1006)
+
+    def close_nowait(self, code=1000, reason=''):
+        self.closed = True
+
+    async def close(self, code=1000, reason=''):
+        self.close_nowait(code, reason)
+
+    def abort(self, code=1011, reason=''):
+        self.closed = True
+
+@pytest.fixture(autouse=True)
+def no_timeout(monkeypatch):
+    # 不写日志；关闭超时，确认阶段是被离开的玩家唤醒的，而不是等到超时
+    monkeypatch.setattr(journal, "JOURNAL_DIR", "")
+    monkeypatch.setattr(server, "PHASE_TIMEOUT", 0)
+
+async def start(*names) -> server.Game:
+    game = server.Game('test', seed=0)
+    server.rooms.rooms[game.room_id] = game
+    for name in names:
+        game.state.players[name] = server.Player(ws=FakeConnection())
+    game.state.started = True
+    await game.start_game()
+    await wait_until(lambda: game.state.phase == 1)
+    return game
+
+async def wait_until(condition, timeout:float=2):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+async def submit(game:server.Game, player:str, msg_type:str, **data):
+    await game._handle_player_message(player, {"type": msg_type, "data": {"player": player, **data}})
+
+async def disconnect(game:server.Game, player:str):
+    await server._serve_player(game, player, game.state.players[player].ws)
+
+async def finish(game:server.Game):
+    game.finish()
+    await asyncio.sleep(0)
+
+def test_investment_ends_when_last_player_leaves():
+    async def run():
+        game = await start('a', 'b')
+        await submit(game, 'a', 'investment', investment='ok')
+        await asyncio.sleep(0.05)
+        assert game.state.phase == 1
+        await disconnect(game, 'b')
+        await wait_until(lambda: game.state.phase == 2)
+        # 进入竞标阶段后照常处理剩下玩家的出价
+        await submit(game, 'a', 'bidding', bid=0)
+        await wait_until(lambda: game.state.epoch == 2)
+        await finish(game)
+    asyncio.run(run())
+
+def test_bidding_ends_when_last_player_leaves():
+    async def run():
+        game = await start('a', 'b', 'c')
+        for name in ('a', 'b', 'c'):
+            await submit(game, name, 'investment', investment='ok')
+        await wait_until(lambda: game.state.phase == 2)
+        await submit(game, 'a', 'bidding', bid=0)
+        await submit(game, 'b', 'bidding', bid=0)
+        await asyncio.sleep(0.05)
+        assert game.state.phase == 2
+        await disconnect(game, 'c')
+        await wait_until(lambda: game.state.epoch == 2)
+        await finish(game)
+    asyncio.run(run())
+
+def test_take_moves_on_when_taker_leaves():
+    async def run():
+        game = await start('a', 'b')
+        for name in ('a', 'b'):
+            await submit(game, name, 'investment', investment='ok')
+        await wait_until(lambda: game.state.phase == 2)
+        for name in ('a', 'b'):
+            await submit(game, name, 'bidding', bid=1)
+        await wait_until(lambda: game._taking is not None)
+        taker = game._taking
+        other = 'b' if taker == 'a' else 'a'
+        await disconnect(game, taker)
+        await wait_until(lambda: game._taking == other)
+        await submit(game, other, 'bidding_wants', want='ok')
+        await wait_until(lambda: game.state.epoch == 2)
+        await finish(game)
+    asyncio.run(run())
+
+def test_deadline_wakes_phase_after_player_left():
+    async def run():
+        game = await start('a', 'b')
+        await submit(game, 'a', 'investment', investment='ok')
+        await asyncio.sleep(0.05)
+        # 绕过 leave 直接删掉玩家，只剩截止时间能唤醒阶段循环
+        game._rule("leave", player='b')
+        game._timed_out("investment", game.state.epoch)
+        await wait_until(lambda: game.state.phase == 2)
+        await finish(game)
+    asyncio.run(run())
+
+def test_restored_room_keeps_journaling(tmp_path, monkeypatch):
+    """保留完整记录（RSIARCHIVE）时，重启后恢复的房间继续写日志，结束后归档，归档的记录能完整重放"""
+    import replay
+    monkeypatch.setattr(journal, "JOURNAL_DIR", str(tmp_path / "journal"))
+    monkeypatch.setattr(journal, "ARCHIVE_DIR", str(tmp_path / "archive"))
+
+    async def run():
+        game = await start('a', 'b')
+        await submit(game, 'a', 'investment', investment='ok')
+        await asyncio.sleep(0.05)
+        path = game.journal.path
+        # 服务器关闭：保留日志
+        game.finish(keep_journal=True)
+        await asyncio.sleep(0)
+        size = os.path.getsize(path)
+
+        meta, snapshot, records = journal.read(path)
+        restored = server.Game(meta['room'], seed=meta['seed'])
+        restored.restore(path, meta, snapshot, records)
+        await wait_until(lambda: restored.state.phase == 1)
+        await submit(restored, 'b', 'investment', investment='ok')
+        await wait_until(lambda: restored.state.phase == 2)
+        await asyncio.sleep(0)
+        assert restored.journal._fd is not None
+        assert not restored.journal._buffer
+        assert os.path.getsize(path) > size
+
+        restored.finish()
+        await asyncio.sleep(0)
+        archived = list((tmp_path / "archive").iterdir())
+        assert len(archived) == 1 and not os.path.exists(path)
+        meta, records = replay.load(str(archived[0]))
+        state, checked = replay.run(meta, records)
+        assert checked >= 1
+        assert state.phase == 2 and state.finished == set()
+    asyncio.run(run())
+
+def test_event_follows_value_update_push():
+    """客户端收到 event_choiced 时，副本里已经是第3阶段价值波动之后的资源价值"""
+    async def run():
+        game = await start('a', 'b')
+        conn = game.state.players['a'].ws
+        await game.send_full_state(conn)
+        while game.state.epoch <= 3:
+            epoch = game.state.epoch
+            for name in ('a', 'b'):
+                await submit(game, name, 'investment', investment='ok')
+            await wait_until(lambda: game.state.phase == 2)
+            for name in ('a', 'b'):
+                await submit(game, name, 'bidding', bid=0)
+            await wait_until(lambda: game.state.epoch > epoch)
+        await finish(game)
+
+        replica, values, checked = StateReplica(), {}, 0
+        for message in conn.sent:
+            target = message['target']
+            if message['type'] == 'state':
+                assert replica.apply(target)
+            elif target['type'] == 'value_changed':
+                values[target['resource']] = target['value']
+            elif target['type'] == 'event_choiced':
+                assert values and all(replica.state['values'][k] == v for k, v in values.items())
+                checked += 1
+        assert checked == 1
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+"""
+排行榜测试：增量维护的得分和每次从头计算的结果一致
+运行: python -m pytest -q tests
+"""
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rules
+import valuation
+
+class Player(valuation.ScoredPlayer, rules.PlayerState):
+    __slots__ = ('_leaderboard', '_name')
+
+    def __init__(self, **state):
+        self._leaderboard = None
+        self._name = None
+        super().__init__(**state)
+
+def from_scratch(board:valuation.Leaderboard):
+    players = {name: {'resources': p.resources, 'buildings': list(p.buildings), 'bank_money': p.bank_money}
+               for name, p in board.items()}
+    return valuation.leaderboard(players, board.resource_values)
+
+def test_ranks_share_ties():
+    assert valuation.ranks(np.array([5, 9, 5, 1])).tolist() == [2, 1, 2, 4]
+
+def test_leaderboard_scores():
+    values = {'铁': 2, '钻石': 8}
+    ranking = valuation.leaderboard({
+        'a': {'resources': {'铁': 1}, 'buildings': ['农场'], 'bank_money': 0},
+        'b': {'resources': {'钻石': 1}, 'buildings': [], 'bank_money': 1},
+    }, dict(rules.DEFAULT_RULESET.resource_values, **values))
+    assert ranking == [
+        {'player': 'b', 'score': 8 + valuation.BANK_MONEY_VALUE, 'rank': 1},
+        {'player': 'a', 'score': 2 + valuation.BUILDING_VALUE, 'rank': 2},
+    ]
+    assert valuation.leaderboard({}, values) == []
+
+def test_incremental_scores_match_from_scratch():
+    rng = random.Random(0)
+    board = valuation.Leaderboard(rules.DEFAULT_RULESET.resource_values)
+    for i in range(5):
+        board[f'p{i}'] = Player(resources={'食物': 10})
+    for step in range(500):
+        name = rng.choice(list(board))
+        player = board[name]
+        match rng.randrange(7):
+            case 0:
+                player.resources[rng.choice(rules.ALL_RESOURCES)] += rng.randint(-2, 3)
+            case 1:
+                player.buildings.append(rng.choice(rules.ALL_BUILDINGS))
+            case 2:
+                if player.buildings:
+                    player.buildings.remove(rng.choice(player.buildings.to_list()))
+            case 3:
+                player.bank_money += rng.randint(0, 5)
+            case 4:
+                board.resource_values[rng.choice(rules.ALL_RESOURCES)] += rng.choice([-1, 1])
+            case 5:
+                # 整个换掉容器也要重新计分
+                player.resources = rules.Inventory({res: rng.randint(0, 4) for res in rules.ALL_RESOURCES})
+            case 6:
+                if len(board) > 2:
+                    del board[name]
+                else:
+                    board[f'n{step}'] = Player()
+        assert board.ranking() == from_scratch(board)
+
+def test_removed_player_is_detached():
+    board = valuation.Leaderboard(rules.DEFAULT_RULESET.resource_values)
+    board['a'] = player = Player()
+    board['b'] = Player()
+    board.pop('a')
+    player.resources['钻石'] += 5
+    player.bank_money = 10
+    assert 'a' not in board.scores
+    assert board.ranking() == from_scratch(board)
+    # 复制出来的玩家不属于任何排行榜
+    clone = board['b'].copy()
+    clone.resources['钻石'] += 1
+    assert board.ranking() == from_scratch(board)
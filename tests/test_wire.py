@@ -0,0 +1,66 @@
+"""
+消息编码测试：JSON 和 msgpack 两种编码解出来的消息一样
+运行: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wire
+
+needs_msgpack = pytest.mark.skipif(wire.MSGPACK is None, reason="没有安装 msgpack")
+
+@needs_msgpack
+def test_msgpack_accepts_int_keys():
+    # 投资操作可以用下标作键，JSON 会把键转成字符串，msgpack 保留整数
+    message = {"type": "investment", "data": {"player": "a", "investment": {3: "木材"}}}
+    assert wire.decode(wire.MSGPACK.encode(message)) == message
+    assert wire.decode(wire.JSON.encode(message))["data"]["investment"] == {"3": "木材"}
+
+def test_binary_frame_without_msgpack(monkeypatch):
+    monkeypatch.setattr(wire, "MSGPACK", None)
+    with pytest.raises(ValueError):
+        wire.decode(b"\x80")
+    assert wire.subprotocols("msgpack") is None
+    assert wire.negotiate([wire.MSGPACK_PROTOCOL]) is None
+
+MESSAGES = [
+    {"type": "notify", "target": {"type": "value_changed", "resource": "铁", "value": 3}},
+    {"type": "state", "target": {"type": "delta", "base": 1, "version": 2, "changes": {
+        "players": {"a": {"resources": {"金币": 1, "铁": 0}, "buildings": ["农场", "农场"], "bank_money": 0}},
+        "removed_players": ["b"], "market": ["木材", "钻石"]}}},
+    {"type": "error", "target": {"type": "investment_error", "action": {"6": [0, "铁"]}, "reason": 3}},
+    {"unknown": ["不在符号表里的字符串", 1.5, None, True]},
+]
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_json_round_trip(message):
+    frame = wire.JSON.encode(message)
+    assert isinstance(frame, str) and wire.decode(frame) == message
+
+@needs_msgpack
+@pytest.mark.parametrize("message", MESSAGES)
+def test_msgpack_round_trip(message):
+    frame = wire.MSGPACK.encode(message)
+    assert isinstance(frame, bytes) and wire.decode(frame) == message
+
+@needs_msgpack
+def test_msgpack_interns_symbols():
+    message = MESSAGES[1]
+    # 符号表里的字符串编码成3字节的扩展类型，比 JSON 小得多
+    assert len(wire.MSGPACK.encode(message)) < len(wire.JSON.encode(message).encode()) / 2
+    assert wire.negotiate(["other", wire.MSGPACK_PROTOCOL]) == wire.MSGPACK_PROTOCOL
+    assert wire.codec_for(wire.MSGPACK_PROTOCOL) is wire.MSGPACK
+    assert wire.subprotocols("msgpack") == [wire.MSGPACK_PROTOCOL]
+
+def test_default_is_json():
+    assert wire.negotiate([]) is None and wire.codec_for(None) is wire.JSON
+    assert wire.subprotocols("json") is None
+
+def test_message_encodes_once_per_codec():
+    message = wire.Message(MESSAGES[0])
+    assert message.frame(wire.JSON) is message.frame(wire.JSON)
+    if wire.MSGPACK is not None:
+        assert wire.decode(message.frame(wire.MSGPACK)) == MESSAGES[0]
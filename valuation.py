@@ -0,0 +1,193 @@
+"""
+玩家价值和排名（服务器、观战器、模拟器共用同一套算法）
+价值 = 各资源数量 × 当前资源价值 + 建筑数 × BUILDING_VALUE + 银行存款 × BANK_MONEY_VALUE
+所有玩家的库存排成 玩家 × 资源 的整数矩阵，和资源价值向量一次算出全部得分和名次。
+服务器用 Leaderboard 在每次修改时增量维护得分，不用每次推送都从头计算
+"""
+import functools
+from typing import Callable, Dict, Iterable, List, Mapping
+
+import numpy as np
+
+import rules
+
+BUILDING_VALUE = 4          # 每个建筑折算的价值
+BANK_MONEY_VALUE = 2        # 存进银行的数额翻倍计算
+
+RESOURCE_INDEX = rules.RESOURCE_INDEX
+
+def value_vector(values:Mapping[str, int]) -> np.ndarray:
+    """按 rules.ALL_RESOURCES 的顺序排列的资源价值"""
+    return np.array([values[res] for res in rules.ALL_RESOURCES], dtype=np.int64)
+
+def inventory_matrix(inventories:Iterable[Mapping[str, int]]) -> np.ndarray:
+    """
+    每个玩家一行，每种资源一列，不是资源的物品忽略
+    :param inventories: 各玩家的 resources
+    """
+    rows = []
+    for resources in inventories:
+        row = [0] * len(RESOURCE_INDEX)
+        for res, qty in resources.items():
+            i = RESOURCE_INDEX.get(res)
+            if i is not None:
+                row[i] = qty
+        rows.append(row)
+    return np.array(rows, dtype=np.int64).reshape(len(rows), len(RESOURCE_INDEX))
+
+def scores(inventory:np.ndarray, values:np.ndarray, buildings:np.ndarray, bank_money:np.ndarray) -> np.ndarray:
+    """
+    inventory 的最后一维是资源，前面可以有任意批次维度，
+    例如模拟器一次传入 对局 × 座位 × 资源，对应 values 为 对局 × 资源
+    :return: 和 buildings 形状相同的得分
+    """
+    return ((inventory * values[..., np.newaxis, :]).sum(axis=-1)
+            + buildings * BUILDING_VALUE + bank_money * BANK_MONEY_VALUE)
+
+def ranks(score:np.ndarray) -> np.ndarray:
+    """名次从1开始，得分相同名次相同（1, 1, 3）"""
+    ordered = -np.sort(score)[::-1]
+    return np.searchsorted(ordered, -score, side='left') + 1
+
+def leaderboard(players:Mapping[str, Mapping], values:Mapping[str, int]) -> List[Dict]:
+    """
+    :param players: 玩家名 -> {resources, buildings, bank_money}，即房间状态里 players 的格式
+    :return: 按得分从高到低排列的 [{player, score, rank}]，得分相同时保持 players 中的顺序
+    """
+    if not players:
+        return []
+    names = list(players)
+    data = players.values()
+    score = scores(inventory_matrix(x['resources'] for x in data), value_vector(values),
+                   np.array([len(x['buildings']) for x in data], dtype=np.int64),
+                   np.array([x['bank_money'] for x in data], dtype=np.int64))
+    return _ranking(names, score)
+
+def _ranking(names:List[str], score:np.ndarray) -> List[Dict]:
+    rank = ranks(score)
+    return [{"player": names[i], "score": int(score[i]), "rank": int(rank[i])}
+            for i in np.argsort(-score, kind='stable')]
+
+class _Values(dict):
+    """资源价值，某种资源价值变化时把 (资源, 差值) 报告给排行榜"""
+    def __init__(self, on_change:Callable[[str, int], None], items=()):
+        super().__init__(items)
+        self._on_change = on_change
+
+    def __setitem__(self, res, value):
+        delta = value - self.get(res, 0)
+        super().__setitem__(res, value)
+        if delta:
+            self._on_change(res, delta)
+
+    def update(self, *args, **kwargs):
+        for res, value in dict(*args, **kwargs).items():
+            self[res] = value
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+class ScoredPlayer:
+    """
+    玩家类的混入：加入 Leaderboard 后，给 resources、buildings、bank_money 重新赋值也会更新得分
+    （resources 和 buildings 内部的修改由 Leaderboard 设置的 on_change 负责报告）
+    玩家类要在 __slots__ 里声明 _leaderboard 和 _name
+    """
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        old = getattr(self, key, None) if key == 'bank_money' else None
+        super().__setattr__(key, value)
+        leaderboard = getattr(self, '_leaderboard', None)
+        if leaderboard is None:
+            return
+        if key == 'bank_money':
+            leaderboard._adjust(self._name, (value - old) * BANK_MONEY_VALUE)
+        elif key in ('resources', 'buildings'):
+            leaderboard._rescore(self._name)
+
+    def __getstate__(self):
+        # 复制或序列化出去的玩家不再属于任何排行榜
+        state, slots = super().__getstate__()
+        return state, {k: v for k, v in slots.items() if k not in ('_leaderboard', '_name')}
+
+class Leaderboard(dict):
+    """
+    房间里 玩家名 -> 玩家 的字典，同时增量维护每个玩家的得分：
+        资源、建筑、存款变化时只按差值调整这个玩家的得分，O(1)
+        某种资源的价值变化时按各玩家持有的数量调整所有人的得分，O(玩家数)
+        排好序的排行榜缓存到下一次得分变化，读取是 O(1)
+    玩家需要混入 ScoredPlayer，资源价值要使用 resource_values 属性。
+    玩家加入时 resources 和 buildings 换成带 on_change 的 rules.Inventory 和 rules.Buildings
+    :param values: 初始的资源价值
+    """
+    def __init__(self, values:Mapping[str, int]):
+        super().__init__()
+        self.resource_values = _Values(self._value_changed, values)
+        self.scores: Dict[str, int] = {}
+        self._ranking = []
+
+    def __setitem__(self, name, player:ScoredPlayer):
+        if name in self:
+            self._detach(name)
+        super().__setitem__(name, player)
+        object.__setattr__(player, '_leaderboard', self)
+        object.__setattr__(player, '_name', name)
+        self._rescore(name)
+
+    def __delitem__(self, name):
+        self._detach(name)
+        super().__delitem__(name)
+        del self.scores[name]
+        self._ranking = None
+
+    def pop(self, name, *default):
+        if name not in self:
+            return super().pop(name, *default)
+        player = self[name]
+        del self[name]
+        return player
+
+    def _detach(self, name):
+        # 离开排行榜的玩家对象可能还会被修改（例如被替换掉的旧对象），不再向这里报告
+        player = self[name]
+        object.__setattr__(player, '_leaderboard', None)
+        player.resources.on_change = None
+        player.buildings.on_change = None
+
+    def _rescore(self, name):
+        """换上会报告变化的容器并重新计算一个玩家的得分，O(资源种类)"""
+        player = self[name]
+        object.__setattr__(player, 'resources', rules.Inventory(
+            player.resources, on_change=functools.partial(self._resource_changed, name)))
+        object.__setattr__(player, 'buildings', rules.Buildings(
+            player.buildings, on_change=functools.partial(self._buildings_changed, name)))
+        self.scores[name] = (sum(self.resource_values.get(res, 0) * qty for res, qty in player.resources.items())
+                             + len(player.buildings) * BUILDING_VALUE + player.bank_money * BANK_MONEY_VALUE)
+        self._ranking = None
+
+    def _adjust(self, name, delta:int):
+        if delta:
+            self.scores[name] += delta
+            self._ranking = None
+
+    def _resource_changed(self, name, res, delta):
+        self._adjust(name, self.resource_values.get(res, 0) * delta)
+
+    def _buildings_changed(self, name, delta):
+        self._adjust(name, delta * BUILDING_VALUE)
+
+    def _value_changed(self, res, delta):
+        index = RESOURCE_INDEX.get(res)
+        if index is not None:
+            scores = self.scores
+            for name, player in self.items():
+                scores[name] += delta * player.resources.counts[index]
+        self._ranking = None
+
+    def ranking(self) -> List[Dict]:
+        """和 leaderboard() 格式相同的排行榜，只在得分变化后的第一次读取时排序"""
+        if self._ranking is None:
+            names = list(self.scores)
+            self._ranking = _ranking(names, np.fromiter(self.scores.values(), dtype=np.int64, count=len(names)))
+        return self._ranking
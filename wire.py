@@ -0,0 +1,142 @@
+"""
+WebSocket 消息的编码（服务器、客户端和机器人共用）
+默认是 JSON 文本帧，和以前完全一样。客户端握手时在子协议（Sec-WebSocket-Protocol）里请求 MSGPACK_PROTOCOL，
+服务器同意后这个连接改用 msgpack 二进制帧：消息结构不变，但消息类型、字段名、资源名、建筑名、事件名这些
+反复出现的字符串换成 SYMBOLS 里的编号（msgpack 扩展类型 SYMBOL_EXT，每个3字节，一个中文资源名要7字节）。
+文本帧一定是 JSON，二进制帧一定是 msgpack，接收方用 decode 不需要知道协商结果。
+服务器没有安装 msgpack 时不接受这个子协议，客户端自动退回 JSON
+"""
+from typing import Dict, List, Optional, Union
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:     # msgpack 是可选依赖
+    msgpack = None
+
+MSGPACK_PROTOCOL = "rsi.msgpack.1"
+SYMBOL_EXT = 0
+
+# 符号表只能在末尾追加，改动已有的编号必须换一个协议名
+SYMBOLS = (
+    # 消息外层
+    "type", "target", "notify", "error", "state", "full", "delta",
+    # 通知类型
+    "game_start", "phase_changed", "data_required", "bidding_sorted", "building_worked",
+    "investment_success", "investment_error", "bidding_success", "bidding_error",
+    "value_changed", "died_players", "event_choiced", "market_error", "market_empty",
+    "player_join", "player_left", "game_over", "kicked", "server_stop",
+    "command", "cmd_syntax_error", "permission_denied",
+    # 字段名
+    "epoch", "phase", "player", "players", "action", "reason", "building", "resource", "value",
+    "sorted", "event", "version", "base", "changes", "removed_players", "started", "market",
+    "values", "action_points", "resources", "buildings", "bank_money", "leaderboard", "score", "rank",
+    "data", "investment", "bid", "want", "bidding", "bidding_wants",
+    # 资源、建筑、事件
+    "金币", "木材", "矿石", "食物", "钻石", "铁",
+    "矿机", "农场", "伐木场", "铁镐", "农田", "高级伐木场", "高级矿机", "无敌农场", "银行", "炮台",
+    "火山爆发", "海盗掠夺", "天降饥荒", "出现宝藏", "祝福事件",
+    # 批量投资
+    "investments", "investment_results", "results",
+)
+assert len(SYMBOLS) <= 256 and len(set(SYMBOLS)) == len(SYMBOLS)
+
+Frame = Union[str, bytes]
+
+class JsonCodec:
+    """用 orjson 编解码，格式和以前的 json.dumps 一样紧凑、中文不转义"""
+    name = "json"
+    binary = False
+
+    def encode(self, data) -> str:
+        # ASGI 的文本帧只接受 str
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def decode(self, frame:Frame):
+        return orjson.loads(frame)
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        self._symbols = {s: msgpack.ExtType(SYMBOL_EXT, bytes([i])) for i, s in enumerate(SYMBOLS)}
+
+        self._packer = msgpack.Packer()
+
+    def _intern(self, obj):
+        # 绝大多数节点是普通的 str/dict/list，先按精确类型判断，子类（defaultdict 等）再走 isinstance
+        kind = type(obj)
+        if kind is str:
+            return self._symbols.get(obj, obj)
+        if kind is dict or isinstance(obj, dict):
+            symbols = self._symbols
+            return {symbols.get(k, k) if type(k) is str else k: self._intern(v) for k, v in obj.items()}
+        if kind is list or isinstance(obj, (list, tuple)):
+            return [self._intern(x) for x in obj]
+        return obj
+
+    def encode(self, data) -> bytes:
+        return self._packer.pack(self._intern(data))
+
+    @staticmethod
+    def _ext_hook(code:int, payload:bytes):
+        if code != SYMBOL_EXT:
+            return msgpack.ExtType(code, payload)
+        return SYMBOLS[payload[0]]
+
+    def decode(self, frame:Frame):
+        # 和 JSON 一样接受非字符串的键（例如以下标为键的投资操作 {3: 'xxx'}）
+        return msgpack.unpackb(frame, ext_hook=self._ext_hook, strict_map_key=False)
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec() if msgpack is not None else None
+
+def negotiate(offered:List[str]) -> Optional[str]:
+    """
+    服务器端握手
+    :param offered: 客户端请求的子协议
+    :return: 要接受的子协议，None 表示使用默认的 JSON
+    """
+    if MSGPACK is not None and MSGPACK_PROTOCOL in offered:
+        return MSGPACK_PROTOCOL
+    return None
+
+def codec_for(subprotocol:Optional[str]):
+    return MSGPACK if subprotocol == MSGPACK_PROTOCOL else JSON
+
+def subprotocols(name:str) -> Optional[List[str]]:
+    """
+    客户端握手时请求的子协议
+    :param name: 'json' 或 'msgpack'，本地没有安装 msgpack 时只能用 JSON
+    :return: None 表示不请求子协议（默认的 JSON）
+    """
+    if name == "msgpack" and MSGPACK is not None:
+        return [MSGPACK_PROTOCOL]
+    return None
+
+def decode(frame:Frame):
+    """按帧类型解码：二进制帧是 msgpack，文本帧是 JSON；没有安装 msgpack 时收到二进制帧抛出 ValueError"""
+    if isinstance(frame, (bytes, bytearray)):
+        if MSGPACK is None:
+            raise ValueError("收到 msgpack 二进制帧，但没有安装 msgpack")
+        return MSGPACK.decode(frame)
+    return JSON.decode(frame)
+
+class Message:
+    """
+    一条可能要发给很多连接的消息，每种编码第一次用到时编码一次，之后直接复用
+    :param data: 消息内容，编码之后不能再修改
+    """
+    __slots__ = ("data", "_frames")
+
+    def __init__(self, data:Dict):
+        self.data = data
+        self._frames = {}
+
+    def frame(self, codec) -> Frame:
+        frame = self._frames.get(codec.name)
+        if frame is None:
+            frame = self._frames[codec.name] = codec.encode(self.data)
+        return frame